@@ -0,0 +1,130 @@
+"""
+Checks that adaptive downscaling (DETECTION_MAX_SIDE) finds the same letters
+as full-resolution detection, and how much time it saves.
+
+The fixture set is generated: dark lettering on a light, noisy, slightly
+blurred background at phone-photo and scan resolutions, saved as PNG and
+JPEG. Phone photos are also saved as JPEGs stored sideways with an EXIF
+orientation, as phones do. Extra image files can be passed on the command
+line.
+
+Usage: python benchmarks/detection_accuracy.py [image ...]
+"""
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import cv2
+import numpy as np
+import extraction
+from letter_table import LetterTable
+
+FIXTURE_SIZES = [(1200, 400), (1600, 1200), (2480, 1200), (4000, 3000), (5000, 3000), (6000, 4000), (9000, 2500)]
+# Sizes also saved sideways, with the EXIF orientation (6: turn 90° clockwise) that shows them upright
+ROTATED_FIXTURE_SIZES = [(1600, 1200), (4000, 3000)]
+EXIF_ORIENTATION = 0x0112
+FIXTURE_TEXT = "OPEN 24H"
+TARGET = (200, 100)  # cm, as in the API defaults
+
+
+def make_fixtures(directory):
+    rng = np.random.default_rng(0)
+    paths = []
+    for width, height in FIXTURE_SIZES:
+        image = np.full((height, width, 3), 235, np.uint8)
+        scale = width / 260
+        thickness = max(2, int(scale * 2))
+        (text_width, text_height), _ = cv2.getTextSize(FIXTURE_TEXT, cv2.FONT_HERSHEY_SIMPLEX, scale, thickness)
+        origin = ((width - text_width) // 2, (height + text_height) // 2)
+        cv2.putText(image, FIXTURE_TEXT, origin, cv2.FONT_HERSHEY_SIMPLEX, scale, (30, 30, 30), thickness)
+        image = cv2.GaussianBlur(image, (5, 5), 0)
+        image = np.clip(image + rng.normal(0, 6, image.shape), 0, 255).astype(np.uint8)
+        for extension in (".png", ".jpg"):
+            path = os.path.join(directory, f"sign-{width}x{height}{extension}")
+            cv2.imwrite(path, image)
+            paths.append(path)
+        if (width, height) in ROTATED_FIXTURE_SIZES:
+            paths.append(save_rotated(image, os.path.join(directory, f"sign-{width}x{height}-exif6.jpg")))
+    return paths
+
+
+def save_rotated(image, path):
+    """Saves the image turned a quarter left, tagged so that viewers turn it back."""
+    from PIL import Image
+
+    sideways = cv2.cvtColor(cv2.rotate(image, cv2.ROTATE_90_COUNTERCLOCKWISE), cv2.COLOR_BGR2RGB)
+    exif = Image.Exif()
+    exif[EXIF_ORIENTATION] = 6
+    Image.fromarray(sideways).save(path, quality=90, exif=exif)
+    return path
+
+
+def full_resolution(path):
+    """The detection path before adaptive downscaling: BGR decode, no resizing."""
+    max_side, extraction.DETECTION_MAX_SIDE = extraction.DETECTION_MAX_SIDE, 0
+    try:
+        return extraction.find_letter_boxes(cv2.imread(path, cv2.IMREAD_COLOR))
+    finally:
+        extraction.DETECTION_MAX_SIDE = max_side
+
+
+def adaptive(path):
+    image, source_size = extraction.load_image(path)
+    return extraction.find_letter_boxes(image, source_size)
+
+
+def timed(func, path, repeat=3):
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func(path)
+        best = min(best, time.perf_counter() - started)
+    return result, best
+
+
+def iou(a, b):
+    ax, ay, aw, ah = a
+    bx, by, bw, bh = b
+    overlap_w = max(0, min(ax + aw, bx + bw) - max(ax, bx))
+    overlap_h = max(0, min(ay + ah, by + bh) - max(ay, by))
+    overlap = overlap_w * overlap_h
+    return overlap / (aw * ah + bw * bh - overlap)
+
+
+def scaled(boxes):
+    letters = LetterTable.from_boxes(boxes).scale_boxes(*TARGET)
+    return letters.scaled_length, letters.scaled_height
+
+
+def compare(path):
+    reference, reference_time = timed(full_resolution, path)
+    candidate, candidate_time = timed(adaptive, path)
+
+    same_count = len(reference) == len(candidate)
+    min_iou = min((iou(a, b) for a, b in zip(reference, candidate)), default=1.0) if same_count else 0.0
+    max_size_error = 0
+    if same_count and len(reference):
+        (ref_lengths, ref_heights), (lengths, heights) = scaled(reference), scaled(candidate)
+        max_size_error = int(max(np.abs(ref_lengths - lengths).max(), np.abs(ref_heights - heights).max()))
+
+    ok = same_count and min_iou >= 0.9 and max_size_error <= 1
+    print(
+        f"{os.path.basename(path):<24}{len(reference):>6}{len(candidate):>6}{min_iou:>9.3f}{max_size_error:>7}cm"
+        f"{reference_time * 1000:>10.1f}ms{candidate_time * 1000:>10.1f}ms  {'ok' if ok else 'MISMATCH'}"
+    )
+    return ok
+
+
+def main(paths):
+    print(f"DETECTION_MAX_SIDE={extraction.DETECTION_MAX_SIDE}")
+    print(f"{'image':<24}{'full':>6}{'fast':>6}{'min IoU':>9}{'size':>9}{'full':>12}{'fast':>12}")
+    with tempfile.TemporaryDirectory() as directory:
+        results = [compare(path) for path in (paths or make_fixtures(directory))]
+    return 0 if all(results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
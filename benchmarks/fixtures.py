@@ -0,0 +1,108 @@
+"""
+Deterministic fixture corpora for the benchmarks, generated on demand:
+text-only PDFs of several glyph counts, the same text converted to
+outlines, PDFs with embedded raster images and large PNG/JPEG scans.
+"""
+import os
+import cv2
+import fitz  # PyMuPDF
+import numpy as np
+
+TEXT_PDF_GLYPHS = (10, 100, 1000, 5000)
+OUTLINED_PDF_GLYPHS = (100, 1000)
+IMAGE_PDF_IMAGES = (1, 4)
+SCAN_SIZES = ((2480, 3508), (6000, 4000))  # A4 at 300 dpi, 24 MP phone photo
+
+_WORDS = ("OPEN", "SIGN", "BAKERY", "CAFE", "24H", "STUDIO", "SALE", "LUX")
+
+
+def _sign_image(width, height, text, seed):
+    rng = np.random.default_rng(seed)
+    image = np.full((height, width, 3), 235, np.uint8)
+    scale = width / (len(text) * 34)
+    thickness = max(2, int(scale * 2))
+    (text_width, text_height), _ = cv2.getTextSize(text, cv2.FONT_HERSHEY_SIMPLEX, scale, thickness)
+    origin = ((width - text_width) // 2, (height + text_height) // 2)
+    cv2.putText(image, text, origin, cv2.FONT_HERSHEY_SIMPLEX, scale, (30, 30, 30), thickness)
+    image = cv2.GaussianBlur(image, (5, 5), 0)
+    return np.clip(image + rng.normal(0, 6, image.shape), 0, 255).astype(np.uint8)
+
+
+def _text_doc(glyphs):
+    doc = fitz.open()
+    page = doc.new_page()
+    written, line, y = 0, [], 60
+    for index in range(glyphs * 2):
+        word = _WORDS[index % len(_WORDS)]
+        if written + len(word) > glyphs:
+            word = word[: glyphs - written]
+        if not word:
+            break
+        line.append(word)
+        written += len(word)
+        if len(line) == 6 or written == glyphs:
+            if y > page.rect.height - 40:
+                page, y = doc.new_page(), 60
+            page.insert_text((40, y), " ".join(line), fontsize=18 + (y // 60) % 3 * 6)
+            line, y = [], y + 32
+        if written == glyphs:
+            break
+    return doc
+
+
+def _text_pdf(path, glyphs):
+    _text_doc(glyphs).save(path)
+
+
+def _outlined_pdf(path, glyphs):
+    """The text PDF with every glyph converted to a filled path, as design tools export it."""
+    doc = fitz.open()
+    for page in _text_doc(glyphs):
+        svg = page.get_svg_image(text_as_path=True)
+        doc.insert_pdf(fitz.open("pdf", fitz.open("svg", svg.encode()).convert_to_pdf()))
+    doc.save(path)
+
+
+def _image_pdf(path, images):
+    doc = fitz.open()
+    page = doc.new_page()
+    for index in range(images):
+        _, png = cv2.imencode(".png", _sign_image(1600, 500, _WORDS[index % len(_WORDS)], index))
+        top = 40 + index * 190
+        page.insert_image(fitz.Rect(40, top, 560, top + 170), stream=png.tobytes())
+    doc.save(path)
+
+
+def ensure_fixtures(directory):
+    """Writes any missing fixture into `directory` and returns {name: (path, content_type)}."""
+    os.makedirs(directory, exist_ok=True)
+    fixtures = {}
+
+    for glyphs in TEXT_PDF_GLYPHS:
+        path = os.path.join(directory, f"text-{glyphs}.pdf")
+        if not os.path.exists(path):
+            _text_pdf(path, glyphs)
+        fixtures[f"text-{glyphs}"] = (path, "application/pdf")
+
+    for glyphs in OUTLINED_PDF_GLYPHS:
+        path = os.path.join(directory, f"outlined-{glyphs}.pdf")
+        if not os.path.exists(path):
+            _outlined_pdf(path, glyphs)
+        fixtures[f"outlined-{glyphs}"] = (path, "application/pdf")
+
+    for images in IMAGE_PDF_IMAGES:
+        path = os.path.join(directory, f"images-{images}.pdf")
+        if not os.path.exists(path):
+            _image_pdf(path, images)
+        fixtures[f"images-{images}"] = (path, "application/pdf")
+
+    for width, height in SCAN_SIZES:
+        scan = None
+        for extension, content_type in ((".png", "image/png"), (".jpg", "image/jpeg")):
+            path = os.path.join(directory, f"scan-{width}x{height}{extension}")
+            if not os.path.exists(path):
+                scan = scan if scan is not None else _sign_image(width, height, "OPEN 24H", width)
+                cv2.imwrite(path, scan)
+            fixtures[f"scan-{width}x{height}-{extension[1:]}"] = (path, content_type)
+
+    return fixtures
@@ -0,0 +1,159 @@
+"""
+Checks that strip-wise detection (TILE_MEMORY_LIMIT) finds the same boxes
+as whole-image detection on very large banner scans, and how much memory
+each needs.
+
+Fixtures are long signs at banner-scan sizes, saved as PNG and JPEG. Every
+run is a fresh process that calls detect_letter_boxes once, both at the
+default DETECTION_MAX_SIDE and at full resolution (DETECTION_MAX_SIDE=0).
+The report gives:
+- the box count, and whether the boxes equal the whole-image ones;
+- the time;
+- peak RSS, which includes pages of the memory-mapped decode buffer the
+  OS may page out again;
+- peak anonymous memory, sampled, which only the process itself can free.
+
+Usage: python benchmarks/large_images.py [--sizes 20000x5000 ...] [--limit 256]
+"""
+import argparse
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCHMARKS_DIR)
+sys.path.insert(0, REPO_DIR)
+
+DEFAULT_SIZES = ("10000x2500", "20000x5000", "40000x10000")
+DEFAULT_FIXTURES_DIR = os.path.join(tempfile.gettempdir(), "letter-benchmark-fixtures")
+BANNER_TEXT = "GRAND OPENING SALE"
+# A limit no fixture reaches, so detection runs on the whole image
+UNLIMITED = str(1 << 50)
+
+
+def banner(path, width, height):
+    """Dark lettering on a light, noisy background, with a cut line below it."""
+    import cv2
+    import numpy as np
+
+    image = np.full((height, width), 235, np.uint8)
+    scale = width / (len(BANNER_TEXT) * 34)
+    thickness = max(2, int(scale * 2))
+    (text_width, text_height), _ = cv2.getTextSize(BANNER_TEXT, cv2.FONT_HERSHEY_SIMPLEX, scale, thickness)
+    origin = ((width - text_width) // 2, (height + text_height) // 2)
+    cv2.putText(image, BANNER_TEXT, origin, cv2.FONT_HERSHEY_SIMPLEX, scale, 30, thickness)
+    cv2.line(image, (0, height - height // 40), (width, height - height // 40), 60, 3)
+    # Noise a strip at a time, so generating the fixture does not need float copies of the whole image
+    rng = np.random.default_rng(width)
+    for top in range(0, height, 1024):
+        rows = image[top:top + 1024]
+        rows[:] = np.clip(rows + rng.normal(0, 6, rows.shape).astype(np.int16), 0, 255)
+    cv2.imwrite(path, image)
+
+
+def ensure_banners(directory, sizes):
+    os.makedirs(directory, exist_ok=True)
+    fixtures = []
+    for size in sizes:
+        width, height = map(int, size.split("x"))
+        for extension, content_type in ((".png", "image/png"), (".jpg", "image/jpeg")):
+            path = os.path.join(directory, f"banner-{size}{extension}")
+            if not os.path.exists(path):
+                banner(path, width, height)
+            fixtures.append((f"banner-{size}-{extension[1:]}", path, content_type))
+    return fixtures
+
+
+def _status_kb(field):
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith(field + ":"):
+                return int(line.split()[1])
+    return 0
+
+
+def run_worker(path, content_type):
+    """Runs detect_letter_boxes once in this process and prints its boxes and memory as JSON."""
+    from extraction import detect_letter_boxes
+
+    peak_anon = _status_kb("RssAnon")
+    done = threading.Event()
+
+    def sample():
+        nonlocal peak_anon
+        while not done.wait(0.002):
+            peak_anon = max(peak_anon, _status_kb("RssAnon"))
+
+    sampler = threading.Thread(target=sample, daemon=True)
+    sampler.start()
+    started = time.perf_counter()
+    _, table = detect_letter_boxes(path, content_type)
+    elapsed = time.perf_counter() - started
+    done.set()
+    sampler.join()
+
+    boxes = [table.x.tolist(), table.y.tolist(), table.widths.tolist(), table.heights.tolist()]
+    print(json.dumps({
+        "boxes": len(table),
+        "digest": hashlib.sha256(json.dumps(boxes).encode()).hexdigest(),
+        "seconds": elapsed,
+        "peak_rss_mb": _status_kb("VmHWM") / 1024,
+        "peak_anon_mb": max(peak_anon, _status_kb("RssAnon")) / 1024,
+    }))
+
+
+def measure(path, content_type, env):
+    completed = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--worker", path, content_type],
+        env={**os.environ, **env}, cwd=REPO_DIR, capture_output=True, text=True,
+    )
+    if completed.returncode != 0:
+        raise RuntimeError(completed.stderr.strip().splitlines()[-1] if completed.stderr.strip() else "failed")
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", nargs="+", default=DEFAULT_SIZES, help="banner sizes as WIDTHxHEIGHT")
+    parser.add_argument("--limit", type=int, default=256, help="TILE_MEMORY_LIMIT of the tiled runs, in MB")
+    parser.add_argument("--fixtures", default=DEFAULT_FIXTURES_DIR, help="directory for generated fixtures")
+    parser.add_argument("--worker", nargs=2, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(*args.worker)
+        return 0
+
+    print(f"tiled runs at TILE_MEMORY_LIMIT={args.limit} MB")
+    print(
+        f"{'fixture':<26}{'max side':>9}{'mode':>7}{'boxes':>7}{'same':>6}"
+        f"{'time':>10}{'peak RSS':>12}{'peak anon':>12}"
+    )
+    same = True
+    for name, path, content_type in ensure_banners(args.fixtures, args.sizes):
+        for max_side in ("2000", "0"):
+            results = {}
+            for mode, limit in (("whole", UNLIMITED), ("tiled", str(args.limit * 1024 * 1024))):
+                env = {"DETECTION_MAX_SIDE": max_side, "TILE_MEMORY_LIMIT": limit}
+                try:
+                    results[mode] = measure(path, content_type, env)
+                except RuntimeError as e:
+                    print(f"{name:<26}{max_side:>9}{mode:>7}  ERROR {e}")
+                    continue
+            for mode, result in results.items():
+                matches = "whole" not in results or result["digest"] == results["whole"]["digest"]
+                same &= matches
+                print(
+                    f"{name:<26}{max_side:>9}{mode:>7}{result['boxes']:>7}{'yes' if matches else 'NO':>6}"
+                    f"{result['seconds']:>9.2f}s{result['peak_rss_mb']:>9.0f} MB{result['peak_anon_mb']:>9.0f} MB"
+                )
+    return 0 if same else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
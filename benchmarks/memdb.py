@@ -0,0 +1,236 @@
+"""
+In-memory stand-in for the Motor database and GridFS bucket, so the ASGI
+app can be benchmarked without Mongo. It covers only the calls the app
+makes, with plain equality, $or, $in and range operators in queries.
+"""
+import copy
+import io
+from bson import ObjectId
+from gridfs.errors import NoFile
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+
+def _matches(doc, query):
+    for field, condition in query.items():
+        if field == "$or":
+            if not any(_matches(doc, branch) for branch in condition):
+                return False
+            continue
+        value = doc.get(field)
+        if isinstance(condition, dict) and any(key.startswith("$") for key in condition):
+            for operator, operand in condition.items():
+                if operator == "$in" and value not in operand:
+                    return False
+                if operator == "$lt" and not (value is not None and value < operand):
+                    return False
+                if operator == "$lte" and not (value is not None and value <= operand):
+                    return False
+                if operator == "$gt" and not (value is not None and value > operand):
+                    return False
+                if operator == "$gte" and not (value is not None and value >= operand):
+                    return False
+        elif value != condition:
+            return False
+    return True
+
+
+def _apply(doc, update):
+    doc.update(copy.deepcopy(update.get("$set", {})))
+    for field, amount in update.get("$inc", {}).items():
+        doc[field] = doc.get(field, 0) + amount
+
+
+def _project(doc, projection):
+    if not projection:
+        return copy.deepcopy(doc)
+    doc = copy.deepcopy(doc)
+    for field, keep in projection.items():
+        if not keep:
+            head, _, rest = field.partition(".")
+            if rest and isinstance(doc.get(head), dict):
+                doc[head].pop(rest, None)
+            else:
+                doc.pop(field, None)
+    return doc
+
+
+class _Result:
+    def __init__(self, **fields):
+        self.__dict__.update(fields)
+
+
+class MemoryCursor:
+    def __init__(self, docs):
+        self._docs = docs
+
+    def sort(self, key, direction=1):
+        self._docs.sort(key=lambda doc: doc.get(key), reverse=direction == -1)
+        return self
+
+    def limit(self, count):
+        if count:
+            self._docs = self._docs[:count]
+        return self
+
+    async def to_list(self, length=None):
+        return self._docs[:length] if length else list(self._docs)
+
+    def __aiter__(self):
+        self._iter = iter(self._docs)
+        return self
+
+    async def __anext__(self):
+        try:
+            return next(self._iter)
+        except StopIteration:
+            raise StopAsyncIteration
+
+
+class MemoryCollection:
+    def __init__(self):
+        self.docs = {}
+
+    async def insert_one(self, doc):
+        doc.setdefault("_id", ObjectId())
+        if doc["_id"] in self.docs:
+            raise DuplicateKeyError("duplicate key", 11000)
+        self.docs[doc["_id"]] = copy.deepcopy(doc)
+        return _Result(inserted_id=doc["_id"])
+
+    async def insert_many(self, docs, ordered=True):
+        errors = []
+        for index, doc in enumerate(docs):
+            try:
+                await self.insert_one(doc)
+            except DuplicateKeyError:
+                errors.append({"index": index, "code": 11000})
+        if errors:
+            raise BulkWriteError({"writeErrors": errors})
+        return _Result(inserted_ids=[doc["_id"] for doc in docs])
+
+    async def find_one(self, query=None, projection=None):
+        for doc in self.docs.values():
+            if _matches(doc, query or {}):
+                return _project(doc, projection)
+        return None
+
+    def find(self, query=None, projection=None, **kwargs):
+        return MemoryCursor([_project(doc, projection) for doc in self.docs.values() if _matches(doc, query or {})])
+
+    async def replace_one(self, query, doc, upsert=False):
+        existing = await self.find_one(query)
+        if existing is None and not upsert:
+            return _Result(matched_count=0)
+        doc = copy.deepcopy(doc)
+        doc.setdefault("_id", existing["_id"] if existing else ObjectId())
+        self.docs[doc["_id"]] = doc
+        return _Result(matched_count=int(existing is not None))
+
+    async def update_one(self, query, update):
+        for doc in self.docs.values():
+            if _matches(doc, query):
+                _apply(doc, update)
+                return _Result(matched_count=1, modified_count=1)
+        return _Result(matched_count=0, modified_count=0)
+
+    async def find_one_and_update(self, query, update, sort=None, return_document=False):
+        docs = [doc for doc in self.docs.values() if _matches(doc, query)]
+        for key, direction in reversed(sort or []):
+            docs.sort(key=lambda doc: doc.get(key), reverse=direction == -1)
+        if not docs:
+            return None
+        before = copy.deepcopy(docs[0])
+        _apply(docs[0], update)
+        # ReturnDocument.AFTER is True
+        return copy.deepcopy(docs[0]) if return_document else before
+
+    async def delete_one(self, query):
+        for _id, doc in list(self.docs.items()):
+            if _matches(doc, query):
+                del self.docs[_id]
+                return _Result(deleted_count=1)
+        return _Result(deleted_count=0)
+
+    async def create_index(self, keys, **kwargs):
+        return str(keys)
+
+
+class MemoryDatabase:
+    def __init__(self):
+        self._collections = {}
+
+    def __getitem__(self, name):
+        return self._collections.setdefault(name, MemoryCollection())
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self[name]
+
+
+class _GridIn:
+    def __init__(self, bucket, file_id, filename, metadata):
+        self._bucket = bucket
+        self._id = file_id
+        self._filename = filename
+        self._metadata = metadata
+        self._buffer = io.BytesIO()
+
+    async def write(self, data):
+        self._buffer.write(data)
+
+    async def set(self, name, value):
+        if name == "metadata":
+            self._metadata = value
+
+    async def close(self):
+        self._bucket.files[self._id] = (self._filename, self._metadata, self._buffer.getvalue())
+
+    async def abort(self):
+        self._buffer = io.BytesIO()
+
+
+class _GridOut(io.BytesIO):
+    def __init__(self, file_id, filename, metadata, data):
+        super().__init__(data)
+        self._id = file_id
+        self.filename = filename
+        self.metadata = metadata
+        self.length = len(data)
+
+    async def readchunk(self):
+        return self.read(255 * 1024)
+
+
+class MemoryGridFSBucket:
+    def __init__(self, db=None, bucket_name="fs"):
+        self.files = {}
+
+    def open_upload_stream(self, filename, metadata=None):
+        return _GridIn(self, ObjectId(), filename, metadata)
+
+    async def upload_from_stream_with_id(self, file_id, filename, source, metadata=None):
+        self.files[file_id] = (filename, metadata, source.read())
+
+    async def open_download_stream(self, file_id):
+        if file_id not in self.files:
+            raise NoFile(file_id)
+        return _GridOut(file_id, *self.files[file_id])
+
+    async def open_download_stream_by_name(self, filename):
+        # The latest revision, as GridFS returns by default
+        for file_id, stored in reversed(self.files.items()):
+            if stored[0] == filename:
+                return _GridOut(file_id, *stored)
+        raise NoFile(filename)
+
+    async def find(self, query):
+        for file_id, (filename, metadata, data) in list(self.files.items()):
+            fields = {"_id": file_id, "filename": filename}
+            fields.update({f"metadata.{key}": value for key, value in (metadata or {}).items()})
+            if _matches(fields, query):
+                yield _GridOut(file_id, filename, metadata, data)
+
+    async def delete(self, file_id):
+        if self.files.pop(file_id, None) is None:
+            raise NoFile(file_id)
@@ -0,0 +1,281 @@
+"""
+Benchmarks for the extraction and pricing hot paths. No network or Mongo
+is needed: fixtures are generated, and the end-to-end cases run the ASGI
+app against benchmarks/memdb.py.
+
+Every case runs in a fresh subprocess, so its peak RSS is its own. For
+the e2e cases that is the API process only; extraction itself runs in the
+spawned pool workers. The report gives throughput, p50/p95 latency and peak
+RSS. Results can be saved as a JSON baseline and compared against later runs.
+
+Usage:
+    python benchmarks/run.py                          # every case
+    python benchmarks/run.py -k price -k scale        # cases whose name contains any of these
+    python benchmarks/run.py --save benchmarks/baseline.json
+    python benchmarks/run.py --compare benchmarks/baseline.json
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCHMARKS_DIR)
+sys.path.insert(0, REPO_DIR)
+sys.path.insert(0, BENCHMARKS_DIR)
+
+DEFAULT_FIXTURES_DIR = os.path.join(tempfile.gettempdir(), "letter-benchmark-fixtures")
+PRICE_OPTIONS = {"thickness_pricing": 5, "plexi_size": 5, "width_of_letter": 8, "colors": ["white", "red"]}
+
+
+# ---------------------------------------------------------------------------
+#  Cases: name -> (extra environment, setup(fixtures) -> callable)
+# ---------------------------------------------------------------------------
+
+
+def _detect(name):
+    def setup(fixtures):
+        from extraction import detect_letter_boxes
+        path, content_type = fixtures[name]
+        return lambda: detect_letter_boxes(path, content_type)
+    return setup
+
+
+def _process_image(name):
+    def setup(fixtures):
+        import cv2
+        from extraction import process_image
+        image = cv2.imread(fixtures[name][0], cv2.IMREAD_COLOR)
+        return lambda: process_image(image, 200, 100)
+    return setup
+
+
+def _scale_text(name):
+    def setup(fixtures):
+        from extraction import detect_letter_boxes, scale_text_data
+        _, table = detect_letter_boxes(*fixtures[name])
+        records = [
+            {"letter": letter, "x": x, "y": y, "w": w, "h": h, "font_size": size}
+            for letter, x, y, w, h, size in zip(
+                table.letters.tolist(), table.x.tolist(), table.y.tolist(),
+                table.widths.tolist(), table.heights.tolist(), table.font_sizes.tolist(),
+            )
+        ]
+        return lambda: scale_text_data(records, 200, 100)
+    return setup
+
+
+def _price(profile, letter_count):
+    def setup(fixtures):
+        import numpy as np
+        from letter_table import ScaledLetters
+        from price_calculater import get_pricer
+        rng = np.random.default_rng(letter_count)
+        letters = ScaledLetters(
+            np.array(list("ABCDEFGHIJKLMNOPQRSTUVWXYZ"))[rng.integers(0, 26, letter_count)],
+            rng.integers(5, 60, letter_count),
+            rng.integers(5, 110, letter_count),
+        )
+        pricer = get_pricer(profile)
+        return lambda: pricer(letters, PRICE_OPTIONS)
+    return setup
+
+
+def _endpoint(route, name):
+    def setup(fixtures):
+        os.environ.setdefault("MOLLIE_API_KEY", "test_benchmark")  # never used, no payment is created
+        from fastapi.testclient import TestClient
+        from memdb import MemoryDatabase, MemoryGridFSBucket
+        import main
+
+        main.db = MemoryDatabase()
+        main.fs = MemoryGridFSBucket(main.db)
+        main.previews_fs = MemoryGridFSBucket(main.db, bucket_name="previews")
+        client = TestClient(main.app)
+        client.__enter__()
+
+        path, content_type = fixtures[name]
+        with open(path, "rb") as f:
+            body = f.read()
+        form = {"profile": "Profiel5", "data": json.dumps(PRICE_OPTIONS), "target_length": 200, "target_height": 100}
+
+        def request():
+            response = client.post(route, files={"file": (os.path.basename(path), body, content_type)}, data=form)
+            if response.status_code != 200:
+                raise RuntimeError(f"{route} answered {response.status_code}: {response.text}")
+        return request
+    return setup
+
+
+def _cases():
+    from fixtures import IMAGE_PDF_IMAGES, OUTLINED_PDF_GLYPHS, SCAN_SIZES, TEXT_PDF_GLYPHS
+    from price_calculater import profile_names
+
+    no_cache = {"LETTER_CACHE_SIZE": "0"}
+    cases = {}
+    for glyphs in TEXT_PDF_GLYPHS:
+        for engine in ("pdfminer", "pymupdf"):
+            cases[f"extract/text-{glyphs}/{engine}"] = ({"TEXT_ENGINE": engine}, _detect(f"text-{glyphs}"))
+    for glyphs in OUTLINED_PDF_GLYPHS:
+        cases[f"extract/outlined-{glyphs}"] = ({}, _detect(f"outlined-{glyphs}"))
+    for images in IMAGE_PDF_IMAGES:
+        cases[f"extract/images-{images}"] = ({}, _detect(f"images-{images}"))
+    for width, height in SCAN_SIZES:
+        for extension in ("png", "jpg"):
+            name = f"scan-{width}x{height}-{extension}"
+            cases[f"detect/{name}"] = ({}, _detect(name))
+        cases[f"process_image/scan-{width}x{height}"] = ({}, _process_image(f"scan-{width}x{height}-png"))
+    cases["scale_text/text-1000"] = ({}, _scale_text("text-1000"))
+    for profile in profile_names():
+        for letter_count in (10, 1000):
+            cases[f"price/{profile}/{letter_count}"] = ({}, _price(profile, letter_count))
+    for name in ("text-100", "images-1", "scan-2480x3508-jpg"):
+        cases[f"e2e/get-price/{name}"] = (no_cache, _endpoint("/get-price/", name))
+        cases[f"e2e/get-price-cached/{name}"] = ({}, _endpoint("/get-price/", name))
+    cases["e2e/detect-letters/text-100"] = (no_cache, _endpoint("/detect-letters/", "text-100"))
+    return cases
+
+
+# ---------------------------------------------------------------------------
+#  Worker: runs one case in this process and prints its result as JSON
+# ---------------------------------------------------------------------------
+
+
+def _peak_rss_mb():
+    # VmHWM belongs to this process image; ru_maxrss can carry over the parent's peak through fork()
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def run_case(name, fixtures_dir, iterations, min_seconds):
+    from fixtures import ensure_fixtures
+
+    _, setup = _cases()[name]
+    func = setup(ensure_fixtures(fixtures_dir))
+    func()  # warm-up: imports, pool start, caches
+
+    timings = []
+    started = time.perf_counter()
+    while len(timings) < iterations or time.perf_counter() - started < min_seconds:
+        call_started = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - call_started)
+        if len(timings) >= iterations * 50:
+            break
+    elapsed = time.perf_counter() - started
+
+    timings.sort()
+    return {
+        "iterations": len(timings),
+        "throughput": len(timings) / elapsed,
+        "p50_ms": statistics.median(timings) * 1000,
+        "p95_ms": timings[min(len(timings) - 1, int(len(timings) * 0.95))] * 1000,
+        "peak_rss_mb": _peak_rss_mb(),
+    }
+
+
+# ---------------------------------------------------------------------------
+#  Driver
+# ---------------------------------------------------------------------------
+
+
+def _run_in_subprocess(name, env, args):
+    command = [
+        sys.executable, os.path.abspath(__file__), "--worker", name,
+        "--fixtures", args.fixtures, "--iterations", str(args.iterations), "--min-seconds", str(args.min_seconds),
+    ]
+    completed = subprocess.run(
+        command, env={**os.environ, **env}, cwd=REPO_DIR, capture_output=True, text=True,
+    )
+    if completed.returncode != 0:
+        return {"error": completed.stderr.strip().splitlines()[-1] if completed.stderr.strip() else "failed"}
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def _format_change(current, baseline, key, lower_is_better=True):
+    if not baseline or key not in baseline or not baseline[key]:
+        return ""
+    change = (current[key] - baseline[key]) / baseline[key] * 100
+    worse = change > 0 if lower_is_better else change < 0
+    return f" ({change:+.0f}%{'!' if worse and abs(change) >= 10 else ''})"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-k", dest="filters", action="append", default=[], help="run cases whose name contains this")
+    parser.add_argument("--iterations", type=int, default=20, help="minimum timed calls per case")
+    parser.add_argument("--min-seconds", type=float, default=1.0, help="minimum timed seconds per case")
+    parser.add_argument("--fixtures", default=DEFAULT_FIXTURES_DIR, help="directory for generated fixtures")
+    parser.add_argument("--save", help="write the results to this JSON baseline")
+    parser.add_argument("--compare", help="show changes against this JSON baseline")
+    parser.add_argument("--list", action="store_true", help="list the cases and exit")
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(run_case(args.worker, args.fixtures, args.iterations, args.min_seconds)))
+        return 0
+
+    cases = _cases()
+    names = [name for name in cases if not args.filters or any(f in name for f in args.filters)]
+    if args.list:
+        print("\n".join(names))
+        return 0
+
+    from fixtures import ensure_fixtures
+    ensure_fixtures(args.fixtures)
+
+    baseline = {}
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["results"]
+
+    print(f"{'case':<42}{'ops/s':>16}{'p50 ms':>18}{'p95 ms':>18}{'peak RSS MB':>18}")
+    results = {}
+    failed = False
+    for name in names:
+        env, _ = cases[name]
+        result = _run_in_subprocess(name, env, args)
+        results[name] = result
+        if "error" in result:
+            failed = True
+            print(f"{name:<42}  ERROR {result['error']}")
+            continue
+        before = baseline.get(name)
+        print(
+            f"{name:<42}"
+            f"{result['throughput']:>10.1f}{_format_change(result, before, 'throughput', False):>6}"
+            f"{result['p50_ms']:>12.2f}{_format_change(result, before, 'p50_ms'):>6}"
+            f"{result['p95_ms']:>12.2f}{_format_change(result, before, 'p95_ms'):>6}"
+            f"{result['peak_rss_mb']:>12.1f}{_format_change(result, before, 'peak_rss_mb'):>6}"
+        )
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump({
+                "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "python": platform.python_version(),
+                "machine": platform.machine(),
+                "cpu_count": os.cpu_count(),
+                "results": results,
+            }, f, indent=2, sort_keys=True)
+        print(f"Saved {len(results)} results to {args.save}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
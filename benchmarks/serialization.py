@@ -0,0 +1,97 @@
+"""
+Compares the response serializers on synthetic order listings:
+
+    previous  convert_objectid + jsonable_encoder + JSONResponse, as before BSONResponse
+    stdlib    BSONResponse with the json fallback encoder
+    orjson    BSONResponse with orjson (when installed)
+
+Usage: python benchmarks/serialization.py [orders per response ...]
+"""
+import os
+import random
+import sys
+import timeit
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bson import ObjectId
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from helpers import serialization
+
+
+def make_orders(count, letters_per_order=12, seed=0):
+    rng = random.Random(seed)
+    started = datetime(2025, 1, 1)
+    orders = []
+    for i in range(count):
+        prices = [
+            {
+                "letter": chr(65 + rng.randrange(26)),
+                "scaled_length": rng.randrange(5, 40),
+                "scaled_height": rng.randrange(10, 90),
+                "price": round(rng.uniform(50, 200), 2),
+            }
+            for _ in range(letters_per_order)
+        ]
+        orders.append({
+            "_id": ObjectId(),
+            "file_id": ObjectId(),
+            "target_length": 200,
+            "target_height": 100,
+            "profile": "Profiel5",
+            "original_data": {"width_of_letter": 6, "colors": ["white", "black"]},
+            "prices": {"totalPrice": sum(p["price"] for p in prices), "prices": prices},
+            "timestamp": started + timedelta(minutes=i),
+        })
+    return orders
+
+
+def convert_objectid(data):
+    """The ObjectId conversion the routes ran before BSONResponse."""
+    if isinstance(data, ObjectId):
+        return str(data)
+    if isinstance(data, list):
+        return [convert_objectid(item) for item in data]
+    if isinstance(data, dict):
+        return {key: convert_objectid(value) for key, value in data.items()}
+    return data
+
+
+def previous_path(payload):
+    return JSONResponse(jsonable_encoder({**payload, "data": convert_objectid(payload["data"])})).body
+
+
+def stdlib_path(payload):
+    orjson, serialization.orjson = serialization.orjson, None
+    try:
+        return serialization.BSONResponse(payload).body
+    finally:
+        serialization.orjson = orjson
+
+
+def orjson_path(payload):
+    return serialization.BSONResponse(payload).body
+
+
+def best_of(func, payload, repeat=5):
+    number = max(1, 2000 // len(payload["data"]))
+    return min(timeit.repeat(lambda: func(payload), number=number, repeat=repeat)) / number
+
+
+def main(sizes):
+    paths = [("previous", previous_path), ("stdlib", stdlib_path)]
+    if serialization.orjson is not None:
+        paths.append(("orjson", orjson_path))
+
+    print(f"{'orders':>8}" + "".join(f"{name:>14}" for name, _ in paths) + f"{'speedup':>10}")
+    for size in sizes:
+        payload = {"success": True, "data": make_orders(size), "next_cursor": None}
+        timings = [best_of(func, payload) for _, func in paths]
+        row = "".join(f"{seconds * 1000:>12.2f}ms" for seconds in timings)
+        print(f"{size:>8}{row}{timings[0] / timings[-1]:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main([int(arg) for arg in sys.argv[1:]] or [10, 100, 1000])
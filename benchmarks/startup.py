@@ -0,0 +1,153 @@
+"""
+Cold-start benchmark: how long `import main` takes, and how long a fresh
+uvicorn process needs before it answers its first request and its first
+quote.
+
+By default the server runs against the in-memory stand-in from
+benchmarks/memdb.py. Pass --mongo-uri to measure with a real Motor client.
+--ref measures another commit the same way, from a temporary git worktree,
+so a change can be compared with what it replaced.
+
+Usage:
+    python benchmarks/startup.py
+    python benchmarks/startup.py --ref HEAD~1 --warmup
+"""
+import argparse
+import os
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCHMARKS_DIR)
+sys.path.insert(0, BENCHMARKS_DIR)
+
+IMPORT_SCRIPT = "import time; started = time.perf_counter(); import main; print(time.perf_counter() - started)"
+
+SERVER_SCRIPT = """
+import sys
+sys.path[:0] = [{repo!r}, {benchmarks!r}]
+import main
+if {memdb!r}:
+    from memdb import MemoryDatabase, MemoryGridFSBucket
+    main.db = MemoryDatabase()
+    main.fs = MemoryGridFSBucket(main.db)
+    main.previews_fs = MemoryGridFSBucket(main.db, bucket_name="previews")
+import uvicorn
+uvicorn.run(main.app, host="127.0.0.1", port={port}, log_level="warning")
+"""
+
+
+def _environment(args):
+    return {
+        **os.environ,
+        "MOLLIE_API_KEY": os.environ.get("MOLLIE_API_KEY", "test_startupbenchmark"),
+        "DATABASE_KEY": args.mongo_uri or "mongodb://127.0.0.1:9/?serverSelectionTimeoutMS=2000",
+        "EXTRACTION_WARMUP": "true" if args.warmup else "false",
+        "LETTER_CACHE_SIZE": "0",
+    }
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def measure_import(repo, args):
+    timings = []
+    for _ in range(args.runs):
+        completed = subprocess.run(
+            [sys.executable, "-c", IMPORT_SCRIPT], cwd=repo, env=_environment(args),
+            capture_output=True, text=True, check=True,
+        )
+        timings.append(float(completed.stdout.strip().splitlines()[-1]))
+    return statistics.median(timings)
+
+
+def measure_first_responses(repo, args, fixture):
+    """Seconds from process start to the first answered GET /, first quote and second quote."""
+    port = _free_port()
+    script = SERVER_SCRIPT.format(repo=repo, benchmarks=BENCHMARKS_DIR, memdb=not args.mongo_uri, port=port)
+    started = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-c", script], cwd=repo, env=_environment(args),
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    try:
+        while True:
+            if server.poll() is not None:
+                raise RuntimeError("server exited during startup")
+            if time.perf_counter() - started > 120:
+                raise RuntimeError("server did not answer within 120s")
+            try:
+                if httpx.get(base_url + "/", timeout=1).status_code == 200:
+                    break
+            except httpx.TransportError:
+                time.sleep(0.005)
+        ready = time.perf_counter() - started
+
+        with open(fixture, "rb") as f:
+            body = f.read()
+        quotes = []
+        for _ in range(2):
+            response = httpx.post(
+                base_url + "/get-price/",
+                files={"file": ("sign.pdf", body, "application/pdf")},
+                data={"profile": "Profiel5", "data": "{}"},
+                timeout=120,
+            )
+            response.raise_for_status()
+            quotes.append(time.perf_counter() - started)
+        return ready, quotes[0], quotes[1] - quotes[0]
+    finally:
+        server.terminate()
+        try:
+            server.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            server.kill()
+
+
+def measure(repo, args, fixture):
+    import_time = measure_import(repo, args)
+    runs = [measure_first_responses(repo, args, fixture) for _ in range(args.runs)]
+    ready, first_quote, warm_quote = (statistics.median(values) for values in zip(*runs))
+    return {"import": import_time, "first response": ready, "first quote": first_quote, "warm quote": warm_quote}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=3, help="median over this many cold starts")
+    parser.add_argument("--warmup", action="store_true", help="start the server with EXTRACTION_WARMUP=true")
+    parser.add_argument("--mongo-uri", help="use a real Motor client against this URI instead of the stand-in")
+    parser.add_argument("--ref", help="also measure this git commit, e.g. HEAD~1")
+    args = parser.parse_args()
+
+    from fixtures import ensure_fixtures
+    fixture = ensure_fixtures(os.path.join(tempfile.gettempdir(), "letter-benchmark-fixtures"))["text-100"][0]
+
+    results = {"working tree": measure(REPO_DIR, args, fixture)}
+    if args.ref:
+        worktree = tempfile.mkdtemp(prefix="startup-ref-")
+        subprocess.run(["git", "worktree", "add", "--detach", worktree, args.ref], cwd=REPO_DIR,
+                       check=True, capture_output=True)
+        try:
+            results[args.ref] = measure(worktree, args, fixture)
+        finally:
+            subprocess.run(["git", "worktree", "remove", "--force", worktree], cwd=REPO_DIR, capture_output=True)
+            shutil.rmtree(worktree, ignore_errors=True)
+
+    print(f"{'':<16}" + "".join(f"{name:>16}" for name in results))
+    for metric in ("import", "first response", "first quote", "warm quote"):
+        print(f"{metric:<16}" + "".join(f"{result[metric] * 1000:>14.0f}ms" for result in results.values()))
+
+
+if __name__ == "__main__":
+    main()
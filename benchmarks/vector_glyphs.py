@@ -0,0 +1,141 @@
+"""
+Compares measuring outlined text from its vector paths with the
+render-then-contour fallback. The fallback renders each page and runs the
+image detection on it.
+
+Fixtures are sign texts converted to outlines, some on a coloured panel
+with a frame and cut lines, plus the outlined-* PDFs from fixtures.py.
+The report gives:
+- the glyph count of each path against the number of letters written;
+- the smallest IoU between the boxes of the two paths;
+- the largest difference in the sizes they quote for a 200x100 cm sign;
+- the time of each path.
+
+Usage: python benchmarks/vector_glyphs.py [--dpi 300]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARKS_DIR))
+sys.path.insert(0, BENCHMARKS_DIR)
+
+import fitz  # PyMuPDF
+import numpy as np
+import extraction
+from detection_accuracy import iou, TARGET
+from fixtures import ensure_fixtures, OUTLINED_PDF_GLYPHS
+from letter_table import LetterTable
+
+SIGNS = [
+    ("OPEN 24H", 120, False),
+    ("Bakery Müller", 72, True),
+    ("jij äöü ÉÎ", 60, True),
+    ("STUDIO LUX", 36, False),
+]
+
+
+def outlined_sign(text, fontsize, panel):
+    doc = fitz.open()
+    page = doc.new_page(width=842, height=595)
+    if panel:
+        shape = page.new_shape()
+        shape.draw_rect(fitz.Rect(20, 120, 822, 120 + fontsize * 2), radius=0.1)
+        shape.finish(fill=(0.85, 0.2, 0.2), color=None)
+        shape.commit()
+        page.draw_rect(fitz.Rect(10, 10, 832, 585), color=(0, 0, 0))
+        page.draw_line((10, 500), (832, 500), color=(0, 0, 0))
+    page.insert_text((40, 120 + fontsize * 1.4), text, fontsize=fontsize)
+    svg = page.get_svg_image(text_as_path=True)
+    return fitz.open("svg", svg.encode()).convert_to_pdf()
+
+
+def vector_boxes(pdf):
+    with fitz.open(stream=pdf) as doc:
+        heights = [doc[page_num].rect.height for page_num in range(len(doc))]
+        records = extraction.extract_vector_glyphs(doc)
+    # Back to top-left origin, page by page as extracted; every fixture page is the same size
+    return np.array([(r["x"], heights[0] - r["y"] - r["h"], r["w"], r["h"]) for r in records]).reshape(-1, 4)
+
+
+def rendered_boxes(pdf, dpi):
+    scale = dpi / 72
+    boxes = []
+    with fitz.open(stream=pdf) as doc:
+        for page in doc:
+            pixmap = page.get_pixmap(dpi=dpi, colorspace=fitz.csGRAY)
+            image = np.frombuffer(pixmap.samples, np.uint8).reshape(pixmap.height, pixmap.width)
+            boxes.append(extraction.find_letter_boxes(image) / scale)
+    return np.concatenate(boxes) if boxes else np.empty((0, 4))
+
+
+def best_time(func, *args, repeat=3):
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func(*args)
+        best = min(best, time.perf_counter() - started)
+    return result, best
+
+
+def scaled(boxes):
+    # Float columns, as vector tables store them
+    table = LetterTable(None, *boxes.T, boxes[:, 3])
+    letters = table.scale_boxes(*TARGET)
+    return letters.scaled_length, letters.scaled_height
+
+
+def compare(name, pdf, letters, dpi):
+    vector, vector_time = best_time(vector_boxes, pdf)
+    rendered, rendered_time = best_time(rendered_boxes, pdf, dpi)
+
+    same_count = len(vector) == len(rendered)
+    min_iou = 0.0
+    if same_count:
+        # Lines make the left-to-right order ambiguous, so pair every box with its best match
+        matches = [max(range(len(rendered)), key=lambda index: iou(box, rendered[index])) for box in vector]
+        rendered = rendered[matches]
+        min_iou = min((iou(a, b) for a, b in zip(vector, rendered)), default=1.0)
+    max_size_error = 0
+    if same_count and len(vector):
+        (vector_lengths, vector_heights), (lengths, heights) = scaled(vector), scaled(rendered)
+        max_size_error = int(max(np.abs(vector_lengths - lengths).max(), np.abs(vector_heights - heights).max()))
+
+    ok = len(vector) == letters
+    print(
+        f"{name:<20}{letters:>8}{len(vector):>8}{len(rendered):>8}{min_iou:>9.3f}{max_size_error:>7}cm"
+        f"{vector_time * 1000:>11.1f}ms{rendered_time * 1000:>11.1f}ms{rendered_time / vector_time:>8.0f}x"
+        f"  {'ok' if ok else 'MISCOUNT'}"
+    )
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dpi", type=int, default=300, help="resolution of the render-then-contour baseline")
+    args = parser.parse_args()
+
+    print(f"render baseline at {args.dpi} dpi")
+    print(
+        f"{'fixture':<20}{'letters':>8}{'vector':>8}{'render':>8}{'min IoU':>9}{'size':>9}"
+        f"{'vector':>13}{'render':>13}{'speedup':>9}"
+    )
+    results = []
+    for text, fontsize, panel in SIGNS:
+        pdf = outlined_sign(text, fontsize, panel)
+        results.append(compare(text, pdf, len(text.replace(" ", "")), args.dpi))
+
+    fixtures = ensure_fixtures(os.path.join(tempfile.gettempdir(), "letter-benchmark-fixtures"))
+    for glyphs in OUTLINED_PDF_GLYPHS:
+        with open(fixtures[f"outlined-{glyphs}"][0], "rb") as f:
+            pdf = f.read()
+        # Its words have no punctuation, so every written letter is one glyph
+        results.append(compare(f"outlined-{glyphs}", pdf, glyphs, args.dpi))
+    return 0 if all(results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
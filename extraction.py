@@ -0,0 +1,780 @@
+import numpy as np
+from io import BytesIO
+import logging
+import os
+from helpers.metrics import timed
+from letter_table import LetterTable
+
+# "pdfminer" re-parses the PDF with pdfminer.six, "pymupdf" reuses the open fitz document
+TEXT_ENGINE = os.getenv("TEXT_ENGINE", "pdfminer")
+TEXT_ENGINES = ("pdfminer", "pymupdf")
+if TEXT_ENGINE not in TEXT_ENGINES:
+    raise ValueError(f"TEXT_ENGINE must be one of {', '.join(TEXT_ENGINES)}, got {TEXT_ENGINE!r}")
+
+# Pages one request may have analysed; longer documents need a page range
+PDF_MAX_PAGES = int(os.getenv("PDF_MAX_PAGES", 20))
+
+# Longest side, in pixels, that contour detection runs at; 0 keeps full resolution
+DETECTION_MAX_SIDE = int(os.getenv("DETECTION_MAX_SIDE", 2000))
+# Letter box filters, in source pixels
+MIN_LETTER_AREA = 500
+MAX_ASPECT_RATIO = 3.0
+
+# Outlined text: gap, in points, still bridged between the paths of one glyph
+VECTOR_JOIN_TOLERANCE = float(os.getenv("VECTOR_JOIN_TOLERANCE", 0.5))
+# Dots and accents at most this share of the typical glyph height are joined to the glyph they sit on
+VECTOR_MARK_HEIGHT = 0.3
+# Glyphs shorter than this share of a page's tallest glyph are dropped, like small specks in scans
+VECTOR_MIN_HEIGHT = 0.2
+# A filled path enclosing this many others is a panel or frame, not a glyph
+VECTOR_CONTAINER_PATHS = 3
+
+# OpenCV, PyMuPDF, pdfminer and PIL are imported by the functions that use them.
+# The API process imports this module only to hand its functions to the pool,
+# so it starts without loading any of them; the pool workers load them on first use.
+
+# Reductions cv2.IMREAD_REDUCED_GRAYSCALE_<n> offers, largest first
+_REDUCTION_FACTORS = (8, 4, 2)
+
+# Peak memory, in bytes, that decoding and detection in one image may use. Larger
+# images are decoded into a memory-mapped temp file and analysed in horizontal strips
+TILE_MEMORY_LIMIT = int(os.getenv("TILE_MEMORY_LIMIT", 256 * 1024 * 1024))
+# Directory for those decode buffers; defaults to the system temp dir
+TILE_SPOOL_DIR = os.getenv("TILE_SPOOL_DIR") or None
+# Largest image accepted, in pixels; a small compressed file can declare a huge canvas.
+# It replaces PIL's lower limit, which assumes the pixels are held in memory
+IMAGE_MAX_PIXELS = int(os.getenv("IMAGE_MAX_PIXELS", 1_000_000_000))
+# Bytes held per decoded pixel while imread returns a new array, which it builds from a copy
+_DECODE_BYTES_PER_PIXEL = 2
+# Bytes held per working pixel by whole-image detection: threshold, closing and contours
+_WHOLE_IMAGE_BYTES_PER_PIXEL = 6
+# Bytes held per working pixel of a strip: its rows, threshold, closing and two label images
+_STRIP_BYTES_PER_PIXEL = 16
+# Times the letter mask is dilated and then eroded to close small gaps
+_CLOSE_ITERATIONS = 2
+
+
+def _open_pdf(source):
+    import fitz  # PyMuPDF
+
+    with timed("pdf_open"):
+        if isinstance(source, str):
+            return fitz.open(source)
+        return fitz.open(stream=BytesIO(source))
+
+def select_pages(page_count: int, first_page=None, last_page=None) -> list:
+    """
+    0-based indexes of the pages to analyse. first_page and last_page are
+    1-based and inclusive; a last_page past the end is clamped.
+    """
+    if page_count == 0:
+        raise ValueError("Empty PDF document")
+    first = 1 if first_page is None else first_page
+    last = page_count if last_page is None else min(last_page, page_count)
+    if first < 1 or first > last:
+        raise ValueError(f"Invalid page range {first}-{last_page or page_count} for a {page_count} page PDF")
+    if last - first + 1 > PDF_MAX_PAGES:
+        raise ValueError(
+            f"At most {PDF_MAX_PAGES} pages can be analysed at once, use first_page and last_page to pick them"
+        )
+    return list(range(first - 1, last))
+
+_PAGE_KINDS = {"image": "images", "text": "text", "vector": "text converted to outlines"}
+
+
+def _page_kind(page):
+    """"image" when the page embeds an image, else "text" when it uses fonts, else "vector" when it draws paths."""
+    if page.get_images(full=True):
+        return "image"
+    if page.get_fonts(full=True):
+        return "text"
+    if page.get_cdrawings():
+        return "vector"
+    return None
+
+
+def _page_list(pages: list) -> str:
+    return ", ".join(str(page_num + 1) for page_num in pages)
+
+
+def inspect_pdf(source, first_page=None, last_page=None):
+    """
+    Decides how a PDF is analysed without decoding anything: ("image", pages)
+    when the selected pages embed images, ("vector", pages) when they use no
+    fonts but draw paths (text converted to outlines), otherwise ("text",
+    pages). Blank pages go along with the others. Text and image sizes are
+    scaled differently, so a selection that mixes kinds is rejected with the
+    pages of each kind, rather than some of them being left out.
+    """
+    try:
+        with _open_pdf(source) as doc:
+            pages = select_pages(len(doc), first_page, last_page)
+            kinds = {}
+            for page_num in pages:
+                kind = _page_kind(doc.load_page(page_num))
+                if kind is not None:
+                    kinds.setdefault(kind, []).append(page_num)
+    except Exception as e:
+        logging.error(f"File extraction error: {str(e)}")
+        raise
+    if len(kinds) > 1:
+        described = "; ".join(
+            f"{_PAGE_KINDS[kind]} on page{'s' if len(kind_pages) > 1 else ''} {_page_list(kind_pages)}"
+            for kind, kind_pages in kinds.items()
+        )
+        raise ValueError(
+            f"The selected pages mix kinds that are measured differently ({described}); "
+            "use first_page and last_page to pick pages of one kind"
+        )
+    return next(iter(kinds), "text"), pages
+
+def page_images(doc, page_num: int):
+    """Decodes every image embedded in a page, in the page's own order, as (xref, image, source size)."""
+    seen = set()
+    for image_info in doc.load_page(page_num).get_images(full=True):
+        xref = image_info[0]
+        if xref in seen:
+            continue
+        seen.add(xref)
+        with timed("image_decode"):
+            extracted = doc.extract_image(xref)
+            source_size = (extracted["width"], extracted["height"])
+            image = _decode_image(extracted["image"], source_size, jpeg=extracted["ext"] in ("jpeg", "jpg"))
+        if image is None:
+            logging.error(f"Could not decode image {xref} on page {page_num + 1}")
+            continue
+        yield xref, image, source_size
+
+def detect_pdf_pages(source, data_type: str, pages: list) -> LetterTable:
+    """
+    Letter boxes for some pages of a PDF, in reading order: page by page and,
+    for image PDFs, image by image within a page. One pool job per slice of
+    pages, so a long document is spread over several workers.
+    """
+    try:
+        if data_type == "image":
+            tables = []
+            with _open_pdf(source) as doc:
+                for page_num in pages:
+                    for _, image, source_size in page_images(doc, page_num):
+                        tables.append(LetterTable.from_boxes(find_letter_boxes(image, source_size)))
+            return LetterTable.concat(tables) if tables else LetterTable.from_boxes([])
+
+        if data_type == "vector":
+            with _open_pdf(source) as doc, timed("extract_vector"):
+                text_data = extract_vector_glyphs(doc, pages)
+            return LetterTable.from_text_records(text_data)
+
+        if TEXT_ENGINE == "pymupdf":
+            with _open_pdf(source) as doc, timed("extract_pymupdf"):
+                text_data = extract_text_pymupdf(doc, pages)
+        else:
+            with timed("extract_pdfminer"):
+                text_data = extract_text_pdfminer(source, pages)
+        return LetterTable.from_text_records(text_data)
+    except Exception as e:
+        logging.error(f"File extraction error: {str(e)}")
+        raise
+
+def merge_page_tables(data_type: str, tables: list) -> LetterTable:
+    """Joins the per-slice tables of detect_pdf_pages, which must be in page order."""
+    table = LetterTable.concat(tables)
+    if data_type != "image" and not len(table):
+        raise ValueError("No images or text found in the PDF")
+    return table
+
+def _decode_reduction(width, height, jpeg, max_side=DETECTION_MAX_SIDE):
+    """
+    Whole factor a JPEG is reduced by inside the decoder, landing closest to
+    max_side without going under it. Other formats are decoded at full
+    size: OpenCV would only resize them after a full decode.
+    """
+    if jpeg and max_side:
+        for factor in _REDUCTION_FACTORS:
+            if max(width, height) // factor >= max_side:
+                return factor
+    return 1
+
+def _open_header(source):
+    """Opens an image with PIL for its header, without decoding it."""
+    from PIL import Image
+
+    # IMAGE_MAX_PIXELS stands in for PIL's own limit
+    Image.MAX_IMAGE_PIXELS = None
+    return Image.open(source if isinstance(source, str) else BytesIO(source))
+
+def _decodable(path, jpeg) -> bool:
+    """
+    Checks a file before imread decodes it into a given buffer, which it
+    then hands back untouched on failure instead of returning None. PNG
+    chunk checksums are read through; truncated JPEGs are padded by the
+    decoder, in memory too, so they pass.
+    """
+    import cv2
+
+    if not cv2.haveImageReader(path):
+        return False
+    if jpeg:
+        return True
+    try:
+        with _open_header(path) as image:
+            image.verify()
+        return True
+    except Exception:
+        return False
+
+def _decode_image(source, source_size, jpeg, transposed=False, color=False, max_side=DETECTION_MAX_SIDE):
+    """
+    Decodes a PNG/JPEG, from a path or bytes, as a grayscale or BGR image,
+    JPEGs reduced towards max_side. When the decoded pixels and the
+    detection buffers for them would not fit in
+    TILE_MEMORY_LIMIT, the image is decoded into a memory-mapped temp file,
+    which the OS can page out, instead of process memory. Returns None when
+    the data cannot be decoded.
+    """
+    import cv2
+    import tempfile
+
+    width, height = source_size
+    if width * height > IMAGE_MAX_PIXELS:
+        raise ValueError(f"Images can have at most {IMAGE_MAX_PIXELS} pixels")
+    reduction = _decode_reduction(width, height, jpeg, max_side)
+    mode = "COLOR" if color else "GRAYSCALE"
+    flag = getattr(cv2, f"IMREAD_REDUCED_{mode}_{reduction}" if reduction > 1 else f"IMREAD_{mode}")
+    # The decoder rounds reduced sizes up
+    shape = (-(-height // reduction), -(-width // reduction))
+    if transposed:
+        shape = shape[::-1]
+    _, working_width, working_height = _working_size(shape[1], shape[0])
+    if color:
+        shape += (3,)
+    in_memory = int(np.prod(shape)) * _DECODE_BYTES_PER_PIXEL
+    if in_memory + working_width * working_height * _WHOLE_IMAGE_BYTES_PER_PIXEL <= TILE_MEMORY_LIMIT:
+        if isinstance(source, str):
+            return cv2.imread(source, flag)
+        return cv2.imdecode(np.frombuffer(source, np.uint8), flag)
+
+    with tempfile.TemporaryFile(prefix="decode-", dir=TILE_SPOOL_DIR) as spool:
+        buffer = np.memmap(spool, dtype=np.uint8, mode="w+", shape=shape)
+    # imread is the only decoder that can write into a given buffer
+    with tempfile.NamedTemporaryFile(prefix="decode-", dir=TILE_SPOOL_DIR) as encoded:
+        if not isinstance(source, str):
+            encoded.write(source)
+            encoded.flush()
+        path = source if isinstance(source, str) else encoded.name
+        if not _decodable(path, jpeg):
+            return None
+        image = cv2.imread(path, buffer, flag)
+    if image is None or not image.size:
+        return None
+    if not np.shares_memory(image, buffer):
+        logging.warning(f"Decoded a {width}x{height} image in memory, its decoded size was not the expected {shape}")
+    return image
+
+def load_image(source, color=False, max_side=DETECTION_MAX_SIDE):
+    """
+    Decodes an uploaded PNG/JPEG, from its spooled path or its bytes, as a
+    grayscale image (BGR with `color`) already reduced towards max_side,
+    the detection resolution by default.
+    Returns (image, (source width, source height)), the source size as
+    displayed, after any EXIF rotation.
+    """
+    try:
+        with _open_header(source) as header:
+            source_size = header.size
+            jpeg = header.format == "JPEG"
+            # EXIF orientations 5-8 turn the image a quarter, and the decoder applies them
+            transposed = jpeg and header.getexif().get(0x0112, 1) in (5, 6, 7, 8)
+    except Exception:
+        raise ValueError("Failed to decode image")
+    with timed("image_decode"):
+        image = _decode_image(source, source_size, jpeg, transposed, color, max_side)
+    if image is None:
+        raise ValueError("Failed to decode image")
+    return image, source_size[::-1] if transposed else source_size
+
+def extract_text_pdfminer(source, pages=None) -> list:
+    """
+    Extracts every visible character with its box and font size using pdfminer.
+    `pages` limits it to those 0-based page indexes.
+    """
+    from pdfminer.high_level import extract_pages
+    from pdfminer.layout import LTTextBox, LTTextLine, LTChar
+
+    text_data = []
+    for page_layout in extract_pages(source if isinstance(source, str) else BytesIO(source), page_numbers=pages):
+        for element in page_layout:
+            if isinstance(element, (LTTextBox, LTTextLine)):
+                for text_line in element:
+                    if isinstance(text_line, LTTextLine):
+                        for char in text_line:
+                            if isinstance(char, LTChar) and char.get_text().strip():
+                                text_data.append({
+                                    "letter": char.get_text(),
+                                    "x": char.bbox[0],
+                                    "y": char.bbox[1],
+                                    "w": char.bbox[2] - char.bbox[0],
+                                    "h": char.bbox[3] - char.bbox[1],
+                                    "font_size": char.size
+                                })
+    return text_data
+
+def extract_text_pymupdf(doc, pages=None) -> list:
+    """
+    Produces the same records as extract_text_pdfminer from an already open
+    fitz document, in one pass over its character spans.
+    Boxes are converted to pdfminer's bottom-left origin and, like pdfminer,
+    start at the font descender and are one font size high.
+    """
+    import fitz  # PyMuPDF
+
+    flags = fitz.TEXT_PRESERVE_LIGATURES | fitz.TEXT_PRESERVE_WHITESPACE | fitz.TEXT_MEDIABOX_CLIP
+    text_data = []
+    for page_num in (range(len(doc)) if pages is None else pages):
+        page = doc.load_page(page_num)
+        page_height = page.rect.height
+        for block in page.get_text("rawdict", flags=flags)["blocks"]:
+            for line in block.get("lines", ()):
+                for span in line["spans"]:
+                    size = span["size"]
+                    descent = span["descender"] * size
+                    for char in span["chars"]:
+                        if not char["c"].strip():
+                            continue
+                        x0, _, x1, _ = char["bbox"]
+                        text_data.append({
+                            "letter": char["c"],
+                            "x": x0,
+                            "y": page_height - char["origin"][1] + descent,
+                            "w": x1 - x0,
+                            "h": size,
+                            "font_size": size
+                        })
+    return text_data
+
+def _glyph_path_rects(drawings):
+    """
+    Bounding rects (x0, y0, x1, y1) of the filled paths that can be parts of
+    glyphs. Strokes (rules, cut lines) and plain rectangles (backgrounds,
+    frames) are skipped. So are filled shapes that enclose several other
+    paths, such as rounded panels behind the lettering.
+    """
+    rects = np.array(
+        [
+            drawing["rect"]
+            for drawing in drawings
+            if drawing.get("fill") is not None and not (len(drawing["items"]) == 1 and drawing["items"][0][0] == "re")
+        ],
+        dtype=np.float64,
+    ).reshape(-1, 4)
+    if len(rects) <= VECTOR_CONTAINER_PATHS:
+        return rects
+    # Only paths well above the typical size can be panels; checking just those keeps this linear
+    areas = (rects[:, 2] - rects[:, 0]) * (rects[:, 3] - rects[:, 1])
+    large = np.flatnonzero(areas > 4 * np.median(areas))
+    if not len(large):
+        return rects
+    x0, y0, x1, y1 = rects.T
+    outer = rects[large]
+    # Counters of O, B, 8 are nested in their glyph, but never three of them
+    enclosed = (
+        (outer[:, :1] <= x0) & (outer[:, 1:2] <= y0) & (outer[:, 2:3] >= x1) & (outer[:, 3:] >= y1)
+    ).sum(axis=1) - 1
+    return np.delete(rects, large[enclosed >= VECTOR_CONTAINER_PATHS], axis=0)
+
+def group_glyph_rects(rects: np.ndarray, tolerance: float = VECTOR_JOIN_TOLERANCE) -> np.ndarray:
+    """
+    Merges path rects that overlap or lie within `tolerance` of each other
+    into glyph rects, returned as an (m, 4) array of (x0, y0, x1, y1).
+    A sweep over x with a heap of active rects finds the candidate pairs.
+    Union-find then joins them. Dots and accents that sit on a glyph,
+    like the dots of i, j and umlauts, are joined to it afterwards.
+    """
+    import heapq
+
+    if not len(rects):
+        return rects.reshape(0, 4)
+    parent = list(range(len(rects)))
+
+    def find(index):
+        while parent[index] != index:
+            parent[index] = parent[parent[index]]
+            index = parent[index]
+        return index
+
+    boxes = rects.tolist()
+    active = []  # (x1, index) of rects the sweep line may still touch
+    for index in np.argsort(rects[:, 0], kind="stable").tolist():
+        x0, y0, _, y1 = boxes[index]
+        while active and active[0][0] + tolerance < x0:
+            heapq.heappop(active)
+        for _, other in active:
+            if boxes[other][1] - tolerance <= y1 and y0 - tolerance <= boxes[other][3]:
+                parent[find(index)] = find(other)
+        heapq.heappush(active, (boxes[index][2], index))
+
+    def merged(labels):
+        _, groups = np.unique(labels, return_inverse=True)
+        glyphs = np.empty((groups.max() + 1, 4))
+        glyphs[:, :2] = np.inf
+        glyphs[:, 2:] = -np.inf
+        np.minimum.at(glyphs[:, :2], groups, rects[:, :2])
+        np.maximum.at(glyphs[:, 2:], groups, rects[:, 2:])
+        return glyphs, groups
+
+    glyphs, groups = merged([find(index) for index in range(len(rects))])
+
+    heights = glyphs[:, 3] - glyphs[:, 1]
+    typical = np.median(heights)
+    marks = np.flatnonzero(heights <= VECTOR_MARK_HEIGHT * typical)
+    if len(marks) and len(marks) < len(glyphs):
+        labels = np.arange(len(glyphs))
+        bodies = np.flatnonzero(heights > VECTOR_MARK_HEIGHT * typical)
+        for mark in marks.tolist():
+            center = (glyphs[mark, 0] + glyphs[mark, 2]) / 2
+            # The gap above or below the body, negative when they overlap vertically
+            gaps = np.maximum(glyphs[bodies, 1] - glyphs[mark, 3], glyphs[mark, 1] - glyphs[bodies, 3])
+            near = (
+                (glyphs[bodies, 0] - tolerance <= center)
+                & (center <= glyphs[bodies, 2] + tolerance)
+                & (gaps <= VECTOR_MARK_HEIGHT * heights[bodies])
+            )
+            if near.any():
+                labels[mark] = bodies[near][np.argmin(gaps[near])]
+        glyphs, groups = merged(labels[groups])
+    return glyphs
+
+def extract_vector_glyphs(doc, pages=None) -> list:
+    """
+    Measures text that was converted to outlines, from the drawing paths of
+    an open fitz document. Returns extract_text_pdfminer style records,
+    so scale_text_data can consume them too. Glyphs have no identity, so
+    every letter is "?". The font size is the glyph's height, as for image
+    boxes. Boxes use pdfminer's bottom-left origin and are ordered left to
+    right, like image boxes.
+    """
+    text_data = []
+    for page_num in (range(len(doc)) if pages is None else pages):
+        page = doc.load_page(page_num)
+        page_height = page.rect.height
+        glyphs = group_glyph_rects(_glyph_path_rects(page.get_cdrawings()))
+        if not len(glyphs):
+            continue
+        widths = glyphs[:, 2] - glyphs[:, 0]
+        heights = glyphs[:, 3] - glyphs[:, 1]
+        keep = (heights >= VECTOR_MIN_HEIGHT * heights.max()) & (widths < MAX_ASPECT_RATIO * heights)
+        glyphs = glyphs[keep]
+        for x0, y0, x1, y1 in glyphs[np.lexsort((glyphs[:, 1], glyphs[:, 0]))].tolist():
+            text_data.append({
+                "letter": "?",
+                "x": x0,
+                "y": page_height - y1,
+                "w": x1 - x0,
+                "h": y1 - y0,
+                "font_size": y1 - y0
+            })
+    return text_data
+
+def scale_text_data(letter_boxes, target_length, target_height):
+    """
+    Scales letters extracted from text data.
+    The letter with the maximum font size is set to 100%, and others are scaled accordingly.
+    """
+    return LetterTable.from_text_records(letter_boxes).scale_text(target_length, target_height).to_records()
+
+def _working_size(width, height):
+    """
+    Whole factor an image is shrunk by so its longest side ends up between
+    DETECTION_MAX_SIDE and twice that, and the working width and height.
+    """
+    factor = max(1, max(width, height) // DETECTION_MAX_SIDE) if DETECTION_MAX_SIDE else 1
+    return factor, width // factor, height // factor
+
+def _working_rows(gray: np.ndarray, factor, width, start, stop):
+    """
+    Rows start to stop of the working image. Source pixels past the last
+    whole factor are dropped, which keeps INTER_AREA on its fast path of
+    plain block means, so any run of rows comes out the same as when the
+    whole image is shrunk at once.
+    """
+    import cv2
+
+    rows = gray[start * factor:stop * factor, :width * factor]
+    if factor == 1:
+        return rows
+    return cv2.resize(rows, (width, stop - start), interpolation=cv2.INTER_AREA)
+
+def _otsu_threshold(histogram: np.ndarray) -> int:
+    """Otsu's threshold for a 256-bin histogram, computed step for step like cv2.THRESH_OTSU."""
+    epsilon = float(np.finfo(np.float32).eps)
+    counts = histogram.tolist()
+    scale = 1.0 / sum(counts)
+    mu = sum(index * count for index, count in enumerate(counts)) * scale
+    mu1 = q1 = max_sigma = 0.0
+    threshold = 0
+    for index, count in enumerate(counts):
+        p = count * scale
+        mu1 *= q1
+        q1 += p
+        q2 = 1.0 - q1
+        if min(q1, q2) < epsilon or max(q1, q2) > 1.0 - epsilon:
+            continue
+        mu1 = (mu1 + index * p) / q1
+        mu2 = (mu - q1 * mu1) / q2
+        sigma = q1 * q2 * (mu1 - mu2) * (mu1 - mu2)
+        if sigma > max_sigma:
+            max_sigma = sigma
+            threshold = index
+    return threshold
+
+def _letter_corners(gray: np.ndarray, kernel):
+    """Top-left and bottom-right corners of the outer contours in a working image."""
+    import cv2
+
+    _, thresh = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+    cleaned = cv2.morphologyEx(thresh, cv2.MORPH_CLOSE, kernel, iterations=_CLOSE_ITERATIONS)
+
+    contours, _ = cv2.findContours(cleaned, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    if not contours:
+        return np.empty((0, 2), dtype=np.int64), np.empty((0, 2), dtype=np.int64)
+
+    # Bounding rects of every contour at once: min/max over each contour's slice of points
+    points = np.concatenate(contours).reshape(-1, 2).astype(np.int64)
+    starts = np.zeros(len(contours), dtype=np.int64)
+    np.cumsum(np.fromiter(map(len, contours[:-1]), dtype=np.int64, count=len(contours) - 1), out=starts[1:])
+    return np.minimum.reduceat(points, starts), np.maximum.reduceat(points, starts) + 1
+
+class _DisjointSet:
+    """Union-find over integer ids; only ids that were joined are stored."""
+
+    def __init__(self):
+        self.parent = {}
+
+    def find(self, item):
+        root = item
+        while self.parent.get(root, root) != root:
+            root = self.parent[root]
+        while item != root:
+            self.parent[item], item = root, self.parent[item]
+        return root
+
+    def join(self, pairs: np.ndarray):
+        # One int64 key per pair dedupes far faster than np.unique(axis=0)
+        for key in np.unique((pairs[:, 0] << 32) | pairs[:, 1]).tolist():
+            a, b = self.find(key >> 32), self.find(key & 0xFFFFFFFF)
+            if a != b:
+                self.parent[max(a, b)] = min(a, b)
+
+    def roots(self, count) -> np.ndarray:
+        roots = np.arange(count)
+        for item in list(self.parent):
+            roots[item] = self.find(item)
+        return roots
+
+def _strip_ids(labels: np.ndarray, offset):
+    """Ids numbered over all strips for a row of connectedComponents labels; -1 for label 0."""
+    return np.where(labels > 0, labels.astype(np.int64) + offset - 1, -1)
+
+def _row_pairs(above: np.ndarray, below: np.ndarray, shifts):
+    """(above, below) id pairs of neighbouring pixels across a strip cut; -1 marks pixels that do not count."""
+    width = len(above)
+    pairs = []
+    for shift in shifts:
+        a = above[max(0, -shift):width - max(0, shift)]
+        b = below[max(0, shift):width - max(0, -shift)]
+        both = (a >= 0) & (b >= 0)
+        pairs.append(np.stack([a[both], b[both]], axis=1))
+    return np.concatenate(pairs)
+
+def _tiled_letter_corners(gray: np.ndarray, factor, width, height, kernel):
+    """
+    The corners _letter_corners finds in the whole working image, computed a
+    horizontal strip at a time so only one strip's buffers are held at once,
+    whatever the image's height. Each strip is shrunk, thresholded and
+    closed with enough rows of overlap that the closing matches the whole
+    image. Three passes over the strips:
+    - a histogram, for the same Otsu threshold as the whole image;
+    - the background, labelled 4-connected like findContours sees it and
+      joined across cuts, to find what is reachable from the image border;
+    - the foreground with its enclosed background filled in, labelled
+      8-connected and joined across cuts. Filling the holes hides nested
+      shapes inside their outer shape, as RETR_EXTERNAL does.
+    """
+    import cv2
+
+    # Rows the closing reaches past a strip: it dilates, then erodes, each _CLOSE_ITERATIONS times
+    margin = 2 * _CLOSE_ITERATIONS * kernel.shape[0]
+    rows = max(2 * margin, TILE_MEMORY_LIMIT // (_STRIP_BYTES_PER_PIXEL * width) - 2 * margin)
+    strips = [(start, min(start + rows, height)) for start in range(0, height, rows)]
+
+    histogram = np.zeros(256, dtype=np.int64)
+    for start, stop in strips:
+        histogram += np.bincount(_working_rows(gray, factor, width, start, stop).ravel(), minlength=256)
+    threshold = _otsu_threshold(histogram)
+
+    def cleaned(start, stop):
+        top, bottom = max(0, start - margin), min(height, stop + margin)
+        _, thresh = cv2.threshold(
+            _working_rows(gray, factor, width, top, bottom), threshold, 255, cv2.THRESH_BINARY_INV
+        )
+        closed = cv2.morphologyEx(thresh, cv2.MORPH_CLOSE, kernel, iterations=_CLOSE_ITERATIONS)
+        return closed[start - top:stop - top]
+
+    def background_labels(strip):
+        count, labels = cv2.connectedComponents((strip == 0).view(np.uint8), connectivity=4, ltype=cv2.CV_32S)
+        return count - 1, labels
+
+    # Background ids are numbered over all strips; label 0 of each strip is the foreground
+    background = _DisjointSet()
+    offsets, border_ids = [], []
+    above, total = None, 0
+    for start, stop in strips:
+        count, labels = background_labels(cleaned(start, stop))
+        edges = [labels[:, 0], labels[:, -1]]
+        if start == 0:
+            edges.append(labels[0])
+        if stop == height:
+            edges.append(labels[-1])
+        border_ids.append(_strip_ids(np.concatenate(edges), total))
+        if above is not None:
+            background.join(_row_pairs(above, _strip_ids(labels[0], total), (0,)))
+        above = _strip_ids(labels[-1], total)
+        offsets.append(total)
+        total += count
+
+    roots = background.roots(total)
+    border_ids = np.concatenate(border_ids)
+    reaches_border = np.zeros(total, dtype=bool)
+    reaches_border[roots[border_ids[border_ids >= 0]]] = True
+    outside = reaches_border[roots]
+
+    shapes = _DisjointSet()
+    corners = []
+    above, total = None, 0
+    for (start, stop), offset in zip(strips, offsets):
+        count, labels = background_labels(cleaned(start, stop))
+        # Foreground and enclosed background are 1, background reaching the border 0
+        filled = np.empty(count + 1, dtype=np.uint8)
+        filled[0] = 1
+        filled[1:] = ~outside[offset:offset + count]
+        count, labels, stats, _ = cv2.connectedComponentsWithStats(filled[labels], connectivity=8, ltype=cv2.CV_32S)
+        if above is not None:
+            shapes.join(_row_pairs(above, _strip_ids(labels[0], total), (-1, 0, 1)))
+        above = _strip_ids(labels[-1], total)
+        x, y, w, h = stats[1:, :4].astype(np.int64).T
+        corners.append(np.stack([x, y + start, x + w, y + start + h], axis=1))
+        total += count - 1
+
+    corners = np.concatenate(corners) if corners else np.empty((0, 4), dtype=np.int64)
+    roots = shapes.roots(total)
+    np.minimum.at(corners[:, :2], roots, corners[:, :2].copy())
+    np.maximum.at(corners[:, 2:], roots, corners[:, 2:].copy())
+    corners = corners[roots == np.arange(total)]
+    return corners[:, :2], corners[:, 2:]
+
+def find_letter_boxes(image: np.ndarray, source_size=None) -> list:
+    """
+    Detects individual letters in an image and returns their (x, y, w, h) boxes
+    as an (n, 4) array sorted left to right.
+    Large images are analysed near DETECTION_MAX_SIDE; the kernel shrinks with
+    them and boxes are mapped back to source pixels before filtering.
+    `source_size` is the (width, height) of the original when `image` was
+    already decoded at a reduced size; it may be BGR or grayscale.
+    When the detection buffers would not fit in TILE_MEMORY_LIMIT, the image
+    is analysed in strips instead, with the same result.
+    """
+    import cv2
+
+    with timed("opencv_detect"):
+        try:
+            gray = image if image.ndim == 2 else cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+            factor, width, height = _working_size(gray.shape[1], gray.shape[0])
+            source_width, source_height = source_size or (gray.shape[1], gray.shape[0])
+            scale_x, scale_y = source_width / width, source_height / height
+
+            # 3x3 at source resolution, kept odd so the kernel is centred and boxes do not shift
+            kernel_size = max(1, round(3 / max(scale_x, scale_y))) | 1
+            kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (kernel_size, kernel_size))
+            if width * height * _WHOLE_IMAGE_BYTES_PER_PIXEL > TILE_MEMORY_LIMIT:
+                with timed("opencv_detect_tiled"):
+                    top_left, bottom_right = _tiled_letter_corners(gray, factor, width, height, kernel)
+            else:
+                top_left, bottom_right = _letter_corners(_working_rows(gray, factor, width, 0, height), kernel)
+            if not len(top_left):
+                return np.empty((0, 4), dtype=np.int64)
+
+            if scale_x != 1 or scale_y != 1:
+                scale = np.array([scale_x, scale_y])
+                top_left = np.round(top_left * scale).astype(np.int64)
+                bottom_right = np.round(bottom_right * scale).astype(np.int64)
+
+            x, y = top_left[:, 0], top_left[:, 1]
+            w, h = (bottom_right - top_left).T
+            keep = (w * h > MIN_LETTER_AREA) & (w / h < MAX_ASPECT_RATIO)
+
+            boxes = np.stack([x, y, w, h], axis=1)[keep]
+            # Left to right, top to bottom for equal x, then by size, so strips and the whole image agree on ties
+            return boxes[np.lexsort((boxes[:, 3], boxes[:, 2], boxes[:, 1], boxes[:, 0]))]
+        except Exception as e:
+            logging.error(f"Image processing error: {str(e)}")
+            raise
+
+def scale_image_boxes(letter_boxes: list, target_length: int, target_height: int) -> list:
+    """
+    Scales letter boxes detected in an image to the requested sign size.
+    """
+    return LetterTable.from_boxes(letter_boxes).scale_boxes(target_length, target_height).to_records()
+
+def process_image(image: np.ndarray, target_length: int, target_height: int) -> list:
+    """
+    Processes an image to detect individual letters and scale them accordingly.
+    """
+    return scale_image_boxes(find_letter_boxes(image), target_length, target_height)
+
+def detect_letter_boxes(source, content_type: str, first_page=None, last_page=None):
+    """
+    Runs the CPU-bound part of letter detection in one go: extraction and,
+    for images, contour detection. Returns the unscaled boxes as a LetterTable
+    so that only a few NumPy columns (never the decoded image) travel back
+    from a pool worker. pipeline.get_letter_boxes splits PDFs over several
+    workers instead.
+    """
+    if content_type == "application/pdf":
+        data_type, pages = inspect_pdf(source, first_page, last_page)
+        return data_type, merge_page_tables(data_type, [detect_pdf_pages(source, data_type, pages)])
+    if content_type in ["image/jpeg", "image/png"]:
+        try:
+            image, source_size = load_image(source)
+        except Exception as e:
+            logging.error(f"File extraction error: {str(e)}")
+            raise
+        return "image", LetterTable.from_boxes(find_letter_boxes(image, source_size))
+    raise ValueError("Unsupported file format")
+
+def warm_up():
+    """
+    Pool job that loads OpenCV, PyMuPDF and pdfminer in a worker and runs the
+    image and PDF paths once on tiny inputs, so the first real upload does not pay for it.
+    """
+    import cv2
+    import fitz  # PyMuPDF
+
+    image = np.full((64, 64), 255, np.uint8)
+    cv2.rectangle(image, (16, 8), (40, 56), 0, -1)
+    _, png = cv2.imencode(".png", image)
+    detect_letter_boxes(png.tobytes(), "image/png")
+
+    doc = fitz.open()
+    doc.new_page().insert_text((20, 40), "A")
+    detect_letter_boxes(doc.tobytes(), "application/pdf")
+
+def scale_letters(data_type: str, table: LetterTable, target_length: int, target_height: int):
+    """
+    Scales the LetterTable returned by detect_letter_boxes to the requested
+    sign size, returning ScaledLetters columns.
+    """
+    with timed("scale"):
+        # Outlined glyphs have no identity either, so they are numbered like image boxes
+        if data_type in ("image", "vector"):
+            return table.scale_boxes(target_length, target_height)
+        return table.scale_text(target_length, target_height)
@@ -1,30 +1,111 @@
-from fastapi.responses import StreamingResponse
-import io
+from fastapi.responses import Response, StreamingResponse
+from urllib.parse import quote
 from bson import ObjectId
+from bson.errors import InvalidId
 from fastapi import HTTPException
+from gridfs.errors import NoFile
+from previews import delete_previews
 
-async def download_file(file_id: str, fs):
-    """Download a file from MongoDB GridFS"""
+
+def _parse_range(range_header: str, length: int):
+    """
+    Parses a single "bytes=start-end" range into inclusive (start, end).
+    Returns None for headers we ignore (other units, multiple ranges) and
+    raises 416 for ranges outside the file.
+    """
+    unit, _, spec = range_header.partition("=")
+    if unit.strip() != "bytes" or "," in spec:
+        return None
+    first, _, last = spec.strip().partition("-")
+    try:
+        if first:
+            start = int(first)
+            end = int(last) if last else length - 1
+        else:
+            # "bytes=-N" is the last N bytes
+            start = max(length - int(last), 0)
+            end = length - 1
+    except ValueError:
+        return None
+
+    if start >= length or start > end:
+        raise HTTPException(
+            status_code=416,
+            detail="Requested range not satisfiable",
+            headers={"Content-Range": f"bytes */{length}"},
+        )
+    return start, min(end, length - 1)
+
+
+async def _iter_chunks(grid_out, start: int, end: int):
+    """Yields the file from start to end (inclusive) one GridFS chunk at a time."""
+    grid_out.seek(start)
+    remaining = end - start + 1
+    while remaining > 0:
+        chunk = await grid_out.readchunk()
+        if not chunk:
+            break
+        chunk = chunk[:remaining]
+        remaining -= len(chunk)
+        yield chunk
+
+
+async def download_file(file_id: str, fs, request=None):
+    """
+    Stream a file from MongoDB GridFS chunk by chunk.
+    Supports single byte ranges (Range / If-Range) and conditional requests
+    (If-None-Match); the ETag is the stored SHA-256, or the file id for older
+    files, which is just as stable because GridFS files never change.
+    """
     try:
         file_id_obj = ObjectId(file_id)
+    except (InvalidId, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid file id")
 
-        # Open the file stream for downloading
+    try:
         file_stream = await fs.open_download_stream(file_id_obj)
-        
-        # Read the file data
-        file_data = await file_stream.read()
-        
-        # Get the file metadata
-        filename = file_stream.filename if hasattr(file_stream, "filename") else "downloaded_file"
-
-        return StreamingResponse(io.BytesIO(file_data), 
-                                 media_type="application/octet-stream",
-                                 headers={"Content-Disposition": f"attachment; filename={filename}"})
+    except NoFile:
+        raise HTTPException(status_code=404, detail="File not found")
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-async def delete_file(file_id: str, fs, db):
-    """Delete a file from MongoDB GridFS"""
+    metadata = file_stream.metadata or {}
+    length = file_stream.length
+    filename = file_stream.filename or "downloaded_file"
+    etag = f'"{metadata.get("sha256") or file_id}"'
+
+    headers = {
+        "ETag": etag,
+        "Accept-Ranges": "bytes",
+        "Content-Disposition": f"attachment; filename*=UTF-8''{quote(filename)}",
+    }
+    request_headers = request.headers if request is not None else {}
+
+    if_none_match = request_headers.get("if-none-match")
+    if if_none_match and (if_none_match.strip() == "*" or etag in [tag.strip() for tag in if_none_match.split(",")]):
+        return Response(status_code=304, headers=headers)
+
+    start, end = 0, length - 1
+    status_code = 200
+    range_header = request_headers.get("range")
+    if_range = request_headers.get("if-range")
+    if range_header and length and (not if_range or if_range.strip() == etag):
+        byte_range = _parse_range(range_header, length)
+        if byte_range is not None:
+            start, end = byte_range
+            status_code = 206
+            headers["Content-Range"] = f"bytes {start}-{end}/{length}"
+
+    headers["Content-Length"] = str(end - start + 1 if length else 0)
+    return StreamingResponse(
+        _iter_chunks(file_stream, start, end),
+        status_code=status_code,
+        media_type=metadata.get("content_type") or "application/octet-stream",
+        headers=headers,
+    )
+
+async def delete_file(file_id: str, fs, db, previews_fs=None):
+    """Delete a file from MongoDB GridFS, with its previews"""
     try:
         file_id_obj = ObjectId(file_id)
 
@@ -35,6 +116,8 @@ async def delete_file(file_id: str, fs, db):
 
         # Delete the file from GridFS
         await fs.delete(file_id_obj)
+        if previews_fs is not None:
+            await delete_previews(previews_fs, file_id_obj)
         return {"message": "File deleted successfully"}
 
     except Exception as e:
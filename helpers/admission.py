@@ -0,0 +1,223 @@
+import asyncio
+import collections
+import logging
+import os
+import time
+from helpers.metrics import Counter, Gauge, STAGE_LATENCY
+from helpers.pool import POOL_WORKERS
+from helpers.uploads import MAX_UPLOAD_BYTES
+
+# Routes that decode uploads and run extraction; they share the memory budget
+HEAVY_PATHS = ("/detect-letters/", "/get-price/", "/get-prices/batch", "/jobs/detect-letters")
+# Never limited, so the limiter can still be watched while it sheds load
+EXEMPT_PATHS = ("/metrics", "/admission")
+# Bytes of request bodies the heavy routes may hold at once, counted from Content-Length
+ADMISSION_MEMORY_BUDGET = int(os.getenv("ADMISSION_MEMORY_BUDGET", 256 * 1024 * 1024))
+# Multiplier from body size to memory held while the request runs
+ADMISSION_MEMORY_FACTOR = float(os.getenv("ADMISSION_MEMORY_FACTOR", 2))
+
+
+class RouteClass:
+    """Limits for one group of routes, overridable as ADMISSION_<NAME>_<SETTING>."""
+
+    def __init__(self, name, concurrency, queue, wait, retry_after, uses_memory=False):
+        prefix = f"ADMISSION_{name.upper()}_"
+        self.name = name
+        # Requests running at once
+        self.concurrency = int(os.getenv(prefix + "CONCURRENCY", concurrency))
+        # Requests allowed to wait for a slot; more get 429
+        self.queue = int(os.getenv(prefix + "QUEUE", queue))
+        # Seconds a request may wait before it gets 503
+        self.wait = float(os.getenv(prefix + "WAIT", wait))
+        self.retry_after = int(os.getenv(prefix + "RETRY_AFTER", retry_after))
+        self.uses_memory = uses_memory
+        self.in_flight = 0
+        self.waiters = collections.deque()
+
+
+class Rejected(Exception):
+    def __init__(self, status_code, reason, retry_after):
+        self.status_code = status_code
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+ADMISSION_REJECTIONS = Counter(
+    "admission_rejections_total", "Requests turned away by admission control.", ("route_class", "reason")
+)
+ADMISSION_IN_FLIGHT = Gauge("admission_in_flight", "Admitted requests still running.", ("route_class",))
+ADMISSION_QUEUED = Gauge("admission_queued", "Requests waiting for admission.", ("route_class",))
+
+
+class AdmissionController:
+    """
+    Per-class concurrency limits with bounded FIFO wait queues, plus one
+    memory budget shared by the classes that use it. A request is admitted
+    when its class has a free slot and, for memory classes, its cost fits in
+    what is left of the budget. Otherwise it joins the back of its class's
+    queue. A full queue answers 429. Waiting past the class deadline
+    answers 503.
+    """
+
+    def __init__(self, classes, memory_budget=ADMISSION_MEMORY_BUDGET):
+        self.classes = {route_class.name: route_class for route_class in classes}
+        self.memory_budget = memory_budget
+        self.memory_reserved = 0
+
+    def cost(self, route_class, content_length):
+        """Budget bytes charged for a request; bodies without a length are charged the upload limit."""
+        if not route_class.uses_memory:
+            return 0
+        size = content_length if content_length is not None else MAX_UPLOAD_BYTES
+        # A request larger than the whole budget still runs, just on its own
+        return min(int(size * ADMISSION_MEMORY_FACTOR), self.memory_budget)
+
+    def _fits(self, route_class, cost):
+        return route_class.in_flight < route_class.concurrency and self.memory_reserved + cost <= self.memory_budget
+
+    def _admit(self, route_class, cost):
+        route_class.in_flight += 1
+        self.memory_reserved += cost
+        ADMISSION_IN_FLIGHT.set(route_class.in_flight, route_class=route_class.name)
+
+    async def acquire(self, route_class, cost):
+        # Queued requests go first, so a steady stream of small requests cannot starve them
+        if not route_class.waiters and self._fits(route_class, cost):
+            self._admit(route_class, cost)
+            return
+        if len(route_class.waiters) >= route_class.queue:
+            raise Rejected(429, "queue_full", route_class.retry_after)
+
+        waiter = (asyncio.get_running_loop().create_future(), cost)
+        route_class.waiters.append(waiter)
+        ADMISSION_QUEUED.set(len(route_class.waiters), route_class=route_class.name)
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter[0]), route_class.wait)
+        except asyncio.TimeoutError:
+            if not waiter[0].done():
+                raise Rejected(503, "wait_timeout", route_class.retry_after)
+            # Admitted in the same loop iteration as the deadline; keep the slot
+        except asyncio.CancelledError:
+            if waiter[0].done() and not waiter[0].cancelled():
+                # Admitted just as the client went away
+                self.release(route_class, cost)
+            raise
+        finally:
+            if waiter in route_class.waiters:
+                route_class.waiters.remove(waiter)
+                ADMISSION_QUEUED.set(len(route_class.waiters), route_class=route_class.name)
+                # The head may have been holding back smaller requests behind it
+                self._wake()
+            STAGE_LATENCY.observe(time.perf_counter() - started, stage=f"admission_wait_{route_class.name}")
+
+    def release(self, route_class, cost):
+        route_class.in_flight -= 1
+        self.memory_reserved -= cost
+        ADMISSION_IN_FLIGHT.set(route_class.in_flight, route_class=route_class.name)
+        self._wake()
+
+    def _wake(self):
+        for route_class in self.classes.values():
+            while route_class.waiters:
+                future, cost = route_class.waiters[0]
+                if not self._fits(route_class, cost):
+                    break
+                route_class.waiters.popleft()
+                ADMISSION_QUEUED.set(len(route_class.waiters), route_class=route_class.name)
+                self._admit(route_class, cost)
+                future.set_result(None)
+
+    def state(self):
+        """Current limits and usage, for monitoring."""
+        return {
+            "memory": {"budget_bytes": self.memory_budget, "reserved_bytes": self.memory_reserved},
+            "classes": {
+                name: {
+                    "in_flight": route_class.in_flight,
+                    "concurrency": route_class.concurrency,
+                    "queued": len(route_class.waiters),
+                    "queue_limit": route_class.queue,
+                    "wait_seconds": route_class.wait,
+                    "uses_memory": route_class.uses_memory,
+                }
+                for name, route_class in self.classes.items()
+            },
+        }
+
+
+admission = AdmissionController([
+    RouteClass("heavy", concurrency=max(2, POOL_WORKERS * 2), queue=16, wait=10, retry_after=5, uses_memory=True),
+    # SSE job streams stay open for the whole job, so they get their own slots
+    RouteClass("stream", concurrency=200, queue=0, wait=0, retry_after=5),
+    RouteClass("default", concurrency=64, queue=128, wait=5, retry_after=1),
+])
+
+Gauge(
+    "admission_memory_reserved_bytes", "Memory budget held by admitted requests.",
+    function=lambda: admission.memory_reserved,
+)
+
+_HEAVY_PATHS = {path.rstrip("/") for path in HEAVY_PATHS}
+
+
+def route_class_for(path):
+    if path in EXEMPT_PATHS:
+        return None
+    if path.rstrip("/") in _HEAVY_PATHS:
+        return admission.classes["heavy"]
+    if path.startswith("/jobs/") and path.endswith("/events"):
+        return admission.classes["stream"]
+    return admission.classes["default"]
+
+
+class AdmissionControlMiddleware:
+    """
+    Admits each request through `admission` before it reaches the app and
+    holds its slot until the response is fully sent, so the slot covers
+    streamed bodies too. Turned-away requests get 429 or 503 with Retry-After
+    right away, without their body being read.
+    """
+
+    def __init__(self, app, controller=admission):
+        self.app = app
+        self.controller = controller
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        route_class = route_class_for(scope["path"])
+        if route_class is None:
+            return await self.app(scope, receive, send)
+
+        content_length = None
+        for name, value in scope["headers"]:
+            if name == b"content-length" and value.isdigit():
+                content_length = int(value)
+        cost = self.controller.cost(route_class, content_length)
+
+        try:
+            await self.controller.acquire(route_class, cost)
+        except Rejected as e:
+            ADMISSION_REJECTIONS.inc(route_class=route_class.name, reason=e.reason)
+            logging.info(f"Admission rejected a {route_class.name} request ({e.reason})")
+            return await self._reject(send, e)
+
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.controller.release(route_class, cost)
+
+    async def _reject(self, send, rejected):
+        detail = "Too many requests, please retry shortly" if rejected.status_code == 429 else "Server is busy, please retry shortly"
+        await send({
+            "type": "http.response.start",
+            "status": rejected.status_code,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"retry-after", str(rejected.retry_after).encode()),
+                # The body was not read, so the connection cannot be reused
+                (b"connection", b"close"),
+            ],
+        })
+        await send({"type": "http.response.body", "body": f'{{"detail":"{detail}"}}'.encode()})
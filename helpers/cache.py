@@ -0,0 +1,98 @@
+import logging
+import os
+import time
+from collections import OrderedDict
+from datetime import datetime
+from helpers.metrics import CACHE_LOOKUPS, ERRORS
+from letter_table import LetterTable
+
+# Entries kept in memory per worker process
+LETTER_CACHE_SIZE = int(os.getenv("LETTER_CACHE_SIZE", 256))
+# Seconds an entry stays valid, in memory and in Mongo
+LETTER_CACHE_TTL = int(os.getenv("LETTER_CACHE_TTL", 24 * 3600))
+# Also keep entries in a Mongo collection shared by all workers
+LETTER_CACHE_PERSIST = os.getenv("LETTER_CACHE_PERSIST", "false").lower() in ("1", "true", "yes")
+LETTER_CACHE_COLLECTION = "letter_box_cache"
+
+_entries = OrderedDict()
+_stats = {"hits": 0, "persistent_hits": 0, "misses": 0}
+
+
+def cache_key(sha256: str, content_type: str, engine: str = "", pages: str = "") -> str:
+    """Hex SHA-256 of the uploaded bytes, scoped by content type, extraction engine and page range."""
+    key = f"{sha256}:{content_type}:{engine}"
+    return f"{key}:{pages}" if pages else key
+
+
+def cache_stats():
+    """Hit/miss counters and current size of the in-memory tier."""
+    return {**_stats, "size": len(_entries), "max_size": LETTER_CACHE_SIZE}
+
+
+def _remember(key, value):
+    _entries[key] = (time.monotonic() + LETTER_CACHE_TTL, value)
+    _entries.move_to_end(key)
+    while len(_entries) > LETTER_CACHE_SIZE:
+        _entries.popitem(last=False)
+
+
+async def get_cached_boxes(db, key):
+    """
+    Returns the cached (data_type, LetterTable) for key, or None on a miss.
+    Checks memory first, then the Mongo tier when it is enabled.
+    """
+    entry = _entries.get(key)
+    if entry is not None:
+        expires_at, value = entry
+        if expires_at > time.monotonic():
+            _entries.move_to_end(key)
+            _stats["hits"] += 1
+            CACHE_LOOKUPS.inc(result="hit")
+            return value
+        del _entries[key]
+
+    if LETTER_CACHE_PERSIST and db is not None:
+        try:
+            doc = await db[LETTER_CACHE_COLLECTION].find_one({"_id": key})
+        except Exception as e:
+            logging.error(f"Letter cache lookup failed: {str(e)}")
+            ERRORS.inc(kind="cache")
+            doc = None
+        if doc:
+            value = (doc["data_type"], LetterTable.from_columns(doc["letter_boxes"]))
+            _remember(key, value)
+            _stats["persistent_hits"] += 1
+            CACHE_LOOKUPS.inc(result="persistent_hit")
+            return value
+
+    _stats["misses"] += 1
+    CACHE_LOOKUPS.inc(result="miss")
+    return None
+
+
+async def store_boxes(db, key, data_type, letter_boxes):
+    """Stores an unscaled LetterTable in memory and, if enabled, in Mongo."""
+    value = (data_type, letter_boxes)
+    _remember(key, value)
+
+    if LETTER_CACHE_PERSIST and db is not None:
+        try:
+            await db[LETTER_CACHE_COLLECTION].replace_one(
+                {"_id": key},
+                {
+                    "_id": key,
+                    "data_type": data_type,
+                    "letter_boxes": letter_boxes.to_columns(),
+                    "created_at": datetime.utcnow(),
+                },
+                upsert=True,
+            )
+        except Exception as e:
+            logging.error(f"Letter cache write failed: {str(e)}")
+            ERRORS.inc(kind="cache")
+
+
+async def ensure_cache_indexes(db):
+    """Lets Mongo expire persisted entries after LETTER_CACHE_TTL."""
+    if LETTER_CACHE_PERSIST:
+        await db[LETTER_CACHE_COLLECTION].create_index("created_at", expireAfterSeconds=LETTER_CACHE_TTL)
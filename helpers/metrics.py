@@ -0,0 +1,218 @@
+import threading
+import time
+from contextlib import contextmanager
+
+# Seconds; wide enough for both quick lookups and whole-document extraction
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+_registry = []
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in (*zip(names, values), *extra)]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def _key(self, labels):
+        if set(labels) != set(self.label_names):
+            raise ValueError(f"{self.name} expects labels {self.label_names}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    def _samples(self):
+        with self._lock:
+            return [(self.name, key, value, ()) for key, value in self._values.items()]
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for sample_name, key, value, extra in self._samples():
+            lines.append(f"{sample_name}{_format_labels(self.label_names, key, extra)} {_format_number(value)}")
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    """A value that only goes up, e.g. requests or errors."""
+
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    """
+    A value that goes up and down. Pass `function` to read it on every
+    scrape instead of setting it, e.g. a queue length.
+    """
+
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labels=(), function=None):
+        super().__init__(name, documentation, labels)
+        self.function = function
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def _samples(self):
+        if self.function is not None:
+            return [(self.name, (), self.function(), ())]
+        return super()._samples()
+
+
+class Histogram(_Metric):
+    """Observations counted into cumulative buckets, plus their sum and count."""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                # One slot per bucket, then the running sum
+                counts = self._values[key] = [0] * len(self.buckets) + [0.0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+            counts[-1] += value
+
+    def _samples(self):
+        samples = []
+        with self._lock:
+            for key, counts in self._values.items():
+                for bound, count in zip(self.buckets, counts):
+                    samples.append((f"{self.name}_bucket", key, count, (("le", _format_number(float(bound))),)))
+                samples.append((f"{self.name}_sum", key, counts[-1], ()))
+                samples.append((f"{self.name}_count", key, counts[-2], ()))
+        return samples
+
+
+def render():
+    """Every registered metric in the Prometheus text exposition format."""
+    return "\n".join(metric.render() for metric in _registry) + "\n"
+
+
+HTTP_REQUESTS = Counter("http_requests_total", "HTTP requests by route and status.", ("method", "route", "status"))
+HTTP_LATENCY = Histogram(
+    "http_request_duration_seconds", "Time to send the full response, by route.", ("method", "route")
+)
+HTTP_IN_FLIGHT = Gauge("http_requests_in_flight", "Requests currently being handled.")
+STAGE_LATENCY = Histogram(
+    "stage_duration_seconds", "Time spent in each processing stage, including pool workers.", ("stage",)
+)
+CACHE_LOOKUPS = Counter("letter_cache_lookups_total", "Letter box cache lookups by result.", ("result",))
+ERRORS = Counter("errors_total", "Handled errors by kind.", ("kind",))
+
+
+# ---------------------------------------------------------------------------
+#  Stage timers
+# ---------------------------------------------------------------------------
+
+# Set while a pool worker runs a job, so its timings travel back with the result
+_worker_stages = None
+
+
+@contextmanager
+def timed(stage: str):
+    """Times the block as `stage`; usable in the API process and in pool workers."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        if _worker_stages is not None:
+            _worker_stages.append((stage, elapsed))
+        else:
+            STAGE_LATENCY.observe(elapsed, stage=stage)
+
+
+def run_collecting_stages(func, *args):
+    """Runs func(*args) in a pool worker and returns (result, [(stage, seconds), ...])."""
+    global _worker_stages
+    _worker_stages = []
+    try:
+        return func(*args), _worker_stages
+    finally:
+        _worker_stages = None
+
+
+def record_stages(stages):
+    """Records stage timings a pool worker sent back."""
+    for stage, elapsed in stages:
+        STAGE_LATENCY.observe(elapsed, stage=stage)
+
+
+# ---------------------------------------------------------------------------
+#  ASGI middleware
+# ---------------------------------------------------------------------------
+
+
+class MetricsMiddleware:
+    """
+    Counts requests and records their latency per route template (e.g.
+    /orders/{order_id}), so ids never become label values. Requests that
+    match no route share the "unmatched" label.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        status = 500
+        started = time.perf_counter()
+
+        async def recording_send(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        HTTP_IN_FLIGHT.inc()
+        try:
+            await self.app(scope, receive, recording_send)
+        finally:
+            HTTP_IN_FLIGHT.dec()
+            route = scope.get("route")
+            route = getattr(route, "path", None) or "unmatched"
+            HTTP_LATENCY.observe(time.perf_counter() - started, method=scope["method"], route=route)
+            HTTP_REQUESTS.inc(method=scope["method"], route=route, status=status)
@@ -0,0 +1,214 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from fastapi import HTTPException
+from helpers.metrics import ERRORS, Gauge, run_collecting_stages, record_stages, timed
+
+# Number of worker processes running extraction / contour detection
+POOL_WORKERS = int(os.getenv("POOL_WORKERS", os.cpu_count() or 1))
+# Jobs allowed to wait for a free worker before we answer 503
+POOL_QUEUE_LIMIT = int(os.getenv("POOL_QUEUE_LIMIT", 4))
+# Seconds a single job may take before the request gets a 504
+POOL_JOB_TIMEOUT = float(os.getenv("POOL_JOB_TIMEOUT", 60))
+# Seconds the client is told to wait when the pool is saturated
+POOL_RETRY_AFTER = int(os.getenv("POOL_RETRY_AFTER", 5))
+
+DISCONNECT_POLL_INTERVAL = 0.5
+
+_executor = None
+_pending = 0
+# Bumped whenever the pool is replaced; jobs of an older pool no longer count as pending
+_generation = 0
+# Workers of replaced pools, killed when their grace period ends or at shutdown
+_retired_workers = set()
+
+
+def get_executor():
+    """Create the process pool on first use."""
+    global _executor
+    if _executor is None:
+        # spawn keeps the Mongo client threads of the API process out of the workers
+        _executor = ProcessPoolExecutor(
+            max_workers=POOL_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+        logging.info(f"Started extraction pool with {POOL_WORKERS} workers")
+    return _executor
+
+
+def shutdown_pool():
+    """Stop the worker processes, dropping jobs that have not started yet."""
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+    _kill_workers(list(_retired_workers))
+
+
+def _retire_pool(executor, grace=0.0):
+    """
+    Takes a broken or stuck pool out of use, so the next job starts a new
+    one, and frees the slots of its jobs. Its worker processes are killed
+    `grace` seconds later; jobs of other requests running on them have
+    that long to finish. Does nothing if the pool was already replaced.
+    """
+    global _executor, _pending, _generation
+    if executor is not _executor:
+        return
+    _executor = None
+    _pending = 0
+    _generation += 1
+    # ProcessPoolExecutor has no public way to stop a worker in the middle of a job
+    processes = list((executor._processes or {}).values())
+    _retired_workers.update(processes)
+    executor.shutdown(wait=False)
+    asyncio.get_running_loop().call_later(grace, _kill_workers, processes)
+
+
+def _kill_workers(processes):
+    for process in processes:
+        if process.is_alive():
+            process.terminate()
+        _retired_workers.discard(process)
+
+
+def _abandon(future, executor, remaining):
+    """
+    Gives up on a job nobody waits for any more. A job that has not started
+    is cancelled. One that has cannot be, and keeps its worker; if it is
+    still running `remaining` seconds later, when it would have timed out,
+    the pool is replaced to get the worker back.
+    """
+    if future.cancel() or future.done():
+        return
+
+    def check():
+        if not future.done() and executor is _executor:
+            logging.error("Extraction job ran past its timeout, replacing the pool")
+            ERRORS.inc(kind="pool_stuck")
+            _retire_pool(executor, POOL_JOB_TIMEOUT)
+
+    asyncio.get_running_loop().call_later(max(0.0, remaining), check)
+
+
+def queue_depth():
+    """Jobs submitted to the pool that have not finished yet."""
+    return _pending
+
+
+POOL_QUEUE_DEPTH = Gauge(
+    "extraction_pool_queue_depth", "Jobs submitted to the extraction pool that have not finished.", function=queue_depth
+)
+
+
+def idle_workers():
+    """Workers with no job submitted for them, so that a new job would start right away."""
+    return max(0, POOL_WORKERS - _pending)
+
+
+def _job_finished(generation):
+    global _pending
+    if generation == _generation:
+        _pending -= 1
+
+
+def _release_on(loop):
+    """
+    Done callback for a pool future. Futures complete on the executor's
+    management thread, so the count is handed back to the event loop,
+    the only thread that reads or changes it.
+    """
+    generation = _generation
+
+    def release(_future):
+        try:
+            loop.call_soon_threadsafe(_job_finished, generation)
+        except RuntimeError:
+            # The loop is already closed, along with everything that read the count
+            pass
+
+    return release
+
+
+async def _wait_for_disconnect(request):
+    while not await request.is_disconnected():
+        await asyncio.sleep(DISCONNECT_POLL_INTERVAL)
+
+
+async def run_in_pool(func, *args, request=None, timeout=None):
+    """
+    Runs func(*args) in the process pool without blocking the event loop.
+
+    Raises 503 when every worker is busy and the wait queue is full, 504 when
+    the job exceeds its timeout, and cancels the job if the client behind
+    `request` disconnects while it is still waiting for a worker. A job that
+    already started runs on, and its pool is replaced if it outlives its
+    timeout. A worker dying, for instance of running out of memory, fails
+    the jobs of its pool with 503; the next job starts a new pool.
+    """
+    global _pending
+    if _pending >= POOL_WORKERS + POOL_QUEUE_LIMIT:
+        ERRORS.inc(kind="pool_busy")
+        raise HTTPException(
+            status_code=503,
+            detail="Server is busy, please retry shortly",
+            headers={"Retry-After": str(POOL_RETRY_AFTER)},
+        )
+
+    loop = asyncio.get_running_loop()
+    timeout = timeout if timeout is not None else POOL_JOB_TIMEOUT
+    deadline = loop.time() + timeout
+    executor = get_executor()
+    try:
+        # Workers send their stage timings back along with the result
+        future = executor.submit(run_collecting_stages, func, *args)
+    except BrokenProcessPool:
+        _retire_pool(executor)
+        executor = get_executor()
+        future = executor.submit(run_collecting_stages, func, *args)
+    _pending += 1
+    # The slot is released when the worker is really done, not when we stop waiting
+    future.add_done_callback(_release_on(loop))
+
+    job = asyncio.wrap_future(future)
+    waiters = {job}
+    disconnect = None
+    if request is not None:
+        disconnect = asyncio.ensure_future(_wait_for_disconnect(request))
+        waiters.add(disconnect)
+
+    try:
+        with timed("pool_job"):
+            done, _ = await asyncio.wait(waiters, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+        if job in done:
+            try:
+                result, stages = job.result()
+            except BrokenProcessPool:
+                logging.error("An extraction worker died, replacing the pool")
+                ERRORS.inc(kind="pool_broken")
+                _retire_pool(executor)
+                raise HTTPException(
+                    status_code=503,
+                    detail="Processing failed, please retry shortly",
+                    headers={"Retry-After": str(POOL_RETRY_AFTER)},
+                )
+            record_stages(stages)
+            return result
+        job.cancel()
+        _abandon(future, executor, deadline - loop.time())
+        if disconnect is not None and disconnect in done:
+            logging.info("Client disconnected, cancelled extraction job")
+            ERRORS.inc(kind="client_disconnect")
+            raise HTTPException(status_code=499, detail="Client closed request")
+        ERRORS.inc(kind="pool_timeout")
+        raise HTTPException(status_code=504, detail="Processing timed out")
+    except asyncio.CancelledError:
+        job.cancel()
+        _abandon(future, executor, deadline - loop.time())
+        raise
+    finally:
+        if disconnect is not None:
+            disconnect.cancel()
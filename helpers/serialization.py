@@ -0,0 +1,61 @@
+import json
+from datetime import date, datetime
+from uuid import UUID
+import numpy as np
+import bson
+from bson import ObjectId
+from bson.decimal128 import Decimal128
+from bson.errors import InvalidDocument
+from fastapi.responses import JSONResponse
+
+try:
+    import orjson
+except ImportError:  # Falls back to the stdlib encoder
+    orjson = None
+
+_ORJSON_OPTIONS = (orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY) if orjson else 0
+
+
+def _default(obj):
+    """Encodes the BSON and NumPy types json/orjson do not know about."""
+    if isinstance(obj, ObjectId):
+        return str(obj)
+    if isinstance(obj, (datetime, date)):
+        return obj.isoformat()
+    if isinstance(obj, (Decimal128, UUID)):
+        return str(obj)
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def dumps(content) -> bytes:
+    """
+    Encodes Mongo documents straight to JSON bytes in one pass: ObjectIds
+    become strings and datetimes ISO 8601, with no intermediate copy.
+    """
+    if orjson is not None:
+        return orjson.dumps(content, default=_default, option=_ORJSON_OPTIONS)
+    return json.dumps(
+        content, default=_default, ensure_ascii=False, allow_nan=False, separators=(",", ":")
+    ).encode("utf-8")
+
+
+def check_storable(doc: dict):
+    """Raises ValueError for a document Mongo cannot store, such as one holding an integer over 64 bits."""
+    try:
+        bson.encode(doc)
+    except (InvalidDocument, OverflowError) as e:
+        raise ValueError(f"The request holds values that cannot be stored: {str(e)}")
+
+
+class BSONResponse(JSONResponse):
+    """
+    JSONResponse that accepts raw Mongo documents. Return it from a route to
+    skip FastAPI's jsonable_encoder pass as well.
+    """
+
+    def render(self, content) -> bytes:
+        return dumps(content)
@@ -0,0 +1,217 @@
+import hashlib
+import logging
+import os
+import shutil
+import tempfile
+import uuid
+from fastapi import HTTPException
+from helpers.metrics import timed
+
+# Largest request body / uploaded file we accept, in bytes
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", 50 * 1024 * 1024))
+# Directory for spooled uploads; defaults to the system temp dir
+UPLOAD_SPOOL_DIR = os.getenv("UPLOAD_SPOOL_DIR") or None
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+_SUFFIXES = {"application/pdf": ".pdf", "image/png": ".png", "image/jpeg": ".jpg"}
+
+
+class SpooledUpload:
+    """An upload copied to a temp file on disk, with its SHA-256 and GridFS id."""
+
+    __slots__ = ("path", "filename", "content_type", "size", "sha256", "file_id")
+
+    def __init__(self, path, filename, content_type, size, sha256, file_id=None):
+        self.path = path
+        self.filename = filename
+        self.content_type = content_type
+        self.size = size
+        self.sha256 = sha256
+        self.file_id = file_id
+
+    def cleanup(self):
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+
+    def link(self):
+        """
+        The same upload under a second temp path, for background work that
+        outlives the request's cleanup. A hard link where the filesystem
+        allows it, a copy otherwise.
+        """
+        path = os.path.join(
+            os.path.dirname(self.path), f"upload-{uuid.uuid4().hex}{os.path.splitext(self.path)[1]}"
+        )
+        try:
+            os.link(self.path, path)
+        except OSError:
+            shutil.copyfile(self.path, path)
+        return SpooledUpload(path, self.filename, self.content_type, self.size, self.sha256, self.file_id)
+
+
+class UploadTooLarge(HTTPException):
+    """413 for uploads over MAX_UPLOAD_BYTES."""
+
+    def __init__(self):
+        super().__init__(
+            status_code=413,
+            detail=f"File is larger than the {MAX_UPLOAD_BYTES / (1024 * 1024):g} MB limit",
+        )
+
+
+async def spool_upload(file, fs=None, max_bytes=MAX_UPLOAD_BYTES) -> SpooledUpload:
+    """
+    Streams an UploadFile chunk by chunk into a temp file, hashing it on the
+    way and, when `fs` is given, piping the same chunks into GridFS.
+    Only one chunk is held in memory at a time. Raises 413 as soon as the
+    file grows past max_bytes.
+    """
+    spool = tempfile.NamedTemporaryFile(
+        prefix="upload-", suffix=_SUFFIXES.get(file.content_type, ""), dir=UPLOAD_SPOOL_DIR, delete=False
+    )
+    digest = hashlib.sha256()
+    size = 0
+    grid_in = None
+    if fs is not None:
+        grid_in = fs.open_upload_stream(file.filename, metadata={"content_type": file.content_type})
+
+    try:
+        with timed("upload_read"):
+            while True:
+                chunk = await file.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > max_bytes:
+                    raise UploadTooLarge()
+                digest.update(chunk)
+                spool.write(chunk)
+                if grid_in is not None:
+                    await grid_in.write(chunk)
+        spool.close()
+
+        file_id = None
+        if grid_in is not None:
+            await grid_in.set(
+                "metadata", {"content_type": file.content_type, "sha256": digest.hexdigest()}
+            )
+            await grid_in.close()
+            file_id = grid_in._id
+    except BaseException:
+        spool.close()
+        os.unlink(spool.name)
+        if grid_in is not None:
+            try:
+                await grid_in.abort()
+            except Exception as e:
+                logging.error(f"Could not abort GridFS upload: {str(e)}")
+        raise
+
+    return SpooledUpload(spool.name, file.filename, file.content_type, size, digest.hexdigest(), file_id)
+
+
+def store_upload(fs, upload: SpooledUpload, file_id):
+    """
+    Returns a coroutine that copies a spooled upload into GridFS under a
+    pre-allocated file_id. The spool file is opened right away, so the caller
+    may clean it up before the copy has run.
+    """
+    source = open(upload.path, "rb")
+
+    async def copy():
+        try:
+            with timed("gridfs_write"):
+                await fs.upload_from_stream_with_id(
+                    file_id,
+                    upload.filename,
+                    source,
+                    metadata={"content_type": upload.content_type, "sha256": upload.sha256},
+                )
+        finally:
+            source.close()
+
+    return copy()
+
+
+async def spool_gridfs(fs, file_id) -> SpooledUpload:
+    """Copies a GridFS file to a temp file, chunk by chunk, for code that works on spooled uploads."""
+    grid_out = await fs.open_download_stream(file_id)
+    metadata = grid_out.metadata or {}
+    content_type = metadata.get("content_type")
+    spool = tempfile.NamedTemporaryFile(
+        prefix="upload-", suffix=_SUFFIXES.get(content_type, ""), dir=UPLOAD_SPOOL_DIR, delete=False
+    )
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with timed("gridfs_read"):
+            while True:
+                chunk = await grid_out.readchunk()
+                if not chunk:
+                    break
+                size += len(chunk)
+                digest.update(chunk)
+                spool.write(chunk)
+        spool.close()
+    except BaseException:
+        spool.close()
+        os.unlink(spool.name)
+        raise
+
+    return SpooledUpload(spool.name, grid_out.filename, content_type, size, digest.hexdigest(), file_id)
+
+
+class UploadSizeLimitMiddleware:
+    """
+    Rejects request bodies over MAX_UPLOAD_BYTES with 413, up front when the
+    client declares Content-Length and while the body streams in otherwise.
+    """
+
+    def __init__(self, app, max_bytes=MAX_UPLOAD_BYTES):
+        self.app = app
+        self.max_bytes = max_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        for name, value in scope["headers"]:
+            if name == b"content-length" and value.isdigit() and int(value) > self.max_bytes:
+                return await self._reject(send)
+
+        received = 0
+        response_started = False
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    # An HTTPException, so FastAPI's body parsing re-raises it as a 413
+                    raise UploadTooLarge()
+            return message
+
+        async def tracking_send(message):
+            nonlocal response_started
+            if message["type"] == "http.response.start":
+                response_started = True
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, tracking_send)
+        except UploadTooLarge:
+            if not response_started:
+                await self._reject(send)
+
+    async def _reject(self, send):
+        exc = UploadTooLarge()
+        await send({
+            "type": "http.response.start",
+            "status": exc.status_code,
+            "headers": [(b"content-type", b"application/json"), (b"connection", b"close")],
+        })
+        await send({"type": "http.response.body", "body": f'{{"detail":"{exc.detail}"}}'.encode()})
+
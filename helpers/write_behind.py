@@ -0,0 +1,205 @@
+import asyncio
+import logging
+import os
+import random
+import bson
+from bson import json_util
+from bson.errors import InvalidDocument
+from pymongo.errors import BulkWriteError, PyMongoError
+from helpers.metrics import ERRORS, timed
+
+# Documents written per insert_many
+WRITE_BATCH_SIZE = int(os.getenv("WRITE_BATCH_SIZE", 50))
+# Seconds to wait for more documents before writing a partial batch
+WRITE_FLUSH_INTERVAL = float(os.getenv("WRITE_FLUSH_INTERVAL", 0.2))
+# Attempts per batch before it goes to the local spool
+WRITE_MAX_RETRIES = int(os.getenv("WRITE_MAX_RETRIES", 5))
+# Documents held in memory before new ones go straight to the spool
+WRITE_QUEUE_LIMIT = int(os.getenv("WRITE_QUEUE_LIMIT", 10000))
+# Directory for the spool files that survive Mongo outages and restarts
+WRITE_SPOOL_DIR = os.getenv("WRITE_SPOOL_DIR", ".")
+
+DUPLICATE_KEY = 11000
+
+
+class WriteBehindQueue:
+    """
+    Buffers documents for one collection and writes them in batches from a
+    background task. Documents must carry their own _id so retries and
+    spool replays are idempotent: duplicate key errors count as written.
+    """
+
+    def __init__(self, collection_name: str):
+        self.collection_name = collection_name
+        self.spool_path = os.path.join(WRITE_SPOOL_DIR, f"{collection_name}-spool.jsonl")
+        # Documents BSON cannot encode, kept for a look by hand since no retry would write them
+        self.rejected_path = os.path.join(WRITE_SPOOL_DIR, f"{collection_name}-rejected.jsonl")
+        self._queue = asyncio.Queue(maxsize=WRITE_QUEUE_LIMIT)
+        self._collection = None
+        self._task = None
+        # Documents _run has taken off the queue and not yet written or spooled
+        self._batch = None
+
+    def put(self, doc: dict):
+        """Queues a document without waiting for Mongo."""
+        try:
+            self._queue.put_nowait(doc)
+        except asyncio.QueueFull:
+            logging.error(f"{self.collection_name} write queue full, spooling document {doc.get('_id')}")
+            self._spool([doc])
+
+    def pending(self):
+        return self._queue.qsize()
+
+    async def start(self, db):
+        self._collection = db[self.collection_name]
+        self._task = asyncio.create_task(self._run(self._take_spool()))
+
+    async def stop(self):
+        """
+        Writes whatever is still queued, and the batch the background task was
+        writing when it was stopped; anything that fails is spooled.
+        """
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        # Docs of a cancelled insert_many may already be in; they come back as duplicate keys
+        batch = self._batch or []
+        self._batch = None
+        while not self._queue.empty():
+            batch.append(self._queue.get_nowait())
+        if batch:
+            await self._write_or_spool(batch)
+
+    async def _run(self, replay_path=None):
+        if replay_path is not None:
+            try:
+                await self._replay_spool(replay_path)
+            except Exception as e:
+                # The replay file stays, for the next start
+                logging.error(f"Replaying the {self.collection_name} spool failed: {str(e)}")
+                ERRORS.inc(kind=f"{self.collection_name}_write")
+        while True:
+            batch = self._batch = [await self._queue.get()]
+            loop = asyncio.get_running_loop()
+            deadline = loop.time() + WRITE_FLUSH_INTERVAL
+            while len(batch) < WRITE_BATCH_SIZE:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            await self._write_or_spool(batch)
+            self._batch = None
+
+    async def _write_or_spool(self, batch):
+        """_write that never raises: a batch it fails on for any other reason is spooled, so the writer keeps going."""
+        try:
+            await self._write(batch)
+        except Exception as e:
+            logging.error(f"{self.collection_name} batch write failed, spooling {len(batch)} documents: {str(e)}")
+            ERRORS.inc(kind=f"{self.collection_name}_spooled")
+            try:
+                self._spool(batch)
+            except Exception as spool_error:
+                logging.error(f"Could not spool {self.collection_name} documents: {str(spool_error)}")
+
+    async def _write(self, batch):
+        attempt = 0
+        while attempt < WRITE_MAX_RETRIES:
+            try:
+                with timed(f"{self.collection_name}_insert"):
+                    await self._collection.insert_many(batch, ordered=False)
+                logging.info(f"Wrote {len(batch)} documents to {self.collection_name}")
+                return
+            except (InvalidDocument, OverflowError):
+                # Encoding fails before anything is sent; set the bad documents aside and retry the rest right away
+                batch = self._encodable(batch)
+                if self._batch is not None:
+                    self._batch = batch
+                if not batch:
+                    return
+                continue
+            except BulkWriteError as e:
+                failed = {
+                    error["index"] for error in e.details.get("writeErrors", []) if error.get("code") != DUPLICATE_KEY
+                }
+                if not failed and not e.details.get("writeConcernErrors"):
+                    return
+                if failed:
+                    batch = [doc for index, doc in enumerate(batch) if index in failed]
+                    if self._batch is not None:
+                        self._batch = batch
+                logging.error(f"{self.collection_name} batch write failed (attempt {attempt + 1}): {str(e)}")
+            except PyMongoError as e:
+                logging.error(f"{self.collection_name} batch write failed (attempt {attempt + 1}): {str(e)}")
+            ERRORS.inc(kind=f"{self.collection_name}_write")
+            # Exponential backoff with full jitter
+            await asyncio.sleep(random.uniform(0, min(30, 0.5 * 2 ** attempt)))
+            attempt += 1
+
+        logging.error(f"Giving up on {len(batch)} {self.collection_name} documents, spooling to {self.spool_path}")
+        ERRORS.inc(kind=f"{self.collection_name}_spooled")
+        self._spool(batch)
+
+    def _encodable(self, batch) -> list:
+        """The documents of a batch BSON can encode; the others go to the rejected file."""
+        encodable = []
+        for doc in batch:
+            try:
+                bson.encode(doc)
+            except (InvalidDocument, OverflowError) as e:
+                logging.error(
+                    f"Rejected {self.collection_name} document {doc.get('_id')}, "
+                    f"writing it to {self.rejected_path}: {str(e)}"
+                )
+                ERRORS.inc(kind=f"{self.collection_name}_rejected")
+                with open(self.rejected_path, "a") as f:
+                    f.write(json_util.dumps(doc, default=repr) + "\n")
+            else:
+                encodable.append(doc)
+        return encodable
+
+    def _spool(self, docs):
+        with open(self.spool_path, "a") as f:
+            for doc in docs:
+                f.write(json_util.dumps(doc) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _take_spool(self):
+        """
+        Moves the spool aside for replay, joining it to one whose replay did
+        not finish. Returns the replay file's path, or None if there is nothing
+        to replay.
+        """
+        replay_path = self.spool_path + ".replay"
+        if os.path.exists(self.spool_path):
+            if os.path.exists(replay_path):
+                with open(self.spool_path) as spool, open(replay_path, "a") as replay:
+                    replay.write(spool.read())
+                    replay.flush()
+                    os.fsync(replay.fileno())
+                os.unlink(self.spool_path)
+            else:
+                os.replace(self.spool_path, replay_path)
+        return replay_path if os.path.exists(replay_path) else None
+
+    async def _replay_spool(self, replay_path):
+        """
+        Writes documents left in the spool by a previous outage or process.
+        The replay file is only deleted once each of them is written or spooled
+        again, so a crash before then replays it on the next start.
+        """
+        with open(replay_path) as f:
+            docs = [json_util.loads(line) for line in f if line.strip()]
+        logging.info(f"Replaying {len(docs)} spooled {self.collection_name} documents")
+        for start in range(0, len(docs), WRITE_BATCH_SIZE):
+            await self._write(docs[start:start + WRITE_BATCH_SIZE])
+        os.unlink(replay_path)
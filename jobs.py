@@ -0,0 +1,287 @@
+import asyncio
+import logging
+import os
+import uuid
+from datetime import datetime, timedelta
+from bson import ObjectId
+from bson.errors import InvalidId
+from fastapi import HTTPException
+from fastapi.responses import StreamingResponse
+from pymongo import ReturnDocument
+from pymongo.errors import PyMongoError
+from helpers.metrics import ERRORS, STAGE_LATENCY, timed
+from helpers.serialization import BSONResponse, dumps
+
+# Jobs this process runs at once; 0 leaves the queue to other machines
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", 2))
+# Seconds a claimed job stays ours without a heartbeat; after that another worker may take it
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", 60))
+# Claims per job, including ones lost to crashes, before it is marked failed
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", 3))
+# Seconds an idle worker waits before looking for jobs enqueued by other processes
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", 1))
+# Seconds between status checks of an SSE stream
+JOB_EVENTS_INTERVAL = float(os.getenv("JOB_EVENTS_INTERVAL", 0.5))
+# Finished jobs are deleted by Mongo after this many seconds
+JOB_RETENTION_SECONDS = int(os.getenv("JOB_RETENTION_SECONDS", 7 * 24 * 3600))
+
+JOBS_COLLECTION = "jobs"
+FINISHED = ("done", "failed")
+SSE_KEEPALIVE_SECONDS = 15
+
+
+class JobFailed(Exception):
+    """Raised by a handler for errors that retrying cannot fix."""
+
+
+def _parse_job_id(job_id):
+    try:
+        return ObjectId(job_id)
+    except (InvalidId, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid job id")
+
+
+async def enqueue_job(db, kind: str, file_id, params: dict):
+    """Stores a queued job and returns its id; any JobRunner handling `kind` will pick it up."""
+    now = datetime.utcnow()
+    job = {
+        "_id": ObjectId(),
+        "kind": kind,
+        "status": "queued",
+        "file_id": file_id,
+        "params": params,
+        "attempts": 0,
+        "progress": None,
+        "created_at": now,
+        "not_before": now,
+    }
+    await db[JOBS_COLLECTION].insert_one(job)
+    return job["_id"]
+
+
+async def ensure_job_indexes(db):
+    """Indexes behind job claims, plus expiry of finished jobs."""
+    jobs_collection = db[JOBS_COLLECTION]
+    await jobs_collection.create_index([("status", 1), ("not_before", 1)])
+    await jobs_collection.create_index([("status", 1), ("lease_until", 1)])
+    await jobs_collection.create_index("finished_at", expireAfterSeconds=JOB_RETENTION_SECONDS)
+
+
+class JobRunner:
+    """
+    Runs queued jobs from the jobs collection with JOB_WORKERS tasks.
+    A claim is one find_one_and_update, so two workers never get the same job.
+    The claim sets a lease, and a heartbeat extends it while the job runs.
+    If a worker dies, its lease runs out and the job goes to whoever claims next.
+    Every claim counts as an attempt. After JOB_MAX_ATTEMPTS the job fails.
+
+    `handlers` maps a job kind to `async handler(job, progress)`, which
+    returns the job's result. `await progress(stage)` publishes how far it
+    got. A handler should be safe to run twice for the same job.
+    """
+
+    def __init__(self, handlers: dict):
+        self.handlers = handlers
+        self._collection = None
+        self._tasks = []
+        self._wakeup = None
+
+    async def start(self, db, workers=JOB_WORKERS):
+        self._collection = db[JOBS_COLLECTION]
+        self._wakeup = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._work()) for _ in range(workers)]
+        if workers:
+            logging.info(f"Started {workers} job workers")
+
+    async def stop(self):
+        """Cancels running jobs; they are handed back to the queue."""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def notify(self):
+        """Wakes idle workers after a job was enqueued by this process."""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _claim(self):
+        now = datetime.utcnow()
+        return await self._collection.find_one_and_update(
+            {
+                "kind": {"$in": list(self.handlers)},
+                "$or": [
+                    {"status": "queued", "not_before": {"$lte": now}},
+                    # Claimed by a worker that stopped renewing its lease
+                    {"status": "running", "lease_until": {"$lt": now}},
+                ],
+            },
+            {
+                "$set": {
+                    "status": "running",
+                    "lease": uuid.uuid4().hex,
+                    "lease_until": now + timedelta(seconds=JOB_LEASE_SECONDS),
+                    "started_at": now,
+                },
+                "$inc": {"attempts": 1},
+            },
+            sort=[("not_before", 1)],
+            return_document=ReturnDocument.AFTER,
+        )
+
+    async def _work(self):
+        while True:
+            try:
+                job = await self._claim()
+            except PyMongoError as e:
+                logging.error(f"Could not claim a job: {str(e)}")
+                ERRORS.inc(kind="job_claim")
+                job = None
+            if job is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), JOB_POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            try:
+                await self._run(job)
+            except PyMongoError as e:
+                # The lease runs out and the job is claimed again
+                logging.error(f"Could not record the outcome of job {job['_id']}: {str(e)}")
+                ERRORS.inc(kind="job_update")
+
+    async def _update(self, job, update):
+        """Applies update only while we still hold the job's lease."""
+        result = await self._collection.update_one({"_id": job["_id"], "lease": job["lease"]}, update)
+        if not result.matched_count:
+            logging.error(f"Lost the lease on job {job['_id']}")
+        return result.matched_count
+
+    async def _heartbeat(self, job):
+        while True:
+            await asyncio.sleep(JOB_LEASE_SECONDS / 3)
+            lease_until = datetime.utcnow() + timedelta(seconds=JOB_LEASE_SECONDS)
+            try:
+                await self._update(job, {"$set": {"lease_until": lease_until}})
+            except PyMongoError as e:
+                logging.error(f"Could not renew the lease on job {job['_id']}: {str(e)}")
+
+    async def _finish(self, job, status, **fields):
+        await self._update(job, {
+            "$set": {"status": status, "finished_at": datetime.utcnow(), "lease_until": None, **fields},
+        })
+
+    async def _retry_or_fail(self, job, error):
+        if job["attempts"] >= JOB_MAX_ATTEMPTS:
+            ERRORS.inc(kind="job_failed")
+            await self._finish(job, "failed", error=error)
+            return
+        ERRORS.inc(kind="job_retry")
+        # Back off a little so a busy pool gets time to drain
+        not_before = datetime.utcnow() + timedelta(seconds=min(30, 2 ** job["attempts"]))
+        await self._update(job, {"$set": {"status": "queued", "not_before": not_before, "lease_until": None}})
+
+    async def _run(self, job):
+        if job["attempts"] > JOB_MAX_ATTEMPTS:
+            # Its previous claims all ended without an answer, e.g. the job keeps crashing workers
+            ERRORS.inc(kind="job_failed")
+            await self._finish(job, "failed", error="Job was abandoned too many times")
+            return
+        STAGE_LATENCY.observe((job["started_at"] - job["created_at"]).total_seconds(), stage="job_queue_wait")
+
+        async def progress(stage):
+            await self._update(job, {"$set": {"progress": stage}})
+
+        heartbeat = asyncio.create_task(self._heartbeat(job))
+        try:
+            with timed(f"job_{job['kind']}"):
+                result = await self.handlers[job["kind"]](job, progress)
+            await self._finish(job, "done", result=result, progress=None)
+        except asyncio.CancelledError:
+            # Shutting down: hand the job back without counting the attempt
+            await asyncio.shield(self._update(job, {
+                "$set": {"status": "queued", "lease_until": None}, "$inc": {"attempts": -1},
+            }))
+            raise
+        except (JobFailed, ValueError) as e:
+            await self._finish(job, "failed", error=str(e))
+        except HTTPException as e:
+            # 4xx are about the input; 5xx (busy pool, timeouts) may pass on a later attempt
+            if e.status_code < 500:
+                await self._finish(job, "failed", error=e.detail)
+            else:
+                await self._retry_or_fail(job, e.detail)
+        except Exception as e:
+            logging.error(f"Job {job['_id']} failed (attempt {job['attempts']}): {str(e)}")
+            await self._retry_or_fail(job, "Internal server error")
+        finally:
+            heartbeat.cancel()
+
+
+def public_job(job):
+    """The parts of a job document a client may see."""
+    state = {
+        "job_id": job["_id"],
+        "kind": job["kind"],
+        "status": job["status"],
+        "progress": job.get("progress"),
+        "attempts": job.get("attempts", 0),
+        "created_at": job["created_at"],
+        "started_at": job.get("started_at"),
+        "finished_at": job.get("finished_at"),
+    }
+    if job["status"] == "done":
+        state["result"] = job.get("result")
+    elif job["status"] == "failed":
+        state["error"] = job.get("error")
+    return state
+
+
+async def get_job(db, job_id):
+    job = await db[JOBS_COLLECTION].find_one({"_id": _parse_job_id(job_id)})
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return BSONResponse({"success": True, "data": public_job(job)})
+
+
+async def job_events(db, job_id, request=None):
+    """
+    Server-Sent Events for one job: a `queued` or `running` event whenever its
+    status or progress changes, then one `done` or `failed` event with the
+    result, after which the stream ends.
+    """
+    jobs_collection = db[JOBS_COLLECTION]
+    job_object_id = _parse_job_id(job_id)
+    job = await jobs_collection.find_one({"_id": job_object_id})
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    async def events(job):
+        loop = asyncio.get_running_loop()
+        last_state = None
+        last_sent = loop.time()
+        while True:
+            state = public_job(job)
+            if state != last_state:
+                yield f"event: {job['status']}\ndata: ".encode() + dumps(state) + b"\n\n"
+                last_state = state
+                last_sent = loop.time()
+            elif loop.time() - last_sent >= SSE_KEEPALIVE_SECONDS:
+                # A comment line keeps proxies from closing an idle stream
+                yield b": keep-alive\n\n"
+                last_sent = loop.time()
+            if job["status"] in FINISHED:
+                return
+            if request is not None and await request.is_disconnected():
+                return
+            await asyncio.sleep(JOB_EVENTS_INTERVAL)
+            job = await jobs_collection.find_one({"_id": job_object_id})
+            if job is None:
+                return
+
+    return StreamingResponse(
+        events(job),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
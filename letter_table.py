@@ -0,0 +1,155 @@
+import numpy as np
+
+
+def _sequential_sum(values: np.ndarray) -> float:
+    # Same left-to-right order as the builtin sum(), so scaled sizes stay bit-identical
+    return float(np.add.accumulate(values)[-1]) if len(values) else 0.0
+
+
+class LetterTable:
+    """
+    Unscaled letter boxes stored column-wise, one NumPy array per field.
+    Text extraction fills every column; image detection has no glyphs, so
+    `letters` is None and font sizes are the box heights. Outlined PDFs
+    have float boxes like text, but every letter is "?" and font sizes are
+    the glyph heights.
+    """
+
+    __slots__ = ("letters", "x", "y", "widths", "heights", "font_sizes")
+
+    def __init__(self, letters, x, y, widths, heights, font_sizes):
+        self.letters = letters
+        self.x = x
+        self.y = y
+        self.widths = widths
+        self.heights = heights
+        self.font_sizes = font_sizes
+
+    def __len__(self):
+        return len(self.widths)
+
+    @classmethod
+    def from_text_records(cls, records: list):
+        """Builds a table from extract_text_* style letter/x/y/w/h/font_size dicts."""
+        return cls(
+            np.array([r["letter"] for r in records], dtype=str),
+            np.array([r["x"] for r in records], dtype=np.float64),
+            np.array([r["y"] for r in records], dtype=np.float64),
+            np.array([r["w"] for r in records], dtype=np.float64),
+            np.array([r["h"] for r in records], dtype=np.float64),
+            np.array([r["font_size"] for r in records], dtype=np.float64),
+        )
+
+    @classmethod
+    def from_boxes(cls, boxes):
+        """Builds a table from an (n, 4) array or list of (x, y, w, h) image boxes."""
+        boxes = np.asarray(boxes, dtype=np.int64).reshape(-1, 4)
+        heights = boxes[:, 3].copy()
+        return cls(None, boxes[:, 0].copy(), boxes[:, 1].copy(), boxes[:, 2].copy(), heights, heights)
+
+    @classmethod
+    def from_columns(cls, columns: dict):
+        """Inverse of to_columns, used when reading the table back from Mongo."""
+        letters = columns.get("letters")
+        dtype = np.float64 if letters is not None else np.int64
+        return cls(
+            np.array(letters, dtype=str) if letters is not None else None,
+            *(np.array(columns[name], dtype=dtype) for name in ("x", "y", "widths", "heights", "font_sizes")),
+        )
+
+    @classmethod
+    def concat(cls, tables: list):
+        """Stacks tables of the same kind, e.g. one per page, keeping their order."""
+        if len(tables) == 1:
+            return tables[0]
+        return cls(
+            None if tables[0].letters is None else np.concatenate([t.letters for t in tables]),
+            *(
+                np.concatenate([getattr(t, name) for t in tables])
+                for name in ("x", "y", "widths", "heights", "font_sizes")
+            ),
+        )
+
+    def to_columns(self) -> dict:
+        """Plain lists per column, for BSON/JSON storage."""
+        return {
+            "letters": self.letters.tolist() if self.letters is not None else None,
+            "x": self.x.tolist(),
+            "y": self.y.tolist(),
+            "widths": self.widths.tolist(),
+            "heights": self.heights.tolist(),
+            "font_sizes": self.font_sizes.tolist(),
+        }
+
+    def scale_text(self, target_length, target_height):
+        """
+        Scales text glyphs: widths share target_length and the largest font
+        size becomes target_height.
+        """
+        if not len(self):
+            return ScaledLetters.empty()
+
+        max_font_size = self.font_sizes.max()
+        total_width = _sequential_sum(self.widths)
+        width_ratio = target_length / total_width if total_width > 0 else 1
+        height_ratio = target_height / max_font_size if max_font_size > 0 else 1
+
+        # str.upper per distinct letter: np.char.upper keeps the <U1 width and cuts "ß" -> "SS" to "S"
+        distinct, index = np.unique(self.letters, return_inverse=True)
+        return ScaledLetters(
+            np.array([letter.upper() for letter in distinct.tolist()], dtype=str)[index],
+            (self.widths * width_ratio).astype(np.int64),
+            (self.font_sizes * height_ratio).astype(np.int64),
+        )
+
+    def scale_boxes(self, target_length, target_height):
+        """
+        Scales image boxes: widths share target_length and the tallest box
+        becomes target_height. Letters are numbered from 1 in box order.
+        """
+        if not len(self):
+            return ScaledLetters.empty()
+
+        width_ratio = target_length / _sequential_sum(self.widths)
+        height_ratio = target_height / self.heights.max()
+
+        return ScaledLetters(
+            np.arange(1, len(self) + 1),
+            (self.widths * width_ratio).astype(np.int64),
+            (height_ratio * self.heights).astype(np.int64),
+        )
+
+
+class ScaledLetters:
+    """Scaled letters as columns; dicts are only built for the JSON response."""
+
+    __slots__ = ("letters", "scaled_length", "scaled_height")
+
+    def __init__(self, letters, scaled_length, scaled_height):
+        self.letters = letters
+        self.scaled_length = scaled_length
+        self.scaled_height = scaled_height
+
+    def __len__(self):
+        return len(self.scaled_height)
+
+    @classmethod
+    def empty(cls):
+        return cls(np.array([], dtype=str), np.array([], dtype=np.int64), np.array([], dtype=np.int64))
+
+    @classmethod
+    def from_records(cls, records: list):
+        """Accepts the list-of-dicts form the calculators used to take."""
+        return cls(
+            np.array([r["letter"] for r in records], dtype=object),
+            np.array([r["scaled_length"] for r in records]),
+            np.array([r["scaled_height"] for r in records]),
+        )
+
+    def to_records(self) -> list:
+        return [
+            {"letter": letter, "scaled_length": length, "scaled_height": height}
+            for letter, length, height in zip(
+                self.letters.tolist(), self.scaled_length.tolist(), self.scaled_height.tolist()
+            )
+        ]
@@ -1,25 +1,31 @@
+from contextlib import asynccontextmanager
 from datetime import datetime
-from fastapi import FastAPI, File, UploadFile, Form, HTTPException
-import cv2
-from helpers.converters import convert_objectid
-import numpy as np
-import fitz  # PyMuPDF
-from io import BytesIO
+from fastapi import FastAPI, File, UploadFile, Form, HTTPException, Request, Query
+from fastapi.responses import StreamingResponse, PlainTextResponse
+from typing import List, Optional
+from helpers.serialization import BSONResponse, check_storable, dumps
+from helpers.pool import shutdown_pool, idle_workers
+from helpers.admission import AdmissionControlMiddleware, admission
+from helpers.metrics import MetricsMiddleware, Gauge, ERRORS, render as render_metrics
+from helpers.cache import cache_stats, ensure_cache_indexes
+from helpers.uploads import spool_upload, spool_gridfs, store_upload, UploadSizeLimitMiddleware
+from helpers.write_behind import WriteBehindQueue
+from extraction import scale_letters
+from pipeline import get_letter_boxes, warm_up_extraction, EXTRACTION_WARMUP, PDF_PARALLEL_JOBS
 import logging
-from pdfminer.high_level import extract_pages
-from pdfminer.layout import LTTextBox, LTTextLine, LTChar
-from price_calculater import Aluminium_Doosletter_Price_calculator , Profiel2_Price_calculator , Profiel3_LUX_Price_calculator ,Profiel4_Price_calculator , Profiel5_Price_calculator , Profiel5_LUX_Price_calculator
+from price_calculater import get_pricer, quote_price, watch_profiles, PRICING_PROFILES_FROM_DB
 from fastapi.middleware.cors import CORSMiddleware
-from motor.motor_asyncio import AsyncIOMotorClient
-from pymongo import MongoClient
-from gridfs import GridFS
-import logging
-from motor.motor_asyncio import AsyncIOMotorGridFSBucket
-from orders import fetch_orders, get_order_by_id, delete_order
+from jobs import JobRunner, enqueue_job, ensure_job_indexes, get_job, job_events
+from orders import fetch_orders, stream_orders, get_order_by_id, delete_order, ensure_order_indexes, ORDERS_PAGE_SIZE, ORDERS_MAX_PAGE_SIZE, HEAVY_ORDER_FIELDS
 from fileRouters import download_file , delete_file
-from userRouters import add_user, edit_user, delete_user, payment_completed, get_all_users, get_one_user
-from payment import create_mollie_payment, PaymentRequest
+from previews import generate_previews, get_preview, ensure_preview_indexes, PREVIEW_BUCKET, PREVIEW_SIZES
+from userRouters import (
+    add_user, edit_user, delete_user, payment_completed, get_all_users, get_one_user,
+    USERS_PAGE_SIZE, USERS_MAX_PAGE_SIZE
+)
+from payment import create_mollie_payment, init_mollie_client, close_mollie_client, PaymentRequest
 from bson import ObjectId
+import asyncio
 import json
 import os
 from dotenv import load_dotenv
@@ -29,165 +35,167 @@ load_dotenv()
 MONGODB_URI = os.getenv("DATABASE_KEY")
 DB_NAME = "marketplace"  # Replace with your actual database name
 
-try:
-    # Async connection for FastAPI
-    # print("DATABASE URI is " , MONGODB_URI )
-    async_client = AsyncIOMotorClient(MONGODB_URI)
-    db = async_client[DB_NAME]
+# Set by the lifespan hook; assign them before startup to run against another database
+async_client = None
+db = None
+fs = None
+previews_fs = None
 
-    # Sync connection for GridFS
-    sync_client = MongoClient(MONGODB_URI)
-    sync_db = sync_client[DB_NAME]
 
-    # Async GridFS Bucket
-    fs = AsyncIOMotorGridFSBucket(db)
+def connect_mongo():
+    """Creates the Motor client and GridFS buckets. Motor connects lazily, on the first query."""
+    global async_client, db, fs, previews_fs
+    from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorGridFSBucket
 
-    logging.info("MongoDB connection successful.")
-except Exception as e:
-    logging.error(f"Error connecting to MongoDB: {str(e)}")
-    raise
+    try:
+        async_client = AsyncIOMotorClient(MONGODB_URI)
+        db = async_client[DB_NAME]
+        fs = AsyncIOMotorGridFSBucket(db)
+        previews_fs = AsyncIOMotorGridFSBucket(db, bucket_name=PREVIEW_BUCKET)
+        logging.info("MongoDB client created.")
+    except Exception as e:
+        logging.error(f"Error connecting to MongoDB: {str(e)}")
+        raise
 
-orders_collection = db["orders"]
 
-app = FastAPI()
+background_tasks = set()
+# GridFS copies and order saves that may outlive their request
+persistence_tasks = set()
+order_writer = WriteBehindQueue("orders")
 
-app = FastAPI()
+Gauge("order_write_queue_pending", "Orders waiting to be written to Mongo.", function=order_writer.pending)
+Gauge("background_tasks", "GridFS copies and order saves still running.", function=lambda: len(persistence_tasks))
 
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["https://banner-nu-seven.vercel.app/" ,"https://banner-nu-seven.vercel.app", "http://localhost:5173"],  # Allow frontend
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
 
+def run_in_background(coro, tasks=background_tasks):
+    """Runs a coroutine outside the request, keeping a reference until it is done."""
+    task = asyncio.create_task(coro)
+    tasks.add(task)
+    task.add_done_callback(tasks.discard)
+    return task
 
-def extract_image_or_text(file_bytes: bytes, content_type: str):
-    """
-    Extracts either an image or text from a given file.
-    If an image is found in a PDF, it extracts the image.
-    Otherwise, it extracts text with font size.
-    """
+
+async def save_order(stored, order_data):
+    """Queues the order once its file is in GridFS."""
     try:
-        if content_type == "application/pdf":
-            doc = fitz.open(stream=BytesIO(file_bytes))
-            if len(doc) == 0:
-                raise ValueError("Empty PDF document")
-
-            for page_num in range(len(doc)):
-                page = doc.load_page(page_num)
-                images = page.get_images(full=True)
-
-                if images:
-                    # Extract first image found in the document
-                    img_index = images[0][0]  # First image index
-                    base_image = doc.extract_image(img_index)
-                    image_bytes = base_image["image"]
-                    img_array = np.frombuffer(image_bytes, dtype=np.uint8)
-                    image = cv2.imdecode(img_array, cv2.IMREAD_COLOR)
-                    return "image", image
-
-            # If no images found, extract text with font size
-            text_data = []
-            for page_layout in extract_pages(BytesIO(file_bytes)):
-                for element in page_layout:
-                    if isinstance(element, (LTTextBox, LTTextLine)):
-                        for text_line in element:
-                            if isinstance(text_line, LTTextLine):
-                                for char in text_line:
-                                    if isinstance(char, LTChar) and char.get_text().strip():
-                                        text_data.append({
-                                            "letter": char.get_text(),
-                                            "x": char.bbox[0],
-                                            "y": char.bbox[1],
-                                            "w": char.bbox[2] - char.bbox[0],
-                                            "h": char.bbox[3] - char.bbox[1],
-                                            "font_size": char.size
-                                        })
-            
-            if not text_data:
-                raise ValueError("No images or text found in the PDF")
-
-            return "text", text_data
-
-        if content_type in ["image/jpeg", "image/png"]:
-            image = cv2.imdecode(np.frombuffer(file_bytes, np.uint8), cv2.IMREAD_COLOR)
-            if image is None:
-                raise ValueError("Failed to decode image")
-            return "image", image
-
-        raise ValueError("Unsupported file format")
+        await stored
     except Exception as e:
-        logging.error(f"File extraction error: {str(e)}")
-        raise
+        logging.error(f"GridFS upload for order {order_data['_id']} failed: {str(e)}")
+        ERRORS.inc(kind="gridfs_write")
+        order_data["file_id"] = None
+    order_writer.put(order_data)
 
-def scale_text_data(letter_boxes, target_length, target_height):
-    """
-    Scales letters extracted from text data.
-    The letter with the maximum font size is set to 100%, and others are scaled accordingly.
-    """
-    if not letter_boxes:
-        return []
-
-    max_font_size = max(letter["font_size"] for letter in letter_boxes)
-
-    # Calculate total width of text
-    total_width = sum(letter["w"] for letter in letter_boxes)
-    width_ratio = target_length / total_width if total_width > 0 else 1
-    height_ratio = target_height / max_font_size if max_font_size > 0 else 1
-
-    letters = []
-    for letter in letter_boxes:
-        letters.append({
-            "letter": letter["letter"].upper(),
-            "scaled_length": int(letter["w"] * width_ratio),
-            "scaled_height": int(letter["font_size"] * height_ratio)
-        })
-
-    return letters
 
-def process_image(image: np.ndarray, target_length: int, target_height: int) -> list:
+async def save_previews(stored, upload, file_id, data_type, letter_boxes, pages):
     """
-    Processes an image to detect individual letters and scale them accordingly.
+    Renders the previews of an upload once its file is in GridFS, if the
+    extraction pool has a worker to spare. When it has not, or this fails,
+    they are rendered on their first request instead.
     """
     try:
-        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-        _, thresh = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
-
-        kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (3,3))
-        cleaned = cv2.morphologyEx(thresh, cv2.MORPH_CLOSE, kernel, iterations=2)
+        await stored
+        await generate_previews(
+            fs, previews_fs, file_id, upload, letter_boxes, data_type, pages, only_when_idle=True
+        )
+    except Exception as e:
+        logging.error(f"Previews for file {file_id} failed: {str(e)}")
+        ERRORS.inc(kind="preview")
+    finally:
+        upload.cleanup()
 
-        contours, _ = cv2.findContours(cleaned, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
 
-        letter_boxes = []
-        min_area = 500
-        max_aspect_ratio = 3.0
+async def run_detect_job(job, progress):
+    """Background twin of /detect-letters/; the job id doubles as the order id, so a rerun saves one order."""
+    params = job["params"]
+    await progress("downloading")
+    upload = await spool_gridfs(fs, job["file_id"])
+    try:
+        await progress("extracting")
+        data_type, letter_boxes = await get_letter_boxes(db, upload, None, params["first_page"], params["last_page"])
+    finally:
+        upload.cleanup()
 
-        for contour in contours:
-            x, y, w, h = cv2.boundingRect(contour)
-            area = w * h
-            aspect_ratio = w / float(h)
+    await progress("pricing")
+    letters = scale_letters(data_type, letter_boxes, params["target_length"], params["target_height"])
+    pricer = get_pricer(params["profile"])
+    result_data = pricer(letters, params["options"]) if pricer else []
 
-            if area > min_area and aspect_ratio < max_aspect_ratio:
-                letter_boxes.append((x, y, w, h))
+    order_writer.put({
+        "_id": job["_id"],
+        "file_id": job["file_id"],
+        "target_length": params["target_length"],
+        "target_height": params["target_height"],
+        "first_page": params["first_page"],
+        "last_page": params["last_page"],
+        "profile": params["profile"],
+        "original_data": params["options"],
+        "prices": result_data,
+        "timestamp": datetime.utcnow()
+    })
+    return {"data": result_data, "order_id": job["_id"]}
 
-        letter_boxes.sort(key=lambda b: (b[0], b[1]))
 
-        scaled_widths = [int(w * (target_length / sum(w for _, _, w, _ in letter_boxes))) for _, _, w, _ in letter_boxes]
-        heights = [h for _, _, _, h in letter_boxes]
+job_runner = JobRunner({"detect-letters": run_detect_job})
 
-        letters = []
-        for idx, (w, h) in enumerate(zip(scaled_widths, heights)):
-            letters.append({
-                "letter": idx + 1,
-                "scaled_length": w,
-                "scaled_height": int((target_height / max(heights)) * h)
-            })
 
-        return letters
+async def create_indexes():
+    try:
+        await ensure_cache_indexes(db)
+        await ensure_order_indexes(db)
+        await ensure_job_indexes(db)
+        await ensure_preview_indexes(db)
     except Exception as e:
-        logging.error(f"Image processing error: {str(e)}")
-        raise
+        logging.error(f"Could not create indexes: {str(e)}")
+
+
+@asynccontextmanager
+async def lifespan(app):
+    if db is None:
+        connect_mongo()
+    init_mollie_client()
+
+    # Nothing below waits on Mongo, so the first request is served right away
+    run_in_background(create_indexes())
+    if PRICING_PROFILES_FROM_DB:
+        run_in_background(watch_profiles(db))
+    await order_writer.start(db)
+    await job_runner.start(db)
+    if EXTRACTION_WARMUP:
+        run_in_background(warm_up_extraction())
+
+    yield
+
+    # Interrupted jobs go back to the queue before the pool goes away
+    await job_runner.stop()
+    shutdown_pool()
+    # Let pending GridFS copies finish so their orders reach the queue
+    if persistence_tasks:
+        await asyncio.wait(list(persistence_tasks), timeout=30)
+    await order_writer.stop()
+    for task in list(background_tasks):
+        task.cancel()
+    await close_mollie_client()
+    if async_client is not None:
+        async_client.close()
+
+
+# Routes returning BSONResponse directly also skip FastAPI's jsonable_encoder pass
+app = FastAPI(default_response_class=BSONResponse, lifespan=lifespan)
+
+# Added before CORS so that 413 responses still carry CORS headers
+app.add_middleware(UploadSizeLimitMiddleware)
+# Outside the size limit, so shed requests are answered before their body is read
+app.add_middleware(AdmissionControlMiddleware)
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=["https://banner-nu-seven.vercel.app/" ,"https://banner-nu-seven.vercel.app", "http://localhost:5173"],  # Allow frontend
+    allow_credentials=True,
+    allow_methods=["*"],
+    allow_headers=["*"],
+)
+# Outermost, so rejected and CORS preflight requests are counted too
+app.add_middleware(MetricsMiddleware)
+
 
 # ---------------------------------------------------------------------------
 #  All Routes
@@ -196,157 +204,296 @@ def process_image(image: np.ndarray, target_length: int, target_height: int) ->
 
 @app.post("/detect-letters/")
 async def detect_letters(
+    request: Request,
     file: UploadFile = File(...),
     profile: str = Form(...),
     data: str = Form(...),
     target_length: int = Form(200),
-    target_height: int = Form(100)
+    target_height: int = Form(100),
+    first_page: Optional[int] = Form(None),
+    last_page: Optional[int] = Form(None)
 ):
+    upload = None
     try:
-        file_bytes = await file.read()
-
-#         file_id = fs.put(
-#     file_bytes,
-#     filename=file.filename,
-#     content_type=file.content_type
-# )
-        file_id = await fs.upload_from_stream(
-            file.filename, BytesIO(file_bytes), metadata={"content_type": file.content_type}
-        )
-
-
-        data_type, extracted_data = extract_image_or_text(file_bytes, file.content_type)
-
-        
-        if data_type == "image":
-            letters = process_image(extracted_data, target_length, target_height)
-            # print("Letters are " , letters)
-        else:
-            letters = scale_text_data(extracted_data, target_length, target_height)
-            # print("Letters are " , letters)
-
-            
-        if profile == "Aluminium Doosletter":
-            prices = Aluminium_Doosletter_Price_calculator(letters, data)
-            result_data = prices
+        upload = await spool_upload(file)
+        # Ids are allocated here so storage and the order write can finish after we respond
+        file_id = ObjectId()
+        order_id = ObjectId()
+        # The GridFS copy runs while the file is analysed
+        stored = run_in_background(store_upload(fs, upload, file_id), persistence_tasks)
 
-        elif profile == "Profiel 2" or profile == "Profiel 3":
-            prices = Profiel2_Price_calculator(letters, data)
-            result_data = prices
+        data_type, letter_boxes = await get_letter_boxes(db, upload, request, first_page, last_page)
+        letters = scale_letters(data_type, letter_boxes, target_length, target_height)
 
-        elif profile == "Profiel3 LUX":
-            prices = Profiel3_LUX_Price_calculator(letters, data)
-            result_data = prices
+        options = json.loads(data)
+        pricer = get_pricer(profile)
+        result_data = pricer(letters, options) if pricer else []
 
-        elif profile == "Profiel4":
-            prices = Profiel4_Price_calculator(letters, data)
-            result_data = prices
-
-        elif profile == "Profiel5":
-            prices = Profiel5_Price_calculator(letters, data)
-            result_data = prices
-
-        elif profile == "Profiel5 LUX":
-            prices = Profiel5_LUX_Price_calculator(letters, data)
-            result_data = prices
-
-        
-        else:
-            result_data = []
-        
         order_data = {
+            "_id": order_id,
             "file_id": file_id,
             "target_length": target_length,
             "target_height": target_height,
+            "first_page": first_page,
+            "last_page": last_page,
             "profile": profile,
-            "original_data": json.loads(data),
+            "original_data": options,
             "prices": result_data,
             "timestamp": datetime.utcnow()
         }
+        # Written after the response, so a document the writer would reject is a 400 now
+        check_storable(order_data)
 
-        order_id = await db.orders.insert_one(order_data)
-        print("Created order with ID:", order_id.inserted_id)
+        # A link to the spooled file, which is deleted when this request ends
+        run_in_background(save_previews(
+            stored, upload.link(), file_id, data_type, letter_boxes, (first_page, last_page)
+        ))
+        run_in_background(save_order(stored, order_data), persistence_tasks)
 
-        return {
+        return BSONResponse({
             "success" : True,
             "data": result_data,
-            "order_id": str(order_id.inserted_id)
-        }
+            "order_id": order_id
+        })
+    except HTTPException:
+        raise
     except ValueError as e:
         raise HTTPException(400, detail=str(e))
     except Exception as e:
         logging.error(f"Unexpected error: {str(e)}")
+        ERRORS.inc(kind="unexpected")
         raise HTTPException(500, detail="Internal server error")
     finally:
+        if upload is not None:
+            upload.cleanup()
         await file.close()
 
 @app.post("/get-price/")
 async def getPrice(
+    request: Request,
     file: UploadFile = File(...),
     profile: str = Form(...),
     data: str = Form(...),
     target_length: int = Form(200),
-    target_height: int = Form(100)
+    target_height: int = Form(100),
+    first_page: Optional[int] = Form(None),
+    last_page: Optional[int] = Form(None)
 ):
+    upload = None
     try:
-        file_bytes = await file.read()
-
-        data_type, extracted_data = extract_image_or_text(file_bytes, file.content_type)
-        
-        if data_type == "image":
-            letters = process_image(extracted_data, target_length, target_height)
-        else:
-            letters = scale_text_data(extracted_data, target_length, target_height)
-            
-        if profile == "Aluminium Doosletter":
-            prices = Aluminium_Doosletter_Price_calculator(letters, data)
-            result_data = prices["totalPrice"]
-
-        elif profile == "Profiel 2" or profile == "Profiel 3":
-            prices = Profiel2_Price_calculator(letters, data)
-            result_data = prices["totalPrice"]
-        
-        elif profile == "Profiel3 LUX":
-            prices = Profiel3_LUX_Price_calculator(letters, data)
-            result_data = prices
-
-        elif profile == "Profiel4":
-            prices = Profiel4_Price_calculator(letters, data)
-            result_data = prices
-
-        elif profile == "Profiel5":
-            prices = Profiel5_Price_calculator(letters, data)
-            result_data = prices
-
-        elif profile == "Profiel5 LUX":
-            prices = Profiel5_LUX_Price_calculator(letters, data)
-            result_data = prices
-
-        else:
-            result_data = 0
-
-        return {
+        upload = await spool_upload(file)
+
+        data_type, letter_boxes = await get_letter_boxes(db, upload, request, first_page, last_page)
+        letters = scale_letters(data_type, letter_boxes, target_length, target_height)
+
+        result_data = quote_price(profile, letters, data)
+
+        return BSONResponse({
             "success" : True,
             "data": result_data
-        }
+        })
+    except HTTPException:
+        raise
     except ValueError as e:
         raise HTTPException(400, detail=str(e))
     except Exception as e:
         logging.error(f"Unexpected error: {str(e)}")
+        ERRORS.inc(kind="unexpected")
         raise HTTPException(500, detail="Internal server error")
     finally:
+        if upload is not None:
+            upload.cleanup()
         await file.close()
 
 
+@app.post("/get-prices/batch")
+async def get_prices_batch(
+    files: List[UploadFile] = File(...),
+    variants: str = Form(...),
+    first_page: Optional[int] = Form(None),
+    last_page: Optional[int] = Form(None)
+):
+    """
+    Quotes one or more files for many option sets in one request.
+    `variants` is a JSON list of {profile, data, target_length, target_height}.
+    Each file is extracted once; one NDJSON line per file and variant is
+    streamed back as soon as that file is done.
+    """
+    uploads = []
+    try:
+        variant_list = json.loads(variants)
+        if not isinstance(variant_list, list) or not variant_list:
+            raise ValueError("variants must be a non-empty JSON list")
+        if not all(isinstance(variant, dict) and "profile" in variant for variant in variant_list):
+            raise ValueError("every variant needs a profile")
+        # Uploads are closed once this handler returns, before the body streams
+        for file in files:
+            uploads.append(await spool_upload(file))
+    except (ValueError, HTTPException) as e:
+        for upload in uploads:
+            upload.cleanup()
+        if isinstance(e, HTTPException):
+            raise
+        raise HTTPException(400, detail=str(e))
+    finally:
+        for file in files:
+            await file.close()
+
+    # Files are analysed a few at a time, sized to the idle workers, so the batch does not trip the pool's 503
+    jobs_per_file = PDF_PARALLEL_JOBS if any(upload.content_type == "application/pdf" for upload in uploads) else 1
+    in_flight = asyncio.Semaphore(max(1, idle_workers() // max(1, jobs_per_file)))
+
+    async def analyse(index, upload):
+        try:
+            async with in_flight:
+                return index, await get_letter_boxes(db, upload, None, first_page, last_page), None
+        except HTTPException as e:
+            return index, None, e.detail
+        except ValueError as e:
+            return index, None, str(e)
+        except Exception as e:
+            logging.error(f"Unexpected error: {str(e)}")
+            ERRORS.inc(kind="unexpected")
+            return index, None, "Internal server error"
+
+    def quote_variant(data_type, letter_boxes, variant):
+        letters = scale_letters(
+            data_type,
+            letter_boxes,
+            int(variant.get("target_length", 200)),
+            int(variant.get("target_height", 100)),
+        )
+        return quote_price(variant["profile"], letters, variant.get("data", "{}"))
+
+    async def stream_quotes():
+        tasks = [asyncio.create_task(analyse(index, upload)) for index, upload in enumerate(uploads)]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                index, extracted, error = await next_done
+                line = {"file_index": index, "filename": uploads[index].filename}
+                if error is not None:
+                    yield dumps({**line, "success": False, "error": error}) + b"\n"
+                    continue
+
+                data_type, letter_boxes = extracted
+                for variant_index, variant in enumerate(variant_list):
+                    try:
+                        result = {"success": True, "data": quote_variant(data_type, letter_boxes, variant)}
+                    except (ValueError, TypeError) as e:
+                        result = {"success": False, "error": str(e)}
+                    except Exception as e:
+                        logging.error(f"Unexpected error quoting variant {variant_index}: {str(e)}")
+                        ERRORS.inc(kind="unexpected")
+                        result = {"success": False, "error": "Internal server error"}
+                    yield dumps({**line, "variant_index": variant_index, **result}) + b"\n"
+        finally:
+            for task in tasks:
+                task.cancel()
+            for upload in uploads:
+                upload.cleanup()
+
+    return StreamingResponse(stream_quotes(), media_type="application/x-ndjson")
+
+
+@app.post("/jobs/detect-letters", status_code=202)
+async def create_detect_job(
+    file: UploadFile = File(...),
+    profile: str = Form(...),
+    data: str = Form(...),
+    target_length: int = Form(200),
+    target_height: int = Form(100),
+    first_page: Optional[int] = Form(None),
+    last_page: Optional[int] = Form(None)
+):
+    """
+    Queues /detect-letters/ work and answers right away with a job id.
+    Follow the job with GET /jobs/{job_id} or the SSE stream at
+    GET /jobs/{job_id}/events; the result matches /detect-letters/.
+    """
+    upload = None
+    try:
+        options = json.loads(data)
+        check_storable(options)
+        # Workers may run on another machine, so the file goes straight to GridFS
+        upload = await spool_upload(file, fs)
+        job_id = await enqueue_job(db, "detect-letters", upload.file_id, {
+            "profile": profile,
+            "options": options,
+            "target_length": target_length,
+            "target_height": target_height,
+            "first_page": first_page,
+            "last_page": last_page,
+        })
+    except HTTPException:
+        raise
+    except ValueError as e:
+        raise HTTPException(400, detail=str(e))
+    except Exception as e:
+        logging.error(f"Could not queue job: {str(e)}")
+        ERRORS.inc(kind="unexpected")
+        raise HTTPException(500, detail="Internal server error")
+    finally:
+        if upload is not None:
+            upload.cleanup()
+        await file.close()
+
+    job_runner.notify()
+    return BSONResponse(
+        {"success": True, "job_id": job_id, "status": "queued"},
+        status_code=202,
+        headers={"Location": f"/jobs/{job_id}"},
+    )
+
+
+@app.get("/jobs/{job_id}")
+async def fetch_job(job_id: str):
+    return await get_job(db, job_id)
+
+
+@app.get("/jobs/{job_id}/events")
+async def follow_job(job_id: str, request: Request):
+    return await job_events(db, job_id, request)
+
+
+def _include_fields(include: str):
+    return tuple(field.strip() for field in include.split(",") if field.strip())
+
+
 @app.get("/orders/")
-async def view_all_orders():
-    data = await fetch_orders(db) 
-    response_data = convert_objectid(data)
-    # print("response data " , response_data)
-    return {
+async def view_all_orders(
+    limit: int = Query(ORDERS_PAGE_SIZE, ge=1, le=ORDERS_MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    profile: Optional[str] = None,
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+    include: str = ""
+):
+    """
+    One page of orders, newest first. `include=prices,original_data` adds the
+    heavy fields; follow `next_cursor` for the next page.
+    """
+    data, next_cursor = await fetch_orders(
+        db, limit, cursor, profile, date_from, date_to, _include_fields(include)
+    )
+    return BSONResponse({
         "success": True,
-        "data": response_data
-            }
+        "data": data,
+        "next_cursor": next_cursor
+    })
+
+@app.get("/orders/export")
+async def export_orders(
+    profile: Optional[str] = None,
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+    include: str = ",".join(HEAVY_ORDER_FIELDS)
+):
+    """Full dump of the matching orders as NDJSON, streamed from the cursor."""
+    async def lines():
+        async for order in stream_orders(db, profile, date_from, date_to, _include_fields(include)):
+            yield dumps(order) + b"\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
 
 @app.get("/orders/{order_id}")
 async def view_order(order_id: str):
@@ -357,12 +504,25 @@ async def delete_order_by_id(order_id: str):
     return await delete_order(db, order_id)  # Pass db explicitly
 
 @app.get("/download/{file_id}")
-async def downloadfile(file_id: str):
-    return await download_file(file_id, fs)
+async def downloadfile(file_id: str, request: Request):
+    return await download_file(file_id, fs, request)
+
+@app.get("/preview/{file_id}")
+async def preview(
+    file_id: str,
+    request: Request,
+    size: int = Query(PREVIEW_SIZES[0], ge=1),
+    annotated: bool = False
+):
+    """
+    JPEG preview of a stored file, the first page for PDFs, with the detected
+    letters outlined when `annotated`. Served from the nearest stored size.
+    """
+    return await get_preview(fs, previews_fs, file_id, size, annotated, request)
 
 @app.delete("/delete-file/{file_id}")
 async def deletefile(file_id: str):
-    return await delete_file(file_id, fs ,db)
+    return await delete_file(file_id, fs ,db, previews_fs)
 
 @app.post("/create-user/")
 async def create_user(user_data: dict):
@@ -381,8 +541,16 @@ async def mark_payment_complete(user_id: str):
     return await payment_completed(db, user_id)
 
 @app.get("/get-users/")
-async def fetch_all_users():
-    return await get_all_users(db)
+async def fetch_all_users(
+    limit: int = Query(USERS_PAGE_SIZE, ge=1, le=USERS_MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    detailed: bool = False
+):
+    """
+    One page of users with their orders. `detailed=true` adds each order's
+    per-letter prices and original form data; follow `next_cursor` for more.
+    """
+    return await get_all_users(db, limit, cursor, detailed)
 
 @app.get("/get-user/{user_id}")
 async def fetch_user(user_id: str):
@@ -390,12 +558,30 @@ async def fetch_user(user_id: str):
 
 
 @app.post("/create-payment/")
-def create_payment(payment: PaymentRequest):
-    response = create_mollie_payment(payment)
-    if "error" in response:
-        raise HTTPException(status_code=400, detail=response["error"])
-    return response
+async def create_payment(payment: PaymentRequest):
+    """
+    Starts a Mollie payment. Pass `order_id` so that repeated clicks for the
+    same order and amount return the same checkout instead of a new payment.
+    """
+    return await create_mollie_payment(payment)
+
+
+
+@app.get("/admission")
+async def admission_state():
+    """Admission limits, in-flight and queued requests per route class, and the memory budget in use."""
+    return admission.state()
+
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus metrics of this worker process."""
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
 
+@app.get("/cache-stats/")
+async def letter_cache_stats():
+    return {"success": True, "data": cache_stats()}
 
 
 @app.get("/")
@@ -1,7 +1,6 @@
 from bson import ObjectId
 from fastapi import HTTPException
-from motor.motor_asyncio import AsyncIOMotorDatabase
-from helpers.converters import convert_objectid
+from helpers.serialization import BSONResponse
 
 def serialize_order(order):
     """Convert ObjectId to string in an order document"""
@@ -10,18 +9,75 @@ def serialize_order(order):
     return order
 
 
-async def fetch_orders(db):
+ORDERS_PAGE_SIZE = 50
+ORDERS_MAX_PAGE_SIZE = 500
+# Large fields left out of listings unless asked for with include=
+HEAVY_ORDER_FIELDS = ("prices", "original_data")
+
+
+def _orders_query(profile=None, date_from=None, date_to=None, cursor=None):
+    query = {}
+    if profile:
+        query["profile"] = profile
+    if date_from or date_to:
+        query["timestamp"] = {}
+        if date_from:
+            query["timestamp"]["$gte"] = date_from
+        if date_to:
+            query["timestamp"]["$lt"] = date_to
+    if cursor:
+        if not ObjectId.is_valid(cursor):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        # Newest first, so the next page holds the smaller ids
+        query["_id"] = {"$lt": ObjectId(cursor)}
+    return query
+
+
+def _orders_projection(include=()):
+    excluded = {field: 0 for field in HEAVY_ORDER_FIELDS if field not in include}
+    return excluded or None
+
+
+async def fetch_orders(db, limit=ORDERS_PAGE_SIZE, cursor=None, profile=None, date_from=None, date_to=None, include=()):
+    """
+    Fetch one page of orders, newest first.
+    Returns (orders, next_cursor); pass next_cursor back as `cursor` for the
+    following page, it is None on the last page.
+    """
+    orders_collection = db["orders"]
+    limit = max(1, min(limit, ORDERS_MAX_PAGE_SIZE))
+    orders = await orders_collection.find(
+        _orders_query(profile, date_from, date_to, cursor),
+        _orders_projection(include),
+    ).sort("_id", -1).limit(limit + 1).to_list(limit + 1)
+
+    next_cursor = str(orders[limit - 1]["_id"]) if len(orders) > limit else None
+    return orders[:limit], next_cursor
+
+
+async def stream_orders(db, profile=None, date_from=None, date_to=None, include=HEAVY_ORDER_FIELDS):
+    """Yield every matching order, newest first, without holding them all in memory."""
+    orders_collection = db["orders"]
+    cursor = orders_collection.find(
+        _orders_query(profile, date_from, date_to),
+        _orders_projection(include),
+        batch_size=500,
+    ).sort("_id", -1)
+    async for order in cursor:
+        yield order
+
+
+async def ensure_order_indexes(db):
+    """Indexes behind the profile and date filters of the orders listing."""
     orders_collection = db["orders"]
-    orders = []
-    async for order in orders_collection.find():
-        orders.append(order)
-    return orders
+    await orders_collection.create_index([("profile", 1), ("_id", -1)])
+    await orders_collection.create_index([("timestamp", -1)])
 
 async def get_order_by_id(db, order_id):
     orders_collection = db["orders"]
     order = await orders_collection.find_one({"_id": ObjectId(order_id)})
     if order:
-        return {"success": True, "data": convert_objectid(order)}
+        return BSONResponse({"success": True, "data": order})
     return {"success": False, "message": "Order not found"}
 
 async def delete_order(db, order_id):
@@ -1,32 +1,146 @@
-from mollie.api.client import Client
+import asyncio
+import hashlib
+import logging
 import os
+import random
+import uuid
+from typing import Optional
+from fastapi import HTTPException
 from pydantic import BaseModel
 from dotenv import load_dotenv
+from helpers.metrics import ERRORS, timed
 
 
 load_dotenv()
 
 MOLLIE_API_KEY = os.getenv("MOLLIE_API_KEY")
+# Point at tools/mollie_stub.py to run without Mollie, e.g. http://127.0.0.1:8001/v2
+MOLLIE_API_URL = os.getenv("MOLLIE_API_URL", "https://api.mollie.com/v2").rstrip("/")
+# Seconds to open a connection / to wait for Mollie's answer
+MOLLIE_CONNECT_TIMEOUT = float(os.getenv("MOLLIE_CONNECT_TIMEOUT", 3))
+MOLLIE_READ_TIMEOUT = float(os.getenv("MOLLIE_READ_TIMEOUT", 10))
+# Extra attempts after a timeout, connection error, 429 or 5xx
+MOLLIE_RETRIES = int(os.getenv("MOLLIE_RETRIES", 2))
+# Backoff before retry n is random in [0, MOLLIE_BACKOFF * 2**n), capped at MOLLIE_BACKOFF_MAX
+MOLLIE_BACKOFF = float(os.getenv("MOLLIE_BACKOFF", 0.25))
+MOLLIE_BACKOFF_MAX = float(os.getenv("MOLLIE_BACKOFF_MAX", 2))
+MOLLIE_MAX_CONNECTIONS = int(os.getenv("MOLLIE_MAX_CONNECTIONS", 20))
 
-if not MOLLIE_API_KEY:
-    raise ValueError("MOLLIE_API_KEY is not set. Please set it in your environment variables.")
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+mollie_client = None
+
+
+def init_mollie_client():
+    """
+    Creates the pooled Mollie HTTP client; called from the app's lifespan so
+    the key is checked before serving.
+    """
+    global mollie_client
+    if not MOLLIE_API_KEY:
+        raise ValueError("MOLLIE_API_KEY is not set. Please set it in your environment variables.")
+
+    import httpx
+
+    mollie_client = httpx.AsyncClient(
+        base_url=MOLLIE_API_URL,
+        headers={"Authorization": f"Bearer {MOLLIE_API_KEY}"},
+        timeout=httpx.Timeout(MOLLIE_READ_TIMEOUT, connect=MOLLIE_CONNECT_TIMEOUT),
+        limits=httpx.Limits(
+            max_connections=MOLLIE_MAX_CONNECTIONS,
+            max_keepalive_connections=MOLLIE_MAX_CONNECTIONS,
+            keepalive_expiry=60,
+        ),
+    )
+    return mollie_client
+
+
+async def close_mollie_client():
+    global mollie_client
+    if mollie_client is not None:
+        await mollie_client.aclose()
+        mollie_client = None
 
-mollie_client = Client()
-mollie_client.set_api_key(MOLLIE_API_KEY)
 
 class PaymentRequest(BaseModel):
     amount: float
     description: str
     redirect_url: str  # Redirect after payment
+    order_id: Optional[str] = None  # Repeated requests for the same order and amount return the same payment
+
+
+def idempotency_key(order_id: str, amount: str) -> str:
+    """Same order and amount, same key: Mollie then answers a duplicate click with the first payment."""
+    return hashlib.sha256(f"{order_id}:{amount}".encode()).hexdigest()
+
 
-def create_mollie_payment(payment: PaymentRequest):
+def _backoff(attempt, response=None):
+    """Seconds to wait before retry `attempt` (0-based), honouring Retry-After."""
+    if response is not None:
+        retry_after = response.headers.get("Retry-After", "")
+        if retry_after.isdigit():
+            return min(float(retry_after), MOLLIE_BACKOFF_MAX)
+    return random.uniform(0, min(MOLLIE_BACKOFF_MAX, MOLLIE_BACKOFF * 2 ** attempt))
+
+
+def _error_detail(response):
     try:
-        # print("Got MOLLIE_API_KEY " , MOLLIE_API_KEY)
-        payment_response = mollie_client.payments.create({
-            "amount": {"currency": "EUR", "value": f"{payment.amount:.2f}"},
-            "description": payment.description,
-            "redirectUrl": payment.redirect_url,
-        })
-        return {"payment_id": payment_response["id"], "checkout_url": payment_response["_links"]["checkout"]["href"]}
-    except Exception as e:
-        return {"error": str(e)}
+        return response.json().get("detail") or response.text
+    except ValueError:
+        return response.text
+
+
+async def _post_with_retries(path, body, key):
+    """
+    POSTs to Mollie, retrying transient failures. Every attempt sends the
+    same Idempotency-Key, so a retry after a lost answer cannot pay twice.
+    """
+    import httpx
+
+    client = mollie_client or init_mollie_client()
+    for attempt in range(MOLLIE_RETRIES + 1):
+        last = attempt == MOLLIE_RETRIES
+        try:
+            response = await client.post(path, json=body, headers={"Idempotency-Key": key})
+        except httpx.TimeoutException:
+            if last:
+                ERRORS.inc(kind="mollie_timeout")
+                raise HTTPException(status_code=504, detail="Payment provider timed out.")
+            delay = _backoff(attempt)
+        except httpx.TransportError as e:
+            if last:
+                logging.error(f"Mollie request failed: {str(e)}")
+                ERRORS.inc(kind="mollie_unavailable")
+                raise HTTPException(status_code=502, detail="Payment provider unavailable.")
+            delay = _backoff(attempt)
+        else:
+            if response.status_code not in RETRY_STATUSES:
+                return response
+            if last:
+                logging.error(f"Mollie answered {response.status_code}: {_error_detail(response)}")
+                ERRORS.inc(kind="mollie_unavailable")
+                raise HTTPException(status_code=502, detail="Payment provider unavailable.")
+            delay = _backoff(attempt, response)
+        ERRORS.inc(kind="mollie_retry")
+        await asyncio.sleep(delay)
+
+
+async def create_mollie_payment(payment: PaymentRequest):
+    amount = f"{payment.amount:.2f}"
+    # Without an order id only the retries of this call share a key
+    key = idempotency_key(payment.order_id, amount) if payment.order_id else uuid.uuid4().hex
+    body = {
+        "amount": {"currency": "EUR", "value": amount},
+        "description": payment.description,
+        "redirectUrl": payment.redirect_url,
+    }
+    if payment.order_id:
+        body["metadata"] = {"order_id": payment.order_id}
+
+    with timed("mollie_create_payment"):
+        response = await _post_with_retries("/payments", body, key)
+    if response.is_error:
+        raise HTTPException(status_code=400, detail=_error_detail(response))
+
+    payment_response = response.json()
+    return {"payment_id": payment_response["id"], "checkout_url": payment_response["_links"]["checkout"]["href"]}
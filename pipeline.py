@@ -0,0 +1,84 @@
+import asyncio
+import logging
+import os
+from helpers.cache import cache_key, get_cached_boxes, store_boxes
+from helpers.pool import idle_workers, run_in_pool, POOL_WORKERS
+from helpers.uploads import SpooledUpload
+from extraction import detect_letter_boxes, detect_pdf_pages, inspect_pdf, merge_page_tables, warm_up, TEXT_ENGINE
+
+# Most pool jobs one PDF is split into, never more than there are idle workers; pages are divided evenly
+PDF_PARALLEL_JOBS = int(os.getenv("PDF_PARALLEL_JOBS", max(1, POOL_WORKERS // 2)))
+# Start the pool workers and load the extraction libraries right after startup
+EXTRACTION_WARMUP = os.getenv("EXTRACTION_WARMUP", "false").lower() in ("1", "true", "yes")
+
+
+def _split_pages(pages, parts):
+    """Splits pages into at most `parts` contiguous, nearly equal slices."""
+    parts = max(1, min(parts, len(pages)))
+    size, extra = divmod(len(pages), parts)
+    slices, start = [], 0
+    for index in range(parts):
+        end = start + size + (1 if index < extra else 0)
+        slices.append(pages[start:end])
+        start = end
+    return slices
+
+
+async def _detect_pdf(path, request=None, first_page=None, last_page=None):
+    """
+    Inspects the PDF in one pool job, then analyses slices of its pages in
+    parallel jobs and merges them back in page order. Pages never share a
+    worker thread: PyMuPDF is not thread-safe, so every slice runs in its own
+    process with its own document handle. The PDF gets no more jobs than
+    there are idle workers, and a single one when the pool is busy, so
+    concurrent uploads queue whole instead of filling the pool's queue with
+    page jobs and getting a 503 halfway.
+    """
+    data_type, pages = await run_in_pool(inspect_pdf, path, first_page, last_page, request=request)
+    jobs = [
+        asyncio.ensure_future(run_in_pool(detect_pdf_pages, path, data_type, page_slice, request=request))
+        for page_slice in _split_pages(pages, min(PDF_PARALLEL_JOBS, idle_workers()))
+    ]
+    try:
+        tables = await asyncio.gather(*jobs)
+    except BaseException:
+        for job in jobs:
+            job.cancel()
+        raise
+    return data_type, merge_page_tables(data_type, tables)
+
+
+async def get_letter_boxes(db, upload: SpooledUpload, request=None, first_page=None, last_page=None):
+    """
+    Returns (data_type, LetterTable) for a spooled upload, running extraction
+    in the process pool only when the same file has not been analysed before.
+    Workers open the spooled file themselves, so the bytes are never pickled.
+    first_page/last_page (1-based, inclusive) narrow down which PDF pages are read.
+    """
+    is_pdf = upload.content_type == "application/pdf"
+    pages = f"{first_page or 1}-{last_page or 'end'}" if is_pdf else ""
+    key = cache_key(upload.sha256, upload.content_type, TEXT_ENGINE, pages)
+    cached = await get_cached_boxes(db, key)
+    if cached is not None:
+        return cached
+
+    if is_pdf:
+        data_type, letter_boxes = await _detect_pdf(upload.path, request, first_page, last_page)
+    else:
+        data_type, letter_boxes = await run_in_pool(
+            detect_letter_boxes, upload.path, upload.content_type, request=request
+        )
+    await store_boxes(db, key, data_type, letter_boxes)
+    return data_type, letter_boxes
+
+
+async def warm_up_extraction():
+    """Runs one warm-up job per pool worker; meant to run in the background at startup."""
+    results = await asyncio.gather(
+        *(run_in_pool(warm_up, timeout=120) for _ in range(POOL_WORKERS)), return_exceptions=True
+    )
+    failures = [result for result in results if isinstance(result, BaseException)]
+    if failures:
+        logging.error(f"Extraction warm-up failed: {str(failures[0])}")
+    else:
+        logging.info(f"Warmed up {POOL_WORKERS} extraction workers")
@@ -0,0 +1,273 @@
+import asyncio
+import logging
+import os
+import numpy as np
+from bson import ObjectId
+from bson.errors import InvalidId
+from fastapi import HTTPException
+from fastapi.responses import Response
+from gridfs.errors import NoFile
+from extraction import (
+    detect_letter_boxes, detect_pdf_pages, find_letter_boxes, inspect_pdf, load_image, page_images
+)
+from helpers.metrics import timed
+from helpers.pool import idle_workers, run_in_pool
+from helpers.uploads import spool_gridfs
+
+# Longest side, in pixels, of each stored preview; requests are served the nearest stored size
+PREVIEW_SIZES = tuple(sorted({int(size) for size in os.getenv("PREVIEW_SIZES", "256,1024").split(",")}))
+# JPEG quality of the stored previews
+PREVIEW_QUALITY = int(os.getenv("PREVIEW_QUALITY", 85))
+# Preview renders this process runs in the extraction pool at once, so they never crowd out uploads
+PREVIEW_RENDER_JOBS = int(os.getenv("PREVIEW_RENDER_JOBS", 1))
+# Previews of a file never change, so browsers and CDNs may keep them for a year
+PREVIEW_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+PREVIEW_BUCKET = "previews"
+PREVIEW_KINDS = ("thumbnail", "annotated")
+BOX_COLOR = (0, 0, 255)
+
+# file_id -> task rendering that file's previews, so concurrent first requests share one render
+_rendering = {}
+_render_slots = asyncio.Semaphore(max(1, PREVIEW_RENDER_JOBS))
+
+
+def preview_name(file_id, kind: str, size: int) -> str:
+    return f"{file_id}-{kind}-{size}.jpg"
+
+
+def _fit(image: np.ndarray, size: int) -> np.ndarray:
+    """Shrinks an image so its longest side is at most `size`."""
+    import cv2
+
+    height, width = image.shape[:2]
+    scale = size / max(width, height)
+    if scale >= 1:
+        return image
+    return cv2.resize(
+        image, (max(1, round(width * scale)), max(1, round(height * scale))), interpolation=cv2.INTER_AREA
+    )
+
+
+def _image_preview(path, content_type, size, table=None):
+    """
+    The image reduced to `size` and its letter boxes in the reduced image's
+    pixels. `table` holds boxes already detected in source pixels.
+    """
+    image, (source_width, source_height) = load_image(path, color=True, max_side=size)
+    image = _fit(image, size)
+    if table is None:
+        _, table = detect_letter_boxes(path, content_type)
+    boxes = _table_boxes(table)
+    scale_x, scale_y = image.shape[1] / source_width, image.shape[0] / source_height
+    return image, boxes * [scale_x, scale_y, scale_x, scale_y]
+
+
+def _table_boxes(table) -> np.ndarray:
+    return np.stack([table.x, table.y, table.widths, table.heights], axis=1).astype(np.float64)
+
+
+def _image_rect_boxes(page, xref, found, source_width, source_height) -> list:
+    """Boxes found in an embedded image, in page points, for every place the page shows it."""
+    placed = []
+    for rect in page.get_image_rects(xref):
+        scale_x, scale_y = rect.width / source_width, rect.height / source_height
+        placed.append(found * [scale_x, scale_y, scale_x, scale_y] + [rect.x0, rect.y0, 0, 0])
+    return placed
+
+
+def _pdf_preview(path, size, table=None, data_type=None, pages=None):
+    """
+    The first page rendered at `size` and the letter boxes found on it, in
+    the rendered page's pixels. The order's `table` is reused when its
+    (first_page, last_page) `pages` were the first page alone and, for image
+    PDFs, that page shows a single image; the table does not say which page
+    or image a box came from.
+    """
+    import cv2
+    import fitz  # PyMuPDF
+
+    with fitz.open(path) as doc:
+        first_page, last_page = pages or (None, None)
+        if (first_page or 1) != 1 or min(last_page or len(doc), len(doc)) != 1:
+            table = None
+        if table is None:
+            data_type, _ = inspect_pdf(path, 1, 1)
+        page = doc[0]
+        zoom = size / max(page.rect.width, page.rect.height)
+        pixmap = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), colorspace=fitz.csRGB, alpha=False)
+        rgb = np.frombuffer(pixmap.samples, np.uint8).reshape(pixmap.height, pixmap.width, 3)
+        image = cv2.cvtColor(rgb, cv2.COLOR_RGB2BGR)
+
+        if data_type == "image":
+            images = {info[0]: (info[2], info[3]) for info in page.get_images(full=True)}
+            boxes = []
+            if table is not None and len(images) == 1:
+                (xref, (source_width, source_height)), = images.items()
+                boxes = _image_rect_boxes(page, xref, _table_boxes(table), source_width, source_height)
+            else:
+                for xref, embedded, (source_width, source_height) in page_images(doc, 0):
+                    found = find_letter_boxes(embedded, (source_width, source_height)).astype(np.float64)
+                    boxes.extend(_image_rect_boxes(page, xref, found, source_width, source_height))
+            boxes = np.concatenate(boxes) if boxes else np.empty((0, 4))
+        else:
+            # Text and outline boxes have their origin at the bottom left of the page
+            if table is None:
+                table = detect_pdf_pages(path, data_type, [0])
+            boxes = np.stack(
+                [table.x, page.rect.height - table.y - table.heights, table.widths, table.heights], axis=1
+            )
+    return image, boxes * zoom
+
+
+def render_previews(path, content_type: str, table=None, data_type=None, pages=None) -> list:
+    """
+    Pool job that renders every preview of an uploaded file as JPEG bytes,
+    returned as (kind, size, data) tuples. PDFs are previewed by their first
+    page. The annotated previews outline each detected letter; the order's
+    `table` of `data_type`, for PDFs read from the (first_page, last_page)
+    `pages`, saves detecting them again where it can.
+    """
+    import cv2
+
+    with timed("preview_render"):
+        largest = PREVIEW_SIZES[-1]
+        if content_type == "application/pdf":
+            base, boxes = _pdf_preview(path, largest, table, data_type, pages)
+        elif content_type in ["image/jpeg", "image/png"]:
+            base, boxes = _image_preview(path, content_type, largest, table)
+        else:
+            raise ValueError("Unsupported file format")
+
+        rendered = []
+        for size in PREVIEW_SIZES:
+            thumbnail = _fit(base, size)
+            scale = thumbnail.shape[1] / base.shape[1]
+            annotated = thumbnail.copy()
+            thickness = max(1, round(max(thumbnail.shape[:2]) / 500))
+            for x, y, w, h in np.round(boxes * scale).astype(np.int64).tolist():
+                cv2.rectangle(annotated, (x, y), (x + w, y + h), BOX_COLOR, thickness)
+            for kind, image in zip(PREVIEW_KINDS, (thumbnail, annotated)):
+                ok, data = cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, PREVIEW_QUALITY])
+                if not ok:
+                    raise ValueError("Failed to encode preview")
+                rendered.append((kind, size, data.tobytes()))
+    return rendered
+
+
+async def ensure_preview_indexes(db):
+    """Previews are looked up by name, which GridFS indexes itself, and deleted by their original's id."""
+    await db[f"{PREVIEW_BUCKET}.files"].create_index("metadata.file_id")
+
+
+async def store_previews(previews_fs, file_id, rendered: list):
+    with timed("gridfs_write"):
+        for kind, size, data in rendered:
+            grid_in = previews_fs.open_upload_stream(
+                preview_name(file_id, kind, size),
+                metadata={"file_id": file_id, "kind": kind, "size": size, "content_type": "image/jpeg"},
+            )
+            await grid_in.write(data)
+            await grid_in.close()
+
+
+async def _render_and_store(fs, previews_fs, file_id, upload, job_args):
+    try:
+        async with _render_slots:
+            if upload is None:
+                upload = await spool_gridfs(fs, file_id)
+            rendered = await run_in_pool(render_previews, upload.path, upload.content_type, *job_args)
+    finally:
+        if upload is not None:
+            upload.cleanup()
+    await store_previews(previews_fs, file_id, rendered)
+    return rendered
+
+
+async def generate_previews(
+    fs, previews_fs, file_id, upload=None, table=None, data_type=None, pages=None, only_when_idle=False
+):
+    """
+    Renders a stored file's previews in the pool and stores them under its
+    id; render_previews describes `table`, `data_type` and `pages`.
+    `upload` is the file already spooled to disk, which this cleans up;
+    without it the original is read back from GridFS. Callers for the same
+    file share one render, and one caller going away does not cancel it.
+    At most PREVIEW_RENDER_JOBS renders run at once. With `only_when_idle`,
+    nothing is rendered unless a pool worker is idle and a render slot is
+    free; it returns None, and the previews are rendered on first request.
+    """
+    task = _rendering.get(file_id)
+    if task is None:
+        if only_when_idle and (idle_workers() == 0 or _render_slots.locked()):
+            if upload is not None:
+                upload.cleanup()
+            return None
+        task = asyncio.ensure_future(
+            _render_and_store(fs, previews_fs, file_id, upload, (table, data_type, pages))
+        )
+        _rendering[file_id] = task
+        task.add_done_callback(lambda _: _rendering.pop(file_id, None))
+    elif upload is not None:
+        upload.cleanup()
+    return await asyncio.shield(task)
+
+
+async def _read_preview(previews_fs, name: str) -> bytes:
+    grid_out = await previews_fs.open_download_stream_by_name(name)
+    chunks = []
+    while True:
+        chunk = await grid_out.readchunk()
+        if not chunk:
+            break
+        chunks.append(chunk)
+    return b"".join(chunks)
+
+
+async def get_preview(fs, previews_fs, file_id: str, size: int, annotated: bool = False, request=None):
+    """
+    A stored file's JPEG preview at the smallest stored size of at least
+    `size` pixels (the largest one for bigger requests), with its letters
+    outlined when `annotated`. Files stored before previews existed are
+    rendered on their first request. Previews never change, so they are
+    served with a year-long Cache-Control and answer If-None-Match with 304.
+    """
+    try:
+        file_id_obj = ObjectId(file_id)
+    except (InvalidId, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid file id")
+
+    size = next((stored for stored in PREVIEW_SIZES if stored >= size), PREVIEW_SIZES[-1])
+    kind = PREVIEW_KINDS[1] if annotated else PREVIEW_KINDS[0]
+    name = preview_name(file_id_obj, kind, size)
+    headers = {"ETag": f'"{name}"', "Cache-Control": PREVIEW_CACHE_CONTROL}
+
+    try:
+        data = await _read_preview(previews_fs, name)
+    except NoFile:
+        try:
+            rendered = await generate_previews(fs, previews_fs, file_id_obj)
+        except NoFile:
+            raise HTTPException(status_code=404, detail="File not found")
+        except HTTPException:
+            raise
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        except Exception as e:
+            logging.error(f"Could not render previews of {file_id}: {str(e)}")
+            raise HTTPException(status_code=500, detail="Internal server error")
+        data = next(data for stored_kind, stored_size, data in rendered if (stored_kind, stored_size) == (kind, size))
+
+    if_none_match = request.headers.get("if-none-match") if request is not None else None
+    if if_none_match and headers["ETag"] in [tag.strip() for tag in if_none_match.split(",")]:
+        return Response(status_code=304, headers=headers)
+    return Response(data, media_type="image/jpeg", headers=headers)
+
+
+async def delete_previews(previews_fs, file_id):
+    """Deletes every preview of a file, after any render of them still running."""
+    task = _rendering.get(file_id)
+    if task is not None:
+        await asyncio.wait([task])
+    async for grid_out in previews_fs.find({"metadata.file_id": file_id}):
+        await previews_fs.delete(grid_out._id)
@@ -1,4 +1,12 @@
+import asyncio
 import json
+import logging
+import os
+import time
+from bisect import bisect_right
+import numpy as np
+from helpers.metrics import ERRORS, timed
+from letter_table import ScaledLetters
 
 base_prices = {
             "10-25cm": 50, 
@@ -32,310 +40,279 @@ profiel3_lux_base_prices = {
 }
 
 
-def Aluminium_Doosletter_Price_calculator(letters, data):
+class PriceTiers:
     """
-    Calculates the price of each letter based on given parameters.
-    """
-    try:
-        data = json.loads(data)  # Parse JSON-formatted string
-        thickness = int(data.get("thickness_pricing", 3))
-        width_of_letter = int(data.get("width_of_letter", 6))
-        colors = data.get("colors", [])
-
-        
-
-        thickness_price_adjustments = {3: 0, 5: 10, 8: 15, 20: 20}
-        width_adjustment_per_cm = 2.5  
-        extra_color_cost = 20 if len(colors) > 1 else 0
-
-        prices = []
-        for letter in letters:
-            scaled_height = letter["scaled_height"]
-            scaled_length = letter["scaled_length"]  # Fixed typo from scaled_length
-            base_price = None
-
-            for height_range, price in base_prices.items():
-                min_h, max_h = map(lambda x: int(x.replace("cm", "")), height_range.split('-'))
-                if min_h <= scaled_height <= max_h:
-                    base_price = price
-                    break
-
-            if base_price is None:
-                base_price = 160  # Default highest price if beyond 90cm
-
-            width_adjustment = (abs(width_of_letter - 6) * width_adjustment_per_cm)
-
-            final_price = base_price * (1 + (width_adjustment / 100))
-            final_price += (base_price * (thickness_price_adjustments.get(thickness, 0) / 100))
-            final_price += extra_color_cost
-
-            prices.append({
-                "letter": letter["letter"],
-                "scaled_length": scaled_length,
-                "scaled_height": scaled_height,
-                "price": round(final_price, 2)
-            })
-        
-        data = {
-            "totalPrice" : sum(item["price"] for item in prices),
-            "prices" : prices
-        }
-        return data
-    except Exception as e:
-        return {"error": str(e)}
+    A "min-maxcm" -> price table compiled into sorted boundary arrays.
 
+    Heights outside every range fall back to `fallback_price`: below the
+    first range (e.g. 0-9cm for base_prices), in a gap between ranges, or
+    above the last one.
+    """
 
-def Profiel2_Price_calculator(letters, data):
+    def __init__(self, tiers: dict, fallback_price=160):
+        bounds = sorted(
+            (*map(lambda x: int(x.replace("cm", "")), height_range.split('-')), price)
+            for height_range, price in tiers.items()
+        )
+        for (_, high, _), (next_low, _, _) in zip(bounds, bounds[1:]):
+            if next_low <= high:
+                raise ValueError(f"Overlapping price tiers at {next_low}cm")
+
+        self.lows = [low for low, _, _ in bounds]
+        self.highs = [high for _, high, _ in bounds]
+        self.prices = [price for _, _, price in bounds]
+        self.fallback_price = fallback_price
+
+        self._lows = np.array(self.lows)
+        self._highs = np.array(self.highs)
+        # Trailing slot holds the fallback so misses can be resolved with one take()
+        self._prices = np.array(self.prices + [fallback_price], dtype=np.float64)
+
+    def lookup(self, height):
+        """Base price for one height, O(log n)."""
+        idx = bisect_right(self.lows, height) - 1
+        if idx >= 0 and height <= self.highs[idx]:
+            return self.prices[idx]
+        return self.fallback_price
+
+    def lookup_many(self, heights):
+        """Base prices for a whole array of heights."""
+        heights = np.asarray(heights)
+        idx = np.searchsorted(self._lows, heights, side="right") - 1
+        clipped = np.maximum(idx, 0)
+        inside = (idx >= 0) & (heights <= self._highs[clipped])
+        return self._prices[np.where(inside, clipped, len(self.lows))]
+
+
+def _price_letters(letters, tiers: PriceTiers, width_adjustment, adjustment_percent, extra_color_cost):
     """
-    Calculates the price of each letter based on given parameters.
+    Prices every letter at once and builds the response dicts.
+    `letters` is ScaledLetters or the older list of scaled letter dicts.
     """
-    try:
-        data = json.loads(data)  
-       
-        width_of_letter = int(data.get("width_of_letter", 6))
-        colors = data.get("colors", [])
-
-        
-
-        width_adjustment_per_cm = 2.5  
-        extra_color_cost = 20 if len(colors) > 1 else 0
-
-        prices = []
-        for letter in letters:
-            scaled_height = letter["scaled_height"]
-            scaled_length = letter["scaled_length"]  # Fixed typo from scaled_length
-            base_price = None
-
-            for height_range, price in base_prices.items():
-                min_h, max_h = map(lambda x: int(x.replace("cm", "")), height_range.split('-'))
-                if min_h <= scaled_height <= max_h:
-                    base_price = price
-                    break
-
-            if base_price is None:
-                base_price = 160  # Default highest price if beyond 90cm
-
-            width_adjustment = (abs(width_of_letter - 6) * width_adjustment_per_cm)
-
-            final_price = base_price * (1 + (width_adjustment / 100))
-            final_price += extra_color_cost
-
-            prices.append({
-                "letter": letter["letter"],
-                "scaled_length": scaled_length,
-                "scaled_height": scaled_height,
-                "price": round(final_price, 2)
-            })
-        
-        data = {
-            "totalPrice" : sum(item["price"] for item in prices),
-            "prices" : prices
-        }
-        return data
-    except Exception as e:
-        return {"error": str(e)}
+    if not isinstance(letters, ScaledLetters):
+        letters = ScaledLetters.from_records(letters)
 
+    base_price = tiers.lookup_many(letters.scaled_height)
 
-def Profiel3_LUX_Price_calculator(letters, data):
-    """
-    Calculates the price of each letter based on given parameters.
-    """
-    try:
-        data = json.loads(data)  # Parse JSON-formatted string
-        plexi_size = int(data.get("plexi_size", 10))
-        width_of_letter = int(data.get("width_of_letter", 6))
-        colors = data.get("colors", [])
-
-        plexi_size_adjustment = {10: 0, 20: 25, 30: 45}
-        width_adjustment_per_cm = 2.5  
-        extra_color_cost = 20 if len(colors) > 1 else 0
-
-        prices = []
-        for letter in letters:
-            scaled_height = letter["scaled_height"]
-            scaled_length = letter["scaled_length"]  # Fixed typo from scaled_length
-            base_price = None
-
-            for height_range, price in profiel3_lux_base_prices.items():
-                min_h, max_h = map(lambda x: int(x.replace("cm", "")), height_range.split('-'))
-                if min_h <= scaled_height <= max_h:
-                    base_price = price
-                    break
-
-            if base_price is None:
-                base_price = 160  # Default highest price if beyond 90cm
-
-            width_adjustment = (abs(width_of_letter - 6) * width_adjustment_per_cm)
-
-            final_price = base_price * (1 + (width_adjustment / 100))
-            final_price += (base_price * (plexi_size_adjustment.get(plexi_size, 0) / 100))
-            final_price += extra_color_cost
-
-            prices.append({
-                "letter": letter["letter"],
-                "scaled_length": scaled_length,
-                "scaled_height": scaled_height,
-                "price": round(final_price, 2)
-            })
-        
-        data = {
-            "totalPrice" : sum(item["price"] for item in prices),
-            "prices" : prices
-        }
-        return data
-    except Exception as e:
-        return {"error": str(e)}
+    final_price = base_price * (1 + (width_adjustment / 100))
+    final_price += (base_price * (adjustment_percent / 100))
+    final_price += extra_color_cost
 
-def Profiel4_Price_calculator(letters, data):
-    """
-    Calculates the price of each letter based on given parameters.
-    """
-    try:
-        data = json.loads(data)  # Parse JSON-formatted string
-        plexi_size = int(data.get("plexi_size", 3))
-        width_of_letter = int(data.get("width_of_letter", 6))
-        colors = data.get("colors", [])
-
-        plexi_size_adjustment = {3: 0, 5: 10, 10: 15}
-        width_adjustment_per_cm = 2.5  
-        extra_color_cost = 20 if len(colors) > 1 else 0
-
-        prices = []
-        for letter in letters:
-            scaled_height = letter["scaled_height"]
-            scaled_length = letter["scaled_length"]  # Fixed typo from scaled_length
-            base_price = None
-
-            for height_range, price in base_prices.items():
-                min_h, max_h = map(lambda x: int(x.replace("cm", "")), height_range.split('-'))
-                if min_h <= scaled_height <= max_h:
-                    base_price = price
-                    break
-
-            if base_price is None:
-                base_price = 160  # Default highest price if beyond 90cm
-
-            width_adjustment = (abs(width_of_letter - 6) * width_adjustment_per_cm)
-
-            final_price = base_price * (1 + (width_adjustment / 100))
-            final_price += (base_price * (plexi_size_adjustment.get(plexi_size, 0) / 100))
-            final_price += extra_color_cost
-
-            prices.append({
-                "letter": letter["letter"],
-                "scaled_length": scaled_length,
-                "scaled_height": scaled_height,
-                "price": round(final_price, 2)
-            })
-        
-        data = {
-            "totalPrice" : sum(item["price"] for item in prices),
-            "prices" : prices
+    # Only a handful of distinct prices exist; round those with Python's round()
+    distinct, index = np.unique(final_price, return_inverse=True)
+    rounded = np.array([round(price, 2) for price in distinct.tolist()])[index].tolist()
+
+    prices = [
+        {
+            "letter": letter,
+            "scaled_length": scaled_length,
+            "scaled_height": scaled_height,
+            "price": price
         }
-        return data
-    except Exception as e:
-        return {"error": str(e)}
+        for letter, scaled_length, scaled_height, price in zip(
+            letters.letters.tolist(), letters.scaled_length.tolist(), letters.scaled_height.tolist(), rounded
+        )
+    ]
+
+    return {
+        "totalPrice" : sum(rounded),
+        "prices" : prices
+    }
+
+
+# ---------------------------------------------------------------------------
+#  Profile registry
+# ---------------------------------------------------------------------------
+
+# Optional JSON file of {"profile name": spec}; changes are picked up while running
+PRICING_PROFILES_FILE = os.getenv("PRICING_PROFILES_FILE")
+# Also read profiles from Mongo (one document per profile, _id = profile name)
+PRICING_PROFILES_FROM_DB = os.getenv("PRICING_PROFILES_FROM_DB", "false").lower() in ("1", "true", "yes")
+PRICING_PROFILES_COLLECTION = "pricing_profiles"
+# Seconds between checks of the file / collection for changes
+PRICING_RELOAD_INTERVAL = float(os.getenv("PRICING_RELOAD_INTERVAL", 30))
+
+TIER_TABLES = {
+    "base": base_prices,
+    "profiel3_lux": profiel3_lux_base_prices,
+}
+
+# Every key is optional except "tiers":
+#   tiers             name from TIER_TABLES or an inline {"min-maxcm": price} table
+#   fallback_price    base price for heights outside every tier (160)
+#   adjustment        surcharge percent chosen by an option, e.g. thickness or plexi size
+#   width             percent per cm that width_of_letter differs from "base"
+#   extra_color_cost  added to each letter when more than one colour is chosen (20)
+#   quote             "total" makes /get-price/ answer with totalPrice only
+DEFAULT_PROFILES = {
+    "Aluminium Doosletter": {
+        "tiers": "base",
+        "adjustment": {"option": "thickness_pricing", "default": 3, "percent": {"3": 0, "5": 10, "8": 15, "20": 20}},
+        "quote": "total",
+    },
+    "Profiel 2": {"tiers": "base", "quote": "total"},
+    "Profiel 3": {"tiers": "base", "quote": "total"},
+    "Profiel3 LUX": {
+        "tiers": "profiel3_lux",  # Heights above its 100cm tier still fall back to 160
+        "adjustment": {"option": "plexi_size", "default": 10, "percent": {"10": 0, "20": 25, "30": 45}},
+    },
+    "Profiel4": {
+        "tiers": "base",
+        "adjustment": {"option": "plexi_size", "default": 3, "percent": {"3": 0, "5": 10, "10": 15}},
+    },
+    "Profiel5": {"tiers": "base"},
+    "Profiel5 LUX": {
+        "tiers": "base",
+        "adjustment": {"option": "plexi_size", "default": 3, "percent": {"3": 0, "5": 10, "10": 15, "19": 25}},
+    },
+}
+
+DEFAULT_WIDTH_RULE = {"option": "width_of_letter", "default": 6, "base": 6, "percent_per_cm": 2.5}
 
-def Profiel5_Price_calculator(letters, data):
+
+class ProfilePricer:
     """
-    Calculates the price of each letter based on given parameters.
+    A profile spec compiled once into a callable:
+    pricer(letters, options) -> {"totalPrice": ..., "prices": [...]}.
     """
+
+    def __init__(self, name: str, spec: dict):
+        self.name = name
+
+        tiers = spec["tiers"]
+        if isinstance(tiers, str):
+            if tiers not in TIER_TABLES:
+                raise ValueError(f"Profile {name!r} uses unknown tier table {tiers!r}")
+            tiers = TIER_TABLES[tiers]
+        self.tiers = PriceTiers(tiers, spec.get("fallback_price", 160))
+
+        adjustment = spec.get("adjustment")
+        self.adjustment_option = adjustment["option"] if adjustment else None
+        self.adjustment_default = adjustment.get("default", 0) if adjustment else 0
+        self.adjustment_percent = {int(k): v for k, v in adjustment["percent"].items()} if adjustment else {}
+
+        width = {**DEFAULT_WIDTH_RULE, **spec.get("width", {})}
+        self.width_option = width["option"]
+        self.width_default = width["default"]
+        self.width_base = width["base"]
+        self.width_percent_per_cm = width["percent_per_cm"]
+
+        self.extra_color_cost = spec.get("extra_color_cost", 20)
+        self.quote_total = spec.get("quote") == "total"
+
+    def __call__(self, letters, options: dict):
+        try:
+            adjustment_percent = 0
+            if self.adjustment_option:
+                selected = int(options.get(self.adjustment_option, self.adjustment_default))
+                adjustment_percent = self.adjustment_percent.get(selected, 0)
+            width_of_letter = int(options.get(self.width_option, self.width_default))
+            colors = options.get("colors", [])
+
+            extra_color_cost = self.extra_color_cost if len(colors) > 1 else 0
+            width_adjustment = (abs(width_of_letter - self.width_base) * self.width_percent_per_cm)
+
+            with timed("pricing"):
+                return _price_letters(letters, self.tiers, width_adjustment, adjustment_percent, extra_color_cost)
+        except Exception as e:
+            ERRORS.inc(kind="pricing")
+            return {"error": str(e)}
+
+
+_pricers = {}
+_file_specs = {}
+_db_specs = {}
+_file_mtime = None
+_last_file_check = 0.0
+
+
+def compile_profiles(specs: dict) -> dict:
+    """Compiles {"profile name": spec} into {"profile name": ProfilePricer}."""
+    return {name: ProfilePricer(name, spec) for name, spec in specs.items()}
+
+
+def _rebuild():
+    global _pricers
     try:
-        data = json.loads(data)  # Parse JSON-formatted string
-        # plexi_size = int(data.get("plexi_size", 3))
-        width_of_letter = int(data.get("width_of_letter", 6))
-        colors = data.get("colors", [])
-
-        # plexi_size_adjustment = {3: 0, 5: 10, 10: 15}
-        width_adjustment_per_cm = 2.5  
-        extra_color_cost = 20 if len(colors) > 1 else 0
-
-        prices = []
-        for letter in letters:
-            scaled_height = letter["scaled_height"]
-            scaled_length = letter["scaled_length"]  # Fixed typo from scaled_length
-            base_price = None
-
-            for height_range, price in base_prices.items():
-                min_h, max_h = map(lambda x: int(x.replace("cm", "")), height_range.split('-'))
-                if min_h <= scaled_height <= max_h:
-                    base_price = price
-                    break
-
-            if base_price is None:
-                base_price = 160  # Default highest price if beyond 90cm
-
-            width_adjustment = (abs(width_of_letter - 6) * width_adjustment_per_cm)
-
-            final_price = base_price * (1 + (width_adjustment / 100))
-            # final_price += (base_price * (plexi_size_adjustment.get(plexi_size, 0) / 100))
-            final_price += extra_color_cost
-
-            prices.append({
-                "letter": letter["letter"],
-                "scaled_length": scaled_length,
-                "scaled_height": scaled_height,
-                "price": round(final_price, 2)
-            })
-        
-        data = {
-            "totalPrice" : sum(item["price"] for item in prices),
-            "prices" : prices
-        }
-        return data
+        # Swap the whole dict so lookups never see a half-built registry
+        _pricers = compile_profiles({**DEFAULT_PROFILES, **_file_specs, **_db_specs})
     except Exception as e:
-        return {"error": str(e)}
+        logging.error(f"Invalid pricing profiles, keeping the previous ones: {str(e)}")
 
 
-def Profiel5_LUX_Price_calculator(letters, data):
-    """
-    Calculates the price of each letter based on given parameters.
-    """
+def reload_profiles_file(force=False):
+    """Re-reads PRICING_PROFILES_FILE when its modification time changed."""
+    global _file_specs, _file_mtime, _last_file_check
+    if not PRICING_PROFILES_FILE:
+        return
+    _last_file_check = time.monotonic()
     try:
-        data = json.loads(data)  # Parse JSON-formatted string
-        plexi_size = int(data.get("plexi_size", 3))
-        width_of_letter = int(data.get("width_of_letter", 6))
-        colors = data.get("colors", [])
-
-        plexi_size_adjustment = {3: 0, 5: 10, 10: 15 , 19 : 25}
-        width_adjustment_per_cm = 2.5  
-        extra_color_cost = 20 if len(colors) > 1 else 0
-
-        prices = []
-        for letter in letters:
-            scaled_height = letter["scaled_height"]
-            scaled_length = letter["scaled_length"]  # Fixed typo from scaled_length
-            base_price = None
-
-            for height_range, price in base_prices.items():
-                min_h, max_h = map(lambda x: int(x.replace("cm", "")), height_range.split('-'))
-                if min_h <= scaled_height <= max_h:
-                    base_price = price
-                    break
-
-            if base_price is None:
-                base_price = 160  # Default highest price if beyond 90cm
-
-            width_adjustment = (abs(width_of_letter - 6) * width_adjustment_per_cm)
-
-            final_price = base_price * (1 + (width_adjustment / 100))
-            final_price += (base_price * (plexi_size_adjustment.get(plexi_size, 0) / 100))
-            final_price += extra_color_cost
-
-            prices.append({
-                "letter": letter["letter"],
-                "scaled_length": scaled_length,
-                "scaled_height": scaled_height,
-                "price": round(final_price, 2)
-            })
-        
-        data = {
-            "totalPrice" : sum(item["price"] for item in prices),
-            "prices" : prices
-        }
-        return data
+        mtime = os.stat(PRICING_PROFILES_FILE).st_mtime
+        if not force and mtime == _file_mtime:
+            return
+        with open(PRICING_PROFILES_FILE) as f:
+            _file_specs = json.load(f)
+        _file_mtime = mtime
+        logging.info(f"Loaded {len(_file_specs)} pricing profiles from {PRICING_PROFILES_FILE}")
     except Exception as e:
-        return {"error": str(e)}
+        logging.error(f"Could not load pricing profiles file: {str(e)}")
+        return
+    _rebuild()
+
+
+async def reload_profiles_db(db):
+    """Re-reads the pricing_profiles collection."""
+    global _db_specs
+    if not PRICING_PROFILES_FROM_DB:
+        return
+    specs = {}
+    async for doc in db[PRICING_PROFILES_COLLECTION].find():
+        name = doc.pop("_id")
+        specs[str(name)] = doc
+    if specs != _db_specs:
+        _db_specs = specs
+        logging.info(f"Loaded {len(specs)} pricing profiles from Mongo")
+        _rebuild()
+
+
+async def watch_profiles(db):
+    """Background loop that keeps the registry in sync with its sources."""
+    while True:
+        try:
+            reload_profiles_file()
+            await reload_profiles_db(db)
+        except Exception as e:
+            logging.error(f"Pricing profile reload failed: {str(e)}")
+        await asyncio.sleep(PRICING_RELOAD_INTERVAL)
+
+
+def get_pricer(profile: str):
+    """The compiled pricer for a profile name, or None for unknown profiles."""
+    if PRICING_PROFILES_FILE and time.monotonic() - _last_file_check > PRICING_RELOAD_INTERVAL:
+        reload_profiles_file()
+    return _pricers.get(profile)
+
+
+def quote_price(profile: str, letters, data):
+    """
+    The /get-price/ answer for one profile: 0 for unknown profiles, only the
+    total for "quote": "total" profiles, otherwise the full breakdown.
+    A pricer's {"error": ...} is returned as it is, whatever the profile quotes.
+    `data` is the form's JSON string or an already parsed dict.
+    """
+    pricer = get_pricer(profile)
+    if pricer is None:
+        return 0
+    options = json.loads(data) if isinstance(data, str) else data
+    prices = pricer(letters, options)
+    if pricer.quote_total and "error" not in prices:
+        return prices["totalPrice"]
+    return prices
+
 
+def profile_names():
+    return list(_pricers)
 
 
+_rebuild()
+reload_profiles_file(force=True)
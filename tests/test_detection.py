@@ -0,0 +1,41 @@
+"""
+Letter detection on the reduced working image against full resolution.
+"""
+import numpy as np
+import pytest
+import extraction
+
+BOX = [50, 50, 100, 200]
+
+
+def rectangle(width, height):
+    image = np.full((height, width), 255, dtype=np.uint8)
+    x, y, w, h = BOX
+    image[y:y + h, x:x + w] = 0
+    return image
+
+
+def full_resolution(image, monkeypatch):
+    with monkeypatch.context() as patch:
+        patch.setattr(extraction, "DETECTION_MAX_SIDE", 0)
+        return extraction.find_letter_boxes(image)
+
+
+@pytest.mark.parametrize("size", [(4000, 3000), (5000, 3000)])
+def test_rectangle_stays_put_at_factor_2(size, monkeypatch):
+    image = rectangle(*size)
+    assert extraction._working_size(*size)[0] == 2
+
+    assert full_resolution(image, monkeypatch).tolist() == [BOX]
+    assert extraction.find_letter_boxes(image).tolist() == [BOX]
+
+
+@pytest.mark.parametrize("size", [(3000, 1500), (6000, 4000), (9000, 2500)])
+def test_reduced_boxes_within_one_working_pixel(size, monkeypatch):
+    image = rectangle(*size)
+    factor = extraction._working_size(*size)[0]
+
+    reference = full_resolution(image, monkeypatch)
+    reduced = extraction.find_letter_boxes(image)
+    assert reduced.shape == reference.shape == (1, 4)
+    assert np.abs(reduced - reference).max() <= factor
@@ -0,0 +1,87 @@
+"""
+PriceTiers and the compiled pricers against the per-letter loop they
+replaced, swept over every height a letter can be quoted at.
+"""
+import json
+import random
+import numpy as np
+import pytest
+from price_calculater import (
+    DEFAULT_PROFILES, PriceTiers, ProfilePricer, TIER_TABLES, base_prices, profiel3_lux_base_prices
+)
+
+HEIGHTS = list(range(-20, 301)) + [
+    0.0, 0.5, 9.5, 9.99, 10.0, 10.01, 19.5, 25.5, 30.5, 89.5, 90.0, 90.5, 100.5, 299.9
+]
+
+
+def baseline_base_price(tiers: dict, scaled_height):
+    """The original lookup: the first "min-maxcm" range holding the height, 160 otherwise."""
+    for height_range, price in tiers.items():
+        min_h, max_h = map(lambda x: int(x.replace("cm", "")), height_range.split('-'))
+        if min_h <= scaled_height <= max_h:
+            return price
+    return 160
+
+
+def baseline_prices(letters, tiers: dict, width_of_letter, adjustment_percent, colors):
+    """The original calculators' loop, one letter at a time."""
+    extra_color_cost = 20 if len(colors) > 1 else 0
+    prices = []
+    for letter in letters:
+        base_price = baseline_base_price(tiers, letter["scaled_height"])
+        width_adjustment = (abs(width_of_letter - 6) * 2.5)
+
+        final_price = base_price * (1 + (width_adjustment / 100))
+        final_price += (base_price * (adjustment_percent / 100))
+        final_price += extra_color_cost
+
+        prices.append({
+            "letter": letter["letter"],
+            "scaled_length": letter["scaled_length"],
+            "scaled_height": letter["scaled_height"],
+            "price": round(final_price, 2)
+        })
+    return {"totalPrice": sum(item["price"] for item in prices), "prices": prices}
+
+
+@pytest.mark.parametrize("table", [base_prices, profiel3_lux_base_prices], ids=["base", "profiel3_lux"])
+def test_lookup_matches_baseline(table):
+    tiers = PriceTiers(table)
+    expected = [baseline_base_price(table, height) for height in HEIGHTS]
+
+    assert [tiers.lookup(height) for height in HEIGHTS] == expected
+    assert tiers.lookup_many(np.array(HEIGHTS, dtype=np.float64)).tolist() == expected
+    integers = [height for height in HEIGHTS if isinstance(height, int)]
+    assert tiers.lookup_many(np.array(integers)).tolist() == [baseline_base_price(table, h) for h in integers]
+
+
+def test_overlapping_tiers_are_rejected():
+    with pytest.raises(ValueError):
+        PriceTiers({"10-25cm": 50, "20-30cm": 60})
+
+
+@pytest.mark.parametrize("name", list(DEFAULT_PROFILES))
+def test_compiled_pricer_matches_baseline(name):
+    spec = DEFAULT_PROFILES[name]
+    pricer = ProfilePricer(name, spec)
+    table = TIER_TABLES[spec["tiers"]]
+    adjustment = spec.get("adjustment")
+    choices = list(adjustment["percent"]) + ["99"] if adjustment else [None]
+    rng = random.Random(name)
+
+    for choice in choices:
+        for width_of_letter in (2, 6, 7, 12):
+            for colors in ([], ["red"], ["red", "blue"]):
+                letters = [
+                    {"letter": index + 1, "scaled_length": rng.randint(1, 120), "scaled_height": height}
+                    for index, height in enumerate(rng.sample(range(-20, 301), 40) + [0, 9, 10, 90, 91, 100, 101])
+                ]
+                options = {"width_of_letter": width_of_letter, "colors": colors}
+                adjustment_percent = 0
+                if adjustment:
+                    options[adjustment["option"]] = int(choice)
+                    adjustment_percent = adjustment["percent"].get(choice, 0)
+
+                expected = baseline_prices(letters, table, width_of_letter, adjustment_percent, colors)
+                assert pricer(letters, json.loads(json.dumps(options))) == expected
@@ -0,0 +1,117 @@
+"""
+A local stand-in for the Mollie payments API, for running the app and
+trying failure handling without a Mollie account.
+
+It implements POST and GET /v2/payments with Bearer auth and Idempotency-Key
+replay. It can also inject failures:
+- --fail-first N answers the first N creates with 503;
+- --fail-rate P answers a fraction P of creates with 503;
+- --delay S waits S seconds before answering, e.g. to trigger timeouts.
+
+Usage:
+    python tools/mollie_stub.py --port 8001 --fail-first 1
+    MOLLIE_API_URL=http://127.0.0.1:8001/v2 MOLLIE_API_KEY=test_stub uvicorn main:app
+"""
+import argparse
+import asyncio
+import random
+import uuid
+
+from fastapi import FastAPI, Header, HTTPException, Request
+from fastapi.responses import JSONResponse
+
+app = FastAPI()
+app.state.fail_first = 0
+app.state.fail_rate = 0.0
+app.state.delay = 0.0
+
+payments = {}
+# Idempotency-Key -> (request body, response body)
+replays = {}
+stats = {"creates": 0, "failed": 0, "replayed": 0}
+
+
+def _check_auth(authorization):
+    if not authorization or not authorization.startswith("Bearer test_"):
+        raise HTTPException(status_code=401, detail="Missing authentication, or failed to authenticate")
+
+
+@app.post("/v2/payments", status_code=201)
+async def create_payment(request: Request, authorization: str = Header(None), idempotency_key: str = Header(None)):
+    _check_auth(authorization)
+    body = await request.json()
+    stats["creates"] += 1
+    if app.state.delay:
+        await asyncio.sleep(app.state.delay)
+    if stats["creates"] <= app.state.fail_first or random.random() < app.state.fail_rate:
+        stats["failed"] += 1
+        return JSONResponse({"status": 503, "title": "Service Unavailable", "detail": "Injected failure"}, status_code=503)
+
+    if idempotency_key in replays:
+        previous_body, previous_response = replays[idempotency_key]
+        if previous_body != body:
+            return JSONResponse(
+                {"status": 422, "title": "Unprocessable Entity", "detail": "Idempotency key reused with another request"},
+                status_code=422,
+            )
+        stats["replayed"] += 1
+        return previous_response
+
+    amount = body.get("amount") or {}
+    if not amount.get("value") or not body.get("description") or not body.get("redirectUrl"):
+        return JSONResponse(
+            {"status": 422, "title": "Unprocessable Entity", "detail": "amount, description and redirectUrl are required"},
+            status_code=422,
+        )
+
+    payment_id = "tr_" + uuid.uuid4().hex[:10]
+    payment = {
+        "resource": "payment",
+        "id": payment_id,
+        "mode": "test",
+        "status": "open",
+        "amount": amount,
+        "description": body["description"],
+        "redirectUrl": body["redirectUrl"],
+        "metadata": body.get("metadata"),
+        "_links": {"checkout": {"href": f"{request.base_url}checkout/{payment_id}", "type": "text/html"}},
+    }
+    payments[payment_id] = payment
+    if idempotency_key:
+        replays[idempotency_key] = (body, payment)
+    return payment
+
+
+@app.get("/v2/payments/{payment_id}")
+async def get_payment(payment_id: str, authorization: str = Header(None)):
+    _check_auth(authorization)
+    if payment_id not in payments:
+        raise HTTPException(status_code=404, detail="No payment exists with token " + payment_id)
+    return payments[payment_id]
+
+
+@app.get("/stats")
+async def get_stats():
+    """Counters for checking retries and idempotency from outside."""
+    return {**stats, "payments": len(payments)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--fail-first", type=int, default=0, help="answer the first N creates with 503")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="answer this fraction of creates with 503")
+    parser.add_argument("--delay", type=float, default=0.0, help="seconds to wait before answering a create")
+    args = parser.parse_args()
+
+    app.state.fail_first = args.fail_first
+    app.state.fail_rate = args.fail_rate
+    app.state.delay = args.delay
+
+    import uvicorn
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,7 @@
 from bson import ObjectId
 from fastapi import HTTPException
 from pymongo.collection import Collection
-from fastapi.encoders import jsonable_encoder
+from helpers.serialization import BSONResponse
 
 async def add_user(db, user_data):
     """Add a new user to the database"""
@@ -35,59 +35,62 @@ async def payment_completed(db, user_id):
     await db.users.update_one({"_id": ObjectId(user_id)}, {"$set": {"ispaid": True}})
     return {"success": True, "message": "Payment status updated to paid"}
 
-async def get_all_users(db):
-    """Fetch all users along with their order details"""
-    users = await db.users.find().to_list(None)
-    
+USERS_PAGE_SIZE = 100
+USERS_MAX_PAGE_SIZE = 1000
+# Per-letter breakdown and raw form data, left out of the user list unless detailed
+HEAVY_USER_ORDER_FIELDS = ("prices.prices", "original_data")
+
+
+def _order_object_id(order_id):
+    return ObjectId(str(order_id)) if order_id and ObjectId.is_valid(str(order_id)) else None
+
+
+async def _attach_orders(db, users, detailed=False):
+    """
+    Adds each user's order under "order" ({} when missing) with a single
+    $in query over all their orderIds, instead of one find_one per user.
+    """
+    order_ids = {_order_object_id(user.get("orderId")) for user in users} - {None}
+    projection = None if detailed else {field: 0 for field in HEAVY_USER_ORDER_FIELDS}
+
+    orders = {}
+    if order_ids:
+        async for order in db.orders.find({"_id": {"$in": list(order_ids)}}, projection):
+            order.setdefault("file_id", None)
+            orders[order["_id"]] = order
+
     for user in users:
-        # Convert ObjectId to string
-        user["_id"] = str(user["_id"])
-        user["orderId"] = str(user["orderId"]) if "orderId" in user and user["orderId"] else None
-        
-        # Handle order retrieval
-        order_id = user.get("orderId")
-        order_object_id = ObjectId(order_id) if order_id and ObjectId.is_valid(order_id) else None
-        
-        # Fetch the order if valid orderId exists
-        if order_object_id:
-            order = await db.orders.find_one({"_id": order_object_id})
-            if order:
-                # Convert ObjectId fields in order to strings
-                order["_id"] = str(order["_id"])
-                order["file_id"] = str(order["file_id"]) if "file_id" in order else None
-                user["order"] = order
-            else:
-                user["order"] = {}
-        else:
-            user["order"] = {}
-
-    return jsonable_encoder({"success": True, "users": users})
-
-
-
-async def get_one_user(db, user_id):
-    """Fetch a single user along with their order details"""
-    # Fetch the user from the database
-    user = await db.users.find_one({"_id": ObjectId(user_id)})
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
+        user["orderId"] = user.get("orderId") or None
+        user["order"] = orders.get(_order_object_id(user["orderId"]), {})
+
+    return users
 
-    # Convert ObjectId fields in user to strings
-    user["_id"] = str(user["_id"])
-    user["orderId"] = str(user["orderId"]) if "orderId" in user else None
 
-    # Extract and validate orderId
-    order_id = user.get("orderId")
-    order_object_id = ObjectId(order_id) if order_id and ObjectId.is_valid(order_id) else None
+async def get_all_users(db, limit=USERS_PAGE_SIZE, cursor=None, detailed=False):
+    """
+    Fetch one page of users, oldest first, along with their order details.
+    Pass next_cursor back as `cursor` for the following page.
+    """
+    query = {}
+    if cursor:
+        if not ObjectId.is_valid(cursor):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        query["_id"] = {"$gt": ObjectId(cursor)}
 
-    # Fetch the order if a valid order ID exists
-    order = await db.orders.find_one({"_id": order_object_id}) if order_object_id else None
+    limit = max(1, min(limit, USERS_MAX_PAGE_SIZE))
+    users = await db.users.find(query).sort("_id", 1).limit(limit + 1).to_list(limit + 1)
+    next_cursor = str(users[limit - 1]["_id"]) if len(users) > limit else None
 
-    # Convert all ObjectId fields in the order to strings
-    if order:
-        order["_id"] = str(order["_id"])
-        order["file_id"] = str(order["file_id"]) if "file_id" in order else None
+    users = await _attach_orders(db, users[:limit], detailed)
+    return BSONResponse({"success": True, "users": users, "next_cursor": next_cursor})
 
-    user["order"] = order if order else {}
 
-    return jsonable_encoder({"success": True, "user": user})
+async def get_one_user(db, user_id, detailed=True):
+    """Fetch a single user along with their order details"""
+    # Fetch the user from the database
+    user = await db.users.find_one({"_id": ObjectId(user_id)})
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+
+    user, = await _attach_orders(db, [user], detailed)
+    return BSONResponse({"success": True, "user": user})